@@ -0,0 +1,342 @@
+# bench_offer_pipeline.py
+# 报价生成与提交热点路径的基准测试套件 - 合成数据生成、分规模计时、结果保存为 JSON 并与基线对比
+
+import os, sys, json, time, random, argparse, platform, tempfile, subprocess
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import compose_offer_robust as compose
+import offer_columnar
+import offer_ledger
+import offer_metrics
+import offer_output
+import offer_rules
+from compose_offer_robust import AEST
+
+DEFAULT_SIZES = (1, 1000, 100000)
+CONFIG_POOL_SIZE = 5000       # 不同配置的数量；更大规模循环复用，内存保持有界
+YAML_POOL_SIZE = 2000
+FILE_POOL_SIZE = 400          # 每种编码写出的样本文件数
+FILE_ENCODINGS = ("utf-8", "utf-8-sig", "utf-16", "utf-16-le")   # utf-16 带 BOM，utf-16-le 不带
+REGRESSION_THRESHOLD = 0.10
+MIN_COMPARE_SECONDS = 0.005   # 总耗时低于此值的结果受噪声主导，只显示不判定回归
+
+FIRST_NAMES = ["Li", "Wei", "Anh", "Priya", "Sofia", "Kenji", "Ama", "José", "Zoë", "Mohammed", "王芳", "Ngọc"]
+LAST_NAMES = ["Wang", "Nguyen", "Sharma", "García", "Tanaka", "Mensah", "Müller", "Smith", "李", "O'Brien"]
+COUNTRIES = ["China", "china", "PRC", "Vietnam", "Viet Nam", "India", "Nepal", "Colombia", "Japan", "Chnia"]
+NATIONALITIES = ["Chinese", "chinese", "Vietnamese", "Indian", "Nepalese", "Colombian", "Japanese"]
+LANGUAGES = ["中文", "Mandarin", "zh-CN", "Vietnamese", "Hindi", "Spanish", ""]
+COURSES = ["CPC50220", "BSB50120", "BSB60120", "CPC40120", "SIT50422"]
+GENDERS = ["male", "female", "M", "F", "woman", "X", ""]
+
+# ---------------- 合成数据 ----------------
+
+def legacy_to_iso8601(val: Any, allow_date_only: bool = True, default_future_days: int = 30) -> str:
+    """重构前的异常驱动实现，仅作为对比基线"""
+    if isinstance(val, (int, float)):
+        try:
+            dt = datetime.fromtimestamp(val, tz=AEST)
+            return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+10:00"
+        except Exception:
+            pass
+    if isinstance(val, str) and val.strip():
+        s = val.strip()
+        try:
+            dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=AEST)
+            return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+10:00"
+        except Exception:
+            pass
+        for fmt in ("%d/%m/%Y", "%Y-%m-%d"):
+            try:
+                d = datetime.strptime(s, fmt).replace(tzinfo=AEST)
+                if allow_date_only:
+                    return d.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+10:00"
+            except Exception:
+                continue
+    d = datetime.now(tz=AEST) + timedelta(days=default_future_days)
+    return d.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+10:00"
+
+def mixed_date_values(n: int, distinct: int = 500, seed: int = 42) -> List[Any]:
+    """生成混合格式的日期值：ISO 日期、日/月/年、带时区的时间戳、数值时间戳"""
+    rng = random.Random(seed)
+    pool: List[Any] = []
+    for _ in range(distinct):
+        d = datetime(1960, 1, 1) + timedelta(days=rng.randint(0, 30000), seconds=rng.randint(0, 86399))
+        pool.append(rng.choice([
+            d.strftime("%Y-%m-%d"),
+            d.strftime("%d/%m/%Y"),
+            d.strftime("%Y-%m-%dT%H:%M:%S") + "Z",
+            d.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+10:00",
+            int(d.replace(tzinfo=AEST).timestamp()),
+        ]))
+    return [rng.choice(pool) for _ in range(n)]
+
+def synthetic_config(rng: random.Random, i: int, dates: List[Any]) -> Dict[str, Any]:
+    """一份接近真实的申请配置：多门课程、较长的教育 / 工作经历、混合日期格式、非 ASCII 姓名"""
+    origin = rng.choice(["OverseasStudent", "OverseasStudentInAustralia", "ResidentStudent", "overseas"])
+    return {
+        "offer_id": f"OFFER_BENCH_{i:08d}",
+        "timestamp": rng.choice(dates),
+        "student_info": {
+            "title": rng.choice(["Mr", "Ms", "Miss", "Dr", "Prof"]),
+            "first_name": rng.choice(FIRST_NAMES), "last_name": rng.choice(LAST_NAMES),
+            "gender": rng.choice(GENDERS), "dob": rng.choice(dates),
+            "email": f"student{i}@example.com" if rng.random() > 0.02 else "not-an-email",
+            "student_origin": origin,
+        },
+        "compliance": {
+            "country_birth": rng.choice(COUNTRIES), "nationality": rng.choice(NATIONALITIES),
+            "passport_number": f"E{rng.randint(1000000, 9999999)}", "passport_expiry_date": rng.choice(dates),
+            "first_language": rng.choice(LANGUAGES), "visa_type": rng.choice(["student", "Tourist", "", "working holiday"]),
+            "visa_number": f"V{i}", "visa_expiry_date": rng.choice(dates),
+            "eng_test_type": rng.choice(["IELTS", "PTE", ""]), "eng_test_date": rng.choice(dates),
+            "eng_test_overall_score": rng.choice([6.5, 7, "58", ""]),
+        },
+        "addresses": [
+            {"address_type": rng.choice(["Current", "Permanent"]), "is_primary": rng.choice(["yes", True, 1, "no"]),
+             "street_number": str(rng.randint(1, 999)), "street_name": "Collins St", "postcode": rng.randint(3000, 3999)}
+            for _ in range(rng.randint(1, 2))
+        ],
+        "applied_courses": [
+            {"course_id": rng.choice(COURSES), "campus_id": str(rng.randint(1, 3)),
+             "intake_date": rng.choice(dates), "start_date": rng.choice(dates), "finish_date": rng.choice(dates),
+             "tuition_fee": rng.choice(["15000", 12500.5, "", "n/a"]), "enrolment_fee": 250}
+            for _ in range(rng.randint(1, 4))
+        ],
+        "education_history": [
+            {"qualification_name": "High School Certificate", "institute_name": f"School {k}",
+             "year_completed": str(rng.randint(2000, 2023))}
+            for k in range(rng.randint(0, 6))
+        ],
+        "employment_history": [
+            {"employer_name": f"Employer {k}", "job_title": "Assistant",
+             "from_date": rng.choice(dates), "to_date": rng.choice(dates)}
+            for k in range(rng.randint(0, 10))
+        ],
+        "emergency_contact": {"contact_name": rng.choice(FIRST_NAMES), "phone": "+61 3 9000 0000"},
+        "leads_marketing": {"know_from": rng.choice(["Agent", "Web", "Friend"])},
+    }
+
+def config_pool(size: int, seed: int = 42) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    dates = mixed_date_values(400, distinct=400, seed=seed)
+    return [synthetic_config(rng, i, dates) for i in range(size)]
+
+def cycle(pool: List[Any], n: int) -> List[Any]:
+    """把样本池循环扩展到 n 条（只复制引用）"""
+    return [pool[i % len(pool)] for i in range(n)]
+
+def config_yaml(config: Dict[str, Any]) -> str:
+    return compose._load_yaml().safe_dump(config, allow_unicode=True, sort_keys=False)
+
+def write_sample_files(directory: str, configs: List[Dict[str, Any]]) -> List[str]:
+    """按多种编码写出 YAML 样本文件（UTF-8、UTF-8 BOM、UTF-16 带 / 不带 BOM）"""
+    paths = []
+    for i, config in enumerate(configs):
+        encoding = FILE_ENCODINGS[i % len(FILE_ENCODINGS)]
+        path = os.path.join(directory, f"offer_{i:05d}.{encoding}.yaml")
+        with open(path, "w", encoding=encoding, newline="\n") as f:
+            f.write(config_yaml(config))
+        paths.append(path)
+    return paths
+
+# ---------------- 计时 ----------------
+
+def time_call(fn: Callable[[Any], Any], values: List[Any], repeat: int = 3) -> float:
+    """返回多次运行中最快一次的耗时（秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for v in values:
+            fn(v)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def clear_caches():
+    """每个基准开始前清空日期缓存"""
+    compose.normalize_date_text.cache_clear()
+    compose._timestamp_text.cache_clear()
+
+class Suite:
+    """惰性准备的样本池；case() 返回 (被测函数, 输入列表)"""
+
+    def __init__(self, workdir: str):
+        self.workdir = workdir
+        self._configs: Optional[List[Dict[str, Any]]] = None
+        self._yaml: Optional[List[str]] = None
+        self._files: Optional[List[str]] = None
+        self._offers: Optional[List[Dict[str, Any]]] = None
+
+    @property
+    def configs(self) -> List[Dict[str, Any]]:
+        if self._configs is None:
+            self._configs = config_pool(CONFIG_POOL_SIZE)
+        return self._configs
+
+    @property
+    def yaml_texts(self) -> List[str]:
+        if self._yaml is None:
+            self._yaml = [config_yaml(c) for c in self.configs[:YAML_POOL_SIZE]]
+        return self._yaml
+
+    @property
+    def files(self) -> List[str]:
+        if self._files is None:
+            self._files = write_sample_files(self.workdir, self.configs[:FILE_POOL_SIZE * len(FILE_ENCODINGS)])
+        return self._files
+
+    @property
+    def offers(self) -> List[Dict[str, Any]]:
+        if self._offers is None:
+            self._offers = [compose.coerce_student_offer_from_config(c)[0] for c in self.configs]
+        return self._offers
+
+    def case(self, name: str, n: int) -> Tuple[Callable[[Any], Any], List[Any]]:
+        if name == "to_iso8601":
+            return compose.to_iso8601, mixed_date_values(n)
+        if name == "robust_file_reader":
+            return compose.robust_file_reader, cycle(self.files, n)
+        if name == "load_yaml_content":
+            return compose.load_yaml_content, cycle(self.yaml_texts, n)
+        if name == "coerce_student_offer_from_config":
+            return compose.coerce_student_offer_from_config, cycle(self.configs, n)
+        if name == "coerce_configs_columnar":
+            # 按批量模式的块大小切分；每条耗时仍按记录数计算
+            configs, size = cycle(self.configs, n), compose.COLUMNAR_CHUNK_SIZE
+            return offer_columnar.coerce_configs, [configs[i:i + size] for i in range(0, n, size)]
+        if name == "serialize_pretty":
+            return lambda o: offer_output.dumps(o, pretty=True), cycle(self.offers, n)
+        if name == "serialize_compact":
+            return offer_output.dumps, cycle(self.offers, n)
+        if name == "serialize_stdlib_indent":
+            return lambda o: json.dumps(o, ensure_ascii=False, indent=2), cycle(self.offers, n)
+        if name == "validate_offer":
+            return offer_rules.validate_offer, cycle(self.offers, n)
+        if name == "offer_hash":
+            return offer_ledger.offer_hash, cycle(self.offers, n)
+        raise KeyError(name)
+
+BENCHMARKS = ("to_iso8601", "robust_file_reader", "load_yaml_content", "coerce_student_offer_from_config",
+              "coerce_configs_columnar", "serialize_pretty", "serialize_compact", "serialize_stdlib_indent",
+              "validate_offer", "offer_hash")
+
+def run_suite(sizes, names, repeat: int, workdir: str) -> Dict[str, Dict[str, Any]]:
+    suite = Suite(workdir)
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in names:
+        results[name] = {}
+        for n in sizes:
+            fn, values = suite.case(name, n)
+            clear_caches()
+            # 大规模只跑一次，避免整套基准耗时过长
+            elapsed = time_call(fn, values, repeat=repeat if n <= 1000 else 1)
+            results[name][str(n)] = {
+                "records": n,
+                "seconds": elapsed,
+                "per_record_us": elapsed / n * 1e6,
+                "records_per_s": n / elapsed if elapsed else None,
+            }
+            print(f"{name:<34} n={n:<7} {elapsed * 1000:>10.2f} ms  {elapsed / n * 1e6:>9.2f} us/record", flush=True)
+    return results
+
+def bench_dates(n: int) -> Dict[str, Any]:
+    """与重构前实现对比：输出一致性与加速比"""
+    values = mixed_date_values(n)
+    mismatches = sum(1 for v in values if legacy_to_iso8601(v) != compose.to_iso8601(v))
+
+    legacy = time_call(legacy_to_iso8601, values)
+    clear_caches()
+    cold = time_call(compose.to_iso8601, values, repeat=1)
+    warm = time_call(compose.to_iso8601, values)
+    return {
+        "records": n,
+        "legacy_s": legacy,
+        "cold_s": cold,
+        "warm_s": warm,
+        "speedup_cold": legacy / cold if cold else None,
+        "speedup_warm": legacy / warm if warm else None,
+        "mismatches": mismatches,
+    }
+
+# ---------------- 保存与对比 ----------------
+
+def environment() -> Dict[str, Any]:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        rev = ""
+    return {
+        "timestamp": datetime.now(tz=AEST).isoformat(timespec="seconds"),
+        "git_rev": rev,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "libyaml": compose._load_yaml() is not None and compose.YAML_LOADER.__name__.startswith("C"),
+        "orjson": offer_output.orjson is not None,
+    }
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """逐项比较每条记录的耗时；变慢超过阈值的项目作为回归返回"""
+    regressions = []
+    print(f"\n{'benchmark':<34} {'n':>7} {'base us':>10} {'now us':>10} {'change':>8}")
+    for name, sizes in current["results"].items():
+        for n, now in sizes.items():
+            base = baseline.get("results", {}).get(name, {}).get(n)
+            if not base:
+                continue
+            change = now["per_record_us"] / base["per_record_us"] - 1 if base["per_record_us"] else 0.0
+            if min(base["seconds"], now["seconds"]) < MIN_COMPARE_SECONDS:
+                flag = "  (noise)" if change > threshold else ""
+            else:
+                flag = "  REGRESSION" if change > threshold else ""
+            print(f"{name:<34} {n:>7} {base['per_record_us']:>10.2f} {now['per_record_us']:>10.2f} {change:>+7.1%}{flag}")
+            if flag == "  REGRESSION":
+                regressions.append(f"{name} n={n}: {change:+.1%}")
+    return regressions
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark suite for the offer compose pipeline")
+    p.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Comma-separated record counts")
+    p.add_argument("--only", nargs="+", choices=BENCHMARKS, help="Run only these benchmarks")
+    p.add_argument("--repeat", type=int, default=3, help="Runs per benchmark for sizes <= 1000 (best is kept)")
+    p.add_argument("--save", help="Write results JSON to this path")
+    p.add_argument("--compare", metavar="BASELINE", help="Compare against a saved results JSON; exit 1 on regression")
+    p.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                   help="Per-record slowdown (fraction) reported as a regression")
+    p.add_argument("--legacy-dates", type=int, metavar="N", help="Also compare to_iso8601 with the pre-refactor version")
+    args = p.parse_args()
+
+    # 基准期间关闭事件输出（robust_file_reader 等会逐个文件打印）
+    offer_metrics.configure(level="off")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    with tempfile.TemporaryDirectory(prefix="offer-bench-") as workdir:
+        results = run_suite(sizes, args.only or BENCHMARKS, max(1, args.repeat), workdir)
+    current = {"environment": environment(), "results": results}
+
+    if args.legacy_dates:
+        r = bench_dates(args.legacy_dates)
+        current["legacy_dates"] = r
+        print(f"\nto_iso8601 x {r['records']}: legacy {r['legacy_s']*1000:.1f} ms, "
+              f"cold {r['cold_s']*1000:.1f} ms ({r['speedup_cold']:.1f}x), "
+              f"warm {r['warm_s']*1000:.1f} ms ({r['speedup_warm']:.1f}x), "
+              f"mismatches {r['mismatches']}")
+
+    if args.save:
+        offer_output.write_json(args.save, current)
+        print(f"\nResults written to {os.path.abspath(args.save)}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"\n[WARN] {len(regressions)} regression(s) above {args.threshold:.0%}:")
+            for r in regressions:
+                print(f" - {r}")
+            sys.exit(1)
+        print("\n[INFO] No regressions")
+
+if __name__ == "__main__":
+    main()
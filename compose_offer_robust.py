@@ -1,19 +1,50 @@
 # compose_offer_robust.py
 # 最强健的版本 - 解决所有可能的编码和格式问题
 
-import os, sys, json, argparse, re, base64, tempfile
+import os, sys, json, argparse, re, threading, codecs, time
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import Any, Dict, List, Tuple, Optional
 
-try:
-    import chardet
-except ImportError:
-    chardet = None
+# 冷启动：chardet、yaml、http.server、concurrent.futures、base64、csv 等只在用到它们的路径上导入，
+# 预算和检查见 import_budget.py
+_UNLOADED = object()
+chardet: Any = _UNLOADED
+yaml: Any = _UNLOADED
+YAML_LOADER = None
+
+def _load_chardet():
+    """chardet 导入要几十毫秒，只在 BOM / UTF-8 都判断不了编码时才加载；未安装时返回 None"""
+    global chardet
+    if chardet is _UNLOADED:
+        try:
+            import chardet as module
+        except ImportError:
+            module = None
+        chardet = module
+    return chardet
+
+def _load_yaml():
+    """首次解析 YAML 时加载 PyYAML；未安装时返回 None"""
+    global yaml, YAML_LOADER
+    if yaml is _UNLOADED:
+        try:
+            import yaml as module
+            # libyaml 可用时使用 C 实现的安全加载器，否则退回纯 Python 版本
+            YAML_LOADER = getattr(module, "CSafeLoader", module.SafeLoader)
+        except ImportError:
+            module = None
+        yaml = module
+    return yaml
 
 try:
-    import yaml
+    import country_reference
 except ImportError:
-    yaml = None
+    country_reference = None
+
+import offer_metrics as metrics
+import offer_profile
+from offer_output import OUTPUT_FORMATS, OfferWriter, dumps, format_for_path, is_stream_format, write_json
 
 # 重用原有的工具函数和常量
 EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
@@ -26,50 +57,124 @@ ALLOWED_ORIGINS = {"OverseasStudent", "OverseasStudentInAustralia", "ResidentStu
 def now_iso() -> str:
     return datetime.now(tz=AEST).isoformat(timespec="seconds")
 
-def to_iso8601(val: Any, allow_date_only: bool = True, default_future_days: int = 30) -> str:
-    if isinstance(val, (int, float)):
+# 由当前时间生成的值（默认的 TimeStamp / OfferId / 未来日期）-> (种类, 参数)；
+# 只在批量生成使用账本时记录，复用缓存的报价时据此找出并刷新这些字段
+_now_log: Optional[Dict[str, Tuple[str, int]]] = None
+
+def _log_now(text: str, kind: str, arg: int = 0) -> str:
+    if _now_log is not None:
+        _now_log[text] = (kind, arg)
+    return text
+
+def timestamp_now() -> str:
+    return _log_now(to_iso8601(now_iso()), "timestamp")
+
+def generated_offer_id() -> str:
+    return _log_now(f"OFFER_{datetime.now(tz=AEST).strftime('%Y%m%d_%H%M%S')}", "offer_id")
+
+# ---------------- 日期规范化引擎 ----------------
+# 常见格式先用预编译正则识别并直接格式化；其余格式交给原有的
+# fromisoformat / strptime 逻辑。结果按输入字符串缓存（LRU）。
+
+DATE_CACHE_SIZE = 4096
+DATE_ONLY_FORMATS = ("%d/%m/%Y", "%Y-%m-%d")
+ISO_DATETIME_RE = re.compile(
+    r"([0-9]{4})-([0-9]{2})-([0-9]{2})"
+    r"(?:[T ]([0-9]{2}):([0-9]{2})(?::([0-9]{2})(?:\.([0-9]{1,6}))?)?(Z|[+-]([0-9]{2}):([0-9]{2}))?)?"
+)
+DMY_RE = re.compile(r"([0-9]{1,2})/([0-9]{1,2})/([0-9]{4})")
+
+def format_aest(dt: datetime) -> str:
+    """统一的输出格式：毫秒精度 + 固定 +10:00 后缀"""
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+10:00"
+
+def _fast_date_text(s: str) -> Optional[Tuple[str, bool]]:
+    """正则快速路径；返回 (结果, 是否仅日期格式) 或 None 表示交给慢速路径"""
+    m = ISO_DATETIME_RE.fullmatch(s)
+    if m:
+        year, month, day, hour, minute, second, frac, tz, tz_h, tz_m = m.groups()
+        if year < "1000" or (tz_h is not None and (int(tz_h) > 23 or int(tz_m) > 59)):
+            return None
+        dt = datetime(int(year), int(month), int(day),
+                      int(hour or 0), int(minute or 0), int(second or 0))
+        ms = (frac or "").ljust(3, "0")[:3]
+        return (f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d}T"
+                f"{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}.{ms}+10:00", False)
+    m = DMY_RE.fullmatch(s)
+    if m:
+        day, month, year = m.groups()
+        if year < "1000":
+            return None
+        dt = datetime(int(year), int(month), int(day))
+        return f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d}T00:00:00.000+10:00", True
+    return None
+
+def _slow_date_text(s: str) -> Optional[Tuple[str, bool]]:
+    """原有的异常驱动解析，用于快速路径未覆盖的格式"""
+    try:
+        dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=AEST)
+        return format_aest(dt), False
+    except Exception:
+        pass
+    for fmt in DATE_ONLY_FORMATS:
         try:
-            dt = datetime.fromtimestamp(val, tz=AEST)
-            return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+10:00"
+            return format_aest(datetime.strptime(s, fmt).replace(tzinfo=AEST)), True
         except Exception:
-            pass
+            continue
+    return None
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def normalize_date_text(s: str) -> Optional[Tuple[str, bool]]:
+    """解析已 strip 的日期字符串；无法识别时返回 None"""
+    try:
+        parsed = _fast_date_text(s)
+    except ValueError:
+        parsed = None
+    return parsed or _slow_date_text(s)
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _timestamp_text(val: Any) -> Optional[str]:
+    try:
+        return format_aest(datetime.fromtimestamp(val, tz=AEST))
+    except Exception:
+        return None
+
+_FUTURE_TEXT: Dict[int, Tuple[datetime, str]] = {}
+
+def _future_date_text(days: int) -> str:
+    """now + days 的格式化结果；同一毫秒内复用上次的文本（输出只精确到毫秒）"""
+    dt = datetime.now(tz=AEST) + timedelta(days=days)
+    key = dt.replace(microsecond=dt.microsecond - dt.microsecond % 1000)
+    last = _FUTURE_TEXT.get(days)
+    if last is not None and last[0] == key:
+        return _log_now(last[1], "future", days)
+    text = format_aest(dt)
+    _FUTURE_TEXT[days] = (key, text)
+    return _log_now(text, "future", days)
+
+@lru_cache(maxsize=64)
+def _default_date_text(default_date: str) -> str:
+    return format_aest(datetime.strptime(default_date, "%Y-%m-%d").replace(tzinfo=AEST))
+
+def to_iso8601(val: Any, allow_date_only: bool = True, default_future_days: int = 30) -> str:
+    if isinstance(val, (int, float)):
+        text = _timestamp_text(val)
+        if text is not None:
+            return text
     if isinstance(val, str) and val.strip():
-        s = val.strip()
-        try:
-            dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=AEST)
-            return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+10:00"
-        except Exception:
-            pass
-        for fmt in ("%d/%m/%Y", "%Y-%m-%d"):
-            try:
-                d = datetime.strptime(s, fmt).replace(tzinfo=AEST)
-                if allow_date_only:
-                    return d.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+10:00"
-            except Exception:
-                continue
-    d = datetime.now(tz=AEST) + timedelta(days=default_future_days)
-    return d.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+10:00"
+        parsed = normalize_date_text(val.strip())
+        if parsed is not None and (allow_date_only or not parsed[1]):
+            return parsed[0]
+    return _future_date_text(default_future_days)
 
 def to_dateonly_iso(val: Any, default_date: str = "1990-01-01") -> str:
     if isinstance(val, str) and val.strip():
-        s = val.strip()
-        for fmt in ("%d/%m/%Y", "%Y-%m-%d"):
-            try:
-                d = datetime.strptime(s, fmt).replace(tzinfo=AEST)
-                return d.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+10:00"
-            except Exception:
-                pass
-        try:
-            dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
-            if dt.tzinfo is None:
-                dt = dt.replace(tzinfo=AEST)
-            return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+10:00"
-        except Exception:
-            pass
-    d = datetime.strptime(default_date, "%Y-%m-%d").replace(tzinfo=AEST)
-    return d.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+10:00"
+        parsed = normalize_date_text(val.strip())
+        if parsed is not None:
+            return parsed[0]
+    return _default_date_text(default_date)
 
 def is_truthy(v: Any) -> bool:
     if isinstance(v, bool): return v
@@ -104,114 +209,482 @@ def normalize_language(s: Optional[str]) -> str:
     if t in chinese_synonyms: return "Mandarin"
     return s.strip()
 
+def fix_yaml_line(line: str) -> str:
+    """修复单行；逐行独立处理，因此也可用于流式输入"""
+    # 去除开头的空白字符，但保留有意义的缩进
+    if line.strip():
+        # 计算原始缩进
+        stripped = line.lstrip()
+        if stripped.endswith(':') and not line.startswith('  '):
+            # 这是一个顶级键，不应该有缩进
+            return stripped
+        # 保留相对缩进
+        return line
+    # 保留空行
+    return ''
+
 def detect_and_fix_yaml_content(content: str) -> str:
     """检测并修复常见的 YAML 格式问题"""
-    lines = content.splitlines()
-    fixed_lines = []
+    with metrics.stage("fix_yaml") as st:
+        st.add_bytes(len(content))
+        lines = content.splitlines()
+        fixed_lines = []
 
-    for line in lines:
-        # 去除开头的空白字符，但保留有意义的缩进
-        if line.strip():
-            # 计算原始缩进
-            stripped = line.lstrip()
-            if stripped.endswith(':') and not line.startswith('  '):
-                # 这是一个顶级键，不应该有缩进
-                fixed_lines.append(stripped)
-            else:
-                # 保留相对缩进
-                fixed_lines.append(line)
-        else:
-            # 保留空行
-            fixed_lines.append('')
+        for line in lines:
+            fixed_lines.append(fix_yaml_line(line))
 
-    result = '\n'.join(fixed_lines)
-    print(f"[INFO] YAML content fixed. Original lines: {len(lines)}, Fixed lines: {len(fixed_lines)}")
+        result = '\n'.join(fixed_lines)
+    metrics.info(f"YAML content fixed. Original lines: {len(lines)}, Fixed lines: {len(fixed_lines)}",
+                 original_lines=len(lines), fixed_lines=len(fixed_lines))
     return result
 
-def robust_file_reader(file_path: str) -> str:
-    """强健的文件读取器 - 处理编码和格式问题"""
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"File not found: {file_path}")
+# 编码探测只看文件开头的样本；超过阈值的文件使用内存映射读取
+DETECTION_SAMPLE_SIZE = 64 * 1024
+MMAP_THRESHOLD = 1024 * 1024
+FALLBACK_ENCODINGS = ['utf-8', 'utf-16', 'utf-16-le', 'utf-16-be', 'ascii', 'latin-1', 'cp1252']
+# UTF-32 的 BOM 以 UTF-16 LE 的 BOM 开头，必须先检查
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+MEANINGFUL_CHAR_RE = re.compile(r"[^\x00\s]")
 
-    # 1. 尝试检测编码
-    encodings_to_try = ['utf-8', 'utf-16', 'utf-16-le', 'utf-16-be', 'ascii', 'latin-1', 'cp1252']
+def sniff_encodings(sample: bytes) -> List[str]:
+    """根据 BOM、空字节分布和 chardet（仅对样本）给出按优先级排序的候选编码"""
+    candidates: List[str] = []
+    for bom, encoding in BOM_ENCODINGS:
+        if sample.startswith(bom):
+            metrics.info(f"Detected BOM: {encoding}", encoding=encoding)
+            candidates.append(encoding)
+            break
+    else:
+        if b"\x00" in sample:
+            # 无 BOM 的 UTF-16：ASCII 字符的高位字节为 0
+            even_nulls, odd_nulls = sample[0::2].count(0), sample[1::2].count(0)
+            if odd_nulls > even_nulls:
+                candidates.append('utf-16-le')
+            elif even_nulls > odd_nulls:
+                candidates.append('utf-16-be')
+        else:
+            try:
+                # 增量解码器允许样本末尾截断在多字节字符中间
+                codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+                candidates.append('utf-8')
+            except UnicodeDecodeError:
+                pass
 
-    if chardet:
-        try:
-            with open(file_path, 'rb') as f:
-                raw_data = f.read()
-            detected = chardet.detect(raw_data)
-            if detected['encoding'] and detected['confidence'] > 0.5:
-                encodings_to_try.insert(0, detected['encoding'])
-                print(f"[INFO] Detected encoding: {detected['encoding']} (confidence: {detected['confidence']:.2f})")
-        except Exception as e:
-            print(f"[WARN] Encoding detection failed: {e}")
+        if not candidates and _load_chardet():
+            try:
+                detected = chardet.detect(sample)
+                if detected['encoding'] and detected['confidence'] > 0.5:
+                    candidates.append(detected['encoding'])
+                    metrics.info(f"Detected encoding: {detected['encoding']} (confidence: {detected['confidence']:.2f})",
+                                 encoding=detected['encoding'], confidence=detected['confidence'])
+            except Exception as e:
+                metrics.warn(f"Encoding detection failed: {e}")
 
-    # 2. 尝试读取文件
-    for encoding in encodings_to_try:
+    ordered, seen = [], set()
+    for encoding in candidates + FALLBACK_ENCODINGS:
         try:
-            with open(file_path, 'r', encoding=encoding) as f:
-                content = f.read()
-
-            # 检查内容是否正常（不全是null字符）
-            if content.replace('\x00', '').replace('\r', '').replace('\n', '').strip():
-                print(f"[SUCCESS] Successfully read file with encoding: {encoding}")
-
-                # 3. 修复常见的格式问题
-                fixed_content = detect_and_fix_yaml_content(content)
-                return fixed_content
-            else:
-                print(f"[WARN] File content appears corrupted with encoding: {encoding}")
-                continue
+            key = codecs.lookup(encoding).name
+        except LookupError:
+            continue
+        if key not in seen:
+            seen.add(key)
+            ordered.append(encoding)
+    return ordered
 
-        except UnicodeDecodeError as e:
-            print(f"[WARN] Failed to read with encoding {encoding}: {e}")
+def decode_with_fallback(data, label: str = "<buffer>") -> str:
+    """对内存中的字节只读一次，依次尝试候选编码解码"""
+    for encoding in sniff_encodings(bytes(data[:DETECTION_SAMPLE_SIZE])):
+        try:
+            content = str(data, encoding)
+        except (UnicodeDecodeError, UnicodeError) as e:
+            metrics.warn(f"Failed to read with encoding {encoding}: {e}", encoding=encoding)
             continue
         except Exception as e:
-            print(f"[WARN] Unexpected error with encoding {encoding}: {e}")
+            metrics.warn(f"Unexpected error with encoding {encoding}: {e}", encoding=encoding)
             continue
 
-    raise ValueError(f"Unable to read file {file_path} with any supported encoding")
+        # 检查内容是否正常（不全是null字符）
+        if MEANINGFUL_CHAR_RE.search(content):
+            metrics.success(f"Successfully read file with encoding: {encoding}", encoding=encoding)
+            return content
+        metrics.warn(f"File content appears corrupted with encoding: {encoding}", encoding=encoding)
+
+    raise ValueError(f"Unable to read file {label} with any supported encoding")
+
+def robust_file_reader(file_path: str) -> str:
+    """强健的文件读取器 - 处理编码和格式问题"""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+
+    with metrics.stage("read_file") as st, open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        st.add_bytes(size)
+        if size >= MMAP_THRESHOLD:
+            import mmap
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                content = decode_with_fallback(data, file_path)
+        else:
+            content = decode_with_fallback(f.read(), file_path)
+
+    # 修复常见的格式问题
+    return detect_and_fix_yaml_content(content)
 
 def load_yaml_content(yaml_content: str) -> Dict[str, Any]:
     """从 YAML 字符串加载配置"""
-    if yaml is None:
+    if _load_yaml() is None:
         raise ImportError("PyYAML not installed. Run: pip install pyyaml")
 
     try:
-        return yaml.safe_load(yaml_content)
+        with metrics.stage("yaml_load") as st:
+            st.add_bytes(len(yaml_content))
+            return yaml.load(yaml_content, Loader=YAML_LOADER)
     except Exception as e:
-        print(f"[ERROR] YAML parsing failed. Content preview:")
-        lines = yaml_content.split('\n')[:10]
-        for i, line in enumerate(lines, 1):
-            print(f"  {i:2d}: {repr(line)}")
+        preview = yaml_content.split('\n')[:10]
+        metrics.error("YAML parsing failed. Content preview:\n" +
+                      "\n".join(f"  {i:2d}: {repr(line)}" for i, line in enumerate(preview, 1)),
+                      error=str(e))
         raise ValueError(f"Failed to parse YAML content: {e}")
 
-def coerce_student_offer_from_yaml_content(yaml_content: str) -> Tuple[Dict[str, Any], List[str]]:
-    """从 YAML 内容创建学生报价"""
+def coerce_student_offer_from_yaml_content(yaml_content: str,
+                                           source: Optional[str] = None) -> Tuple[Dict[str, Any], List[str]]:
+    """从 YAML 内容创建学生报价；内容必须是字段映射。指定 source 时缺少的 offer_id 由来源和内容生成"""
     config = load_yaml_content(yaml_content)
-    return coerce_student_offer_from_config(config)
+    if config is None:
+        raise ValueError("YAML content is empty")
+    if not isinstance(config, dict):
+        raise ValueError(f"YAML content must be a mapping of offer fields, got {type(config).__name__}")
+    if source:
+        with_offer_id(config, source)
+    with metrics.stage("coerce"):
+        return coerce_student_offer_from_config(config)
+
+class FixedLineStream:
+    """把逐行修复后的文本包装成可供 yaml 分块读取的流，不需要先读入全部内容"""
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        parts = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            fixed = fix_yaml_line(line.rstrip("\r\n")) + "\n"
+            parts.append(fixed)
+            length += len(fixed)
+        data = "".join(parts)
+        if size < 0:
+            self._buffer = ""
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+def iter_yaml_configs(stream, source: str = "stream") -> Any:
+    """用 load_all 惰性解析 '---' 分隔的多文档 YAML，每次只产出一个配置；跳过空文档。
+    没有 offer_id 的文档按 source 和文档序号生成编号"""
+    if _load_yaml() is None:
+        raise ImportError("PyYAML not installed. Run: pip install pyyaml")
+    documents = yaml.load_all(stream, Loader=YAML_LOADER)
+    index = 0
+    while True:
+        index += 1
+        try:
+            with metrics.stage("yaml_load"):
+                config = next(documents, _MISSING)
+        except yaml.YAMLError as e:
+            raise ValueError(f"Failed to parse YAML document {index}: {e}")
+        if config is _MISSING:
+            return
+        if config is not None:
+            yield with_offer_id(config, f"{source}#{index}")
+
+def iter_offers_from_yaml_stream(stream, source: str = "stream") -> Any:
+    """逐个文档生成 (报价, 问题列表)"""
+    for config in iter_yaml_configs(stream, source):
+        with metrics.stage("coerce"):
+            result = coerce_student_offer_from_config(config)
+        yield result
+
+# ---------------- 字段映射规格 ----------------
+# 每个字段：(目标键, 源键, 转换函数, 默认值, 模式)
+#   转换函数可以是 None、函数，或 (函数, 额外参数...)
+#   模式 None     -> 转换(src.get(源键, 默认值))
+#   模式 IF_SET   -> 源值为空时输出 ''，否则 转换(源值)
+#   模式 OR_NONE  -> 转换(源值 or None)，空值走转换函数自身的默认逻辑
+# 规格在导入时编译为每个实体一个构建函数；纯函数转换的默认结果预先计算。
+
+IF_SET = "if_set"
+OR_NONE = "or_none"
+
+def _to_float(x, dv=0.0):
+    if x is None or x == "":
+        return float(dv)
+    try:
+        return float(x)
+    except:
+        return float(dv)
+
+def _to_int(x, dv=1):
+    if x is None or x == "":
+        return int(dv)
+    try:
+        return int(x)
+    except:
+        return int(dv)
+
+PURE_COERCERS = {normalize_gender, normalize_language, normalize_visa_type, to_dateonly_iso, is_truthy, _to_float, _to_int}
+
+STUDENT_FIELDS = [
+    ("Title", "title", None, "Mr", None),
+    ("FirstName", "first_name", None, "First", None),
+    ("MiddleName", "middle_name", None, "", None),
+    ("LastName", "last_name", None, "Last", None),
+    ("Gender", "gender", normalize_gender, "M", None),
+    ("DoB", "dob", to_dateonly_iso, "1990-01-01", None),
+    ("Email", "email", None, "student@example.com", None),
+    ("StudentOrigin", "student_origin", None, "OverseasStudent", None),
+]
+
+COMPLIANCE_FIELDS = [
+    ("CountryBirth", "country_birth", None, "China", None),
+    ("Nationality", "nationality", None, "Chinese", None),
+    ("PassportNumber", "passport_number", None, "", None),
+    ("PassportExpiryDate", "passport_expiry_date", to_iso8601, "", IF_SET),
+    ("FirstLanguage", "first_language", normalize_language, None, None),
+    ("HowWellEngSpeak", "how_well_eng_speak", None, "", None),
+    ("StudyReason", "study_reason", None, "", None),
+    ("CurrentEmployStatus", "current_employ_status", None, "", None),
+    ("IndustryEmployment", "industry_employment", None, "", None),
+    ("OccupationCode", "occupation_code", None, "", None),
+    ("USI", "usi", None, "", None),
+    ("IsAboriginal", "is_aboriginal", None, False, None),
+    ("IsTorresStraitIslander", "is_torres_strait_islander", None, False, None),
+    ("IsEngLanguageInClass", "is_eng_language_in_class", None, True, None),
+    ("EngTestType", "eng_test_type", None, "", None),
+    ("EngTestDate", "eng_test_date", to_iso8601, "", IF_SET),
+    ("EngTestListeningScore", "eng_test_listening_score", None, "", None),
+    ("EngTestReadingScore", "eng_test_reading_score", None, "", None),
+    ("EngTestWritingScore", "eng_test_writing_score", None, "", None),
+    ("EngTestSpeakingScore", "eng_test_speaking_score", None, "", None),
+    ("EngTestOverallScore", "eng_test_overall_score", None, "", None),
+    ("HighSchoolLevel", "high_school_level", None, "@@", None),
+    ("HighSchoolYearCompleted", "high_school_year_completed", None, 0, None),
+    ("IsStillAtHighSchool", "is_still_at_high_school", None, False, None),
+    ("SchoolType", "school_type", None, "", None),
+    ("IsDisabled", "is_disabled", None, False, None),
+    ("IsRequestHelpForDisabled", "is_request_help_for_disabled", None, False, None),
+]
+
+# 仅海外学生
+VISA_FIELDS = [
+    ("VisaType", "visa_type", normalize_visa_type, None, None),
+    ("VisaNumber", "visa_number", None, "", None),
+    ("VisaExpiryDate", "visa_expiry_date", to_iso8601, "", IF_SET),
+]
+
+ADDRESS_FIELDS = [
+    ("AddressType", "address_type", None, "Current", None),
+    ("IsPrimary", "is_primary", is_truthy, True, None),
+    ("BuildingName", "building_name", None, "", None),
+    ("FlatUnitDetail", "flat_unit_detail", None, "", None),
+    ("StreetNumber", "street_number", None, "1", None),
+    ("StreetName", "street_name", None, "Sample St", None),
+    ("Suburb", "suburb", None, "Melbourne", None),
+    ("State", "state", None, "VIC", None),
+    ("Postcode", "postcode", None, "3000", None),
+    ("Country", "country", None, "Australia", None),
+    ("Phone", "phone", None, "", None),
+    ("Fax", "fax", None, "", None),
+    ("Mobile", "mobile", None, "+61 4xx xxx xxx", None),
+]
+
+# 未提供任何地址时使用（注意 FlatUnitDetail 与逐字段默认值不同）
+DEFAULT_ADDRESS = {
+    "AddressType": "Current", "IsPrimary": True,
+    "BuildingName": "", "FlatUnitDetail": "Unit 1", "StreetNumber": "1",
+    "StreetName": "Sample St", "Suburb": "Melbourne", "State": "VIC",
+    "Postcode": "3000", "Country": "Australia", "Phone": "",
+    "Fax": "", "Mobile": "+61 4xx xxx xxx"
+}
+
+COURSE_FIELDS = [
+    ("CourseId", "course_id", None, "CPC50220", None),
+    ("CampusId", "campus_id", (_to_int, 1), 1, None),
+    ("IntakeDate", "intake_date", to_iso8601, None, OR_NONE),
+    ("StartDate", "start_date", to_iso8601, None, OR_NONE),
+    ("FinishDate", "finish_date", to_iso8601, None, OR_NONE),
+    ("ELICOS_NumOfWeeks", "elicos_num_of_weeks", (_to_int, 0), 0, None),
+    ("TuitionFee", "tuition_fee", (_to_float, 12000.0), 12000.0, None),
+    ("EnrolmentFee", "enrolment_fee", (_to_float, 250.0), 250.0, None),
+    ("MaterialFee", "material_fee", (_to_float, 300.0), 300.0, None),
+    ("UpfrontFee", "upfront_fee", (_to_float, 500.0), 500.0, None),
+    ("SpecialCondition", "special_condition", None, "", None),
+    ("ApplicationRequest", "application_request", None, "Direct apply", None),
+    ("Status", "status", None, "", None),
+]
+
+DISABILITY_FIELDS = [
+    ("DisabilityCode", "disability_code", None, "", None),
+    ("DisabilityName", "disability_name", None, "", None),
+    ("OtherValue", "other_value", None, "", None),
+]
+
+EDUCATION_FIELDS = [
+    ("QualificationName", "qualification_name", None, "", None),
+    ("InstituteName", "institute_name", None, "", None),
+    ("InstituteLocation", "institute_location", None, "", None),
+    ("YearCompleted", "year_completed", (_to_int, 0), 0, None),
+    ("EducationLevelCode", "education_level_code", None, "", None),
+    ("AchievementRecognitionCode", "achievement_recognition_code", None, "", None),
+]
+
+EMPLOYMENT_FIELDS = [
+    ("EmployerName", "employer_name", None, "", None),
+    ("JobTitle", "job_title", None, "", None),
+    ("JobDescription", "job_description", None, "", None),
+    ("FromDate", "from_date", to_iso8601, "", None),
+    ("ToDate", "to_date", to_iso8601, "", None),
+]
+
+EMERGENCY_FIELDS = [
+    ("ContactType", "contact_type", None, "Emergency", None),
+    ("Relationship", "relationship", None, "Parent", None),
+    ("ContactName", "contact_name", None, "Wei Zhang", None),
+    ("Address", "address", None, "123 Collins St, Melbourne VIC 3000", None),
+    ("Phone", "phone", None, "+61 3 xxxx xxxx", None),
+    ("Email", "email", None, "parent@example.com", None),
+]
+
+LEADS_FIELDS = [
+    ("KnowFrom", "know_from", None, "Agent", None),
+    ("LeadSource", "lead_source", None, "Web", None),
+    ("CampaignName", "campaign_name", None, "Website", None),
+]
+
+_MISSING = object()
+FIELD_MEMO_SIZE = 4096   # 每个字段最多记住的不同字符串取值
+
+def _stable_date_text(v: str) -> bool:
+    """只有能解析的日期字符串结果才与当前时间无关，可以记忆"""
+    s = v.strip()
+    return bool(s) and normalize_date_text(s) is not None
+
+def _field_coercer(func, extra, default, memo):
+    """字段的慢路径：转换一个值，并在结果可复用时记入 memo"""
+    stable = _stable_date_text if func is to_iso8601 else None
+    missing = func(default, *extra) if func in PURE_COERCERS else _MISSING
+
+    def coerce(v):
+        if v is _MISSING:
+            return missing if missing is not _MISSING else func(default, *extra)
+        r = func(v, *extra)
+        if v.__class__ is str and len(memo) < FIELD_MEMO_SIZE and (stable is None or stable(v)):
+            memo[v] = r
+        return r
+    return coerce
+
+def compile_entity_builder(name: str, fields, with_offer_id: bool = True):
+    """把字段规格编译为 build(src, offer_id) -> dict 的函数（生成源码后 exec）
+
+    带转换函数的字段先查字符串取值的 memo，未命中才调用转换函数；
+    键缺失时直接使用预先计算好的默认结果。
+    """
+    ns: Dict[str, Any] = {"_MISSING": _MISSING}
+    lines = [f"def {name}(src, offer_id):", "    g = src.get", "    return {"]
+    if with_offer_id:
+        lines.append('        "OfferId": offer_id,')
+    for i, (target, source, coerce, default, mode) in enumerate(fields):
+        if coerce is None:
+            ns[f"d{i}"] = default
+            lines.append(f"        {target!r}: g({source!r}, d{i}),")
+            continue
+        func, extra = (coerce[0], coerce[1:]) if isinstance(coerce, tuple) else (coerce, ())
+        ns[f"m{i}"] = memo = {}
+        ns[f"f{i}"] = _field_coercer(func, extra, default, memo)
+        if mode == IF_SET:
+            fetch, wrap = "v", f"{{}} if (v := g({source!r})) else ''"
+        elif mode == OR_NONE:
+            fetch, wrap = f"(v := g({source!r}) or None)", "{}"
+        else:
+            fetch, wrap = f"(v := g({source!r}, _MISSING))", "{}"
+        lookup = f"(r if {fetch}.__class__ is str and (r := m{i}.get(v, _MISSING)) is not _MISSING else f{i}(v))"
+        expr = "(" + wrap.format(lookup) + ")"
+        lines.append(f"        {target!r}: {expr},")
+    lines.append("    }")
+    exec("\n".join(lines), ns)
+    return ns[name]
+
+build_student = compile_entity_builder("build_student", STUDENT_FIELDS, with_offer_id=False)
+build_compliance = compile_entity_builder("build_compliance", COMPLIANCE_FIELDS)
+build_visa = compile_entity_builder("build_visa", VISA_FIELDS, with_offer_id=False)
+build_address = compile_entity_builder("build_address", ADDRESS_FIELDS)
+build_course = compile_entity_builder("build_course", COURSE_FIELDS)
+build_disability = compile_entity_builder("build_disability", DISABILITY_FIELDS)
+build_education = compile_entity_builder("build_education", EDUCATION_FIELDS)
+build_employment = compile_entity_builder("build_employment", EMPLOYMENT_FIELDS)
+build_emergency = compile_entity_builder("build_emergency", EMERGENCY_FIELDS)
+build_leads = compile_entity_builder("build_leads", LEADS_FIELDS)
+
+# 报价中的列表实体：(报价键, 配置键, 字段规格, 构建函数)；列式批量路径（offer_columnar）按同一张表成批构建
+LIST_ENTITIES = [
+    ("Addresses", "addresses", ADDRESS_FIELDS, build_address),
+    ("AppliedCourses", "applied_courses", COURSE_FIELDS, build_course),
+    ("Disabilities", "disabilities", DISABILITY_FIELDS, build_disability),
+    ("EducationHistoryList", "education_history", EDUCATION_FIELDS, build_education),
+    ("EmploymentHistoryList", "employment_history", EMPLOYMENT_FIELDS, build_employment),
+]
+
+def config_offer_id(config: Dict[str, Any]) -> str:
+    return config.get('offer_id') or generated_offer_id()
+
+def derived_offer_id(config: Dict[str, Any], source: str) -> str:
+    """由来源（文件 / 流名加文档或行序号）和内容生成的稳定编号，写法与 CSV 行的编号相同"""
+    import hashlib
+    try:
+        text = json.dumps([source, config], sort_keys=True, ensure_ascii=False, default=str)
+    except TypeError:   # YAML 中键类型混杂时无法排序
+        text = json.dumps([source, config], ensure_ascii=False, default=str)
+    return f"OFFER_{hashlib.sha1(text.encode('utf-8')).hexdigest()[:12].upper()}"
+
+def with_offer_id(config: Any, source: str) -> Any:
+    """多记录输入（批量、JSONL、多文档 YAML）中没有 offer_id 的记录使用 derived_offer_id：
+    按秒生成的默认编号在同一批记录中会重复"""
+    if isinstance(config, dict) and not config.get('offer_id'):
+        config['offer_id'] = derived_offer_id(config, source)
+    return config
+
+def entity_rows(config: Dict[str, Any], key: str) -> List[Dict[str, Any]]:
+    return [e for e in config.get(key, []) if isinstance(e, dict)]
 
 def coerce_student_offer_from_config(config: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
     """从配置字典创建学生报价"""
+    offer_id = config_offer_id(config)
+    lists = {target: [build(e, offer_id) for e in entity_rows(config, source)]
+             for target, source, _, build in LIST_ENTITIES}
+    return assemble_offer(config, offer_id, lists)
+
+def assemble_offer(config: Dict[str, Any], offer_id: str,
+                   lists: Dict[str, List[Dict[str, Any]]]) -> Tuple[Dict[str, Any], List[str]]:
+    """用已构建的列表实体（键见 LIST_ENTITIES）组装报价并校验基本字段"""
     issues: List[str] = []
 
     # Extract student info
     student_info = config.get('student_info', {})
-    offer_id = config.get('offer_id') or f"OFFER_{datetime.now(tz=AEST).strftime('%Y%m%d_%H%M%S')}"
 
     offer: Dict[str, Any] = {
         "OfferId": offer_id,
-        "TimeStamp": to_iso8601(config.get('timestamp') or now_iso()),
-        "Title": student_info.get('title', 'Mr'),
-        "FirstName": student_info.get('first_name', 'First'),
-        "MiddleName": student_info.get('middle_name', ''),
-        "LastName": student_info.get('last_name', 'Last'),
-        "Gender": normalize_gender(student_info.get('gender', 'M')),
-        "DoB": to_dateonly_iso(student_info.get('dob', '1990-01-01')),
-        "Email": student_info.get('email', 'student@example.com'),
-        "StudentOrigin": student_info.get('student_origin', 'OverseasStudent'),
+        "TimeStamp": to_iso8601(config['timestamp']) if config.get('timestamp') else timestamp_now(),
     }
+    offer.update(build_student(student_info, offer_id))
 
     # Validate basic fields
     if offer["Title"] not in ALLOWED_TITLES:
@@ -227,206 +700,860 @@ def coerce_student_offer_from_config(config: Dict[str, Any]) -> Tuple[Dict[str,
 
     # Process compliance info
     compliance_config = config.get('compliance', {})
-    compliance = {
-        "OfferId": offer_id,
-        "CountryBirth": compliance_config.get('country_birth', 'China'),
-        "Nationality": compliance_config.get('nationality', 'Chinese'),
-        "PassportNumber": compliance_config.get('passport_number', ''),
-        "PassportExpiryDate": to_iso8601(compliance_config.get('passport_expiry_date', '')) if compliance_config.get('passport_expiry_date') else '',
-        "FirstLanguage": normalize_language(compliance_config.get('first_language')),
-        "HowWellEngSpeak": compliance_config.get('how_well_eng_speak', ''),
-        "StudyReason": compliance_config.get('study_reason', ''),
-        "CurrentEmployStatus": compliance_config.get('current_employ_status', ''),
-        "IndustryEmployment": compliance_config.get('industry_employment', ''),
-        "OccupationCode": compliance_config.get('occupation_code', ''),
-        "USI": compliance_config.get('usi', ''),
-        "IsAboriginal": compliance_config.get('is_aboriginal', False),
-        "IsTorresStraitIslander": compliance_config.get('is_torres_strait_islander', False),
-        "IsEngLanguageInClass": compliance_config.get('is_eng_language_in_class', True),
-        "EngTestType": compliance_config.get('eng_test_type', ''),
-        "EngTestDate": to_iso8601(compliance_config.get('eng_test_date', '')) if compliance_config.get('eng_test_date') else '',
-        "EngTestListeningScore": compliance_config.get('eng_test_listening_score', ''),
-        "EngTestReadingScore": compliance_config.get('eng_test_reading_score', ''),
-        "EngTestWritingScore": compliance_config.get('eng_test_writing_score', ''),
-        "EngTestSpeakingScore": compliance_config.get('eng_test_speaking_score', ''),
-        "EngTestOverallScore": compliance_config.get('eng_test_overall_score', ''),
-        "HighSchoolLevel": compliance_config.get('high_school_level', '@@'),
-        "HighSchoolYearCompleted": compliance_config.get('high_school_year_completed', 0),
-        "IsStillAtHighSchool": compliance_config.get('is_still_at_high_school', False),
-        "SchoolType": compliance_config.get('school_type', ''),
-        "IsDisabled": compliance_config.get('is_disabled', False),
-        "IsRequestHelpForDisabled": compliance_config.get('is_request_help_for_disabled', False)
-    }
+    compliance = build_compliance(compliance_config, offer_id)
+
+    # Normalize country / nationality against the portal's option lists；
+    # 只有完全匹配 / 别名才替换，近似匹配只作为提示，保留原值
+    if country_reference:
+        for field, normalize in (("CountryBirth", country_reference.normalize_country),
+                                 ("Nationality", country_reference.normalize_nationality)):
+            value = compliance[field]
+            if not isinstance(value, str) or not value.strip():
+                continue
+            try:
+                canonical, how = normalize(value)
+            except OSError:
+                break  # 参考数据文件缺失时保持原值
+            if canonical is None:
+                issues.append(f"{field} '{value}' not in portal list")
+            elif how == "fuzzy":
+                issues.append(f"{field} '{value}' not in portal list, did you mean '{canonical}'?")
+            elif canonical != value:
+                issues.append(f"{field} '{value}' -> '{canonical}' ({how})")
+                compliance[field] = canonical
 
     # Add visa info for overseas students
     if offer["StudentOrigin"].startswith("Overseas"):
-        compliance["VisaType"] = normalize_visa_type(compliance_config.get('visa_type'))
-        compliance["VisaNumber"] = compliance_config.get('visa_number', '')
-        compliance["VisaExpiryDate"] = to_iso8601(compliance_config.get('visa_expiry_date', '')) if compliance_config.get('visa_expiry_date') else ''
-
-    # Process addresses
-    addresses_config = config.get('addresses', [])
-    cleaned_addrs = []
-    for addr in addresses_config:
-        if isinstance(addr, dict):
-            addr_entry = {
-                "OfferId": offer_id,
-                "AddressType": addr.get('address_type', 'Current'),
-                "IsPrimary": is_truthy(addr.get('is_primary', True)),
-                "BuildingName": addr.get('building_name', ''),
-                "FlatUnitDetail": addr.get('flat_unit_detail', ''),
-                "StreetNumber": addr.get('street_number', '1'),
-                "StreetName": addr.get('street_name', 'Sample St'),
-                "Suburb": addr.get('suburb', 'Melbourne'),
-                "State": addr.get('state', 'VIC'),
-                "Postcode": addr.get('postcode', '3000'),
-                "Country": addr.get('country', 'Australia'),
-                "Phone": addr.get('phone', ''),
-                "Fax": addr.get('fax', ''),
-                "Mobile": addr.get('mobile', '+61 4xx xxx xxx')
-            }
-            cleaned_addrs.append(addr_entry)
-
-    if not cleaned_addrs:
-        cleaned_addrs = [{
-            "OfferId": offer_id, "AddressType": "Current", "IsPrimary": True,
-            "BuildingName": "", "FlatUnitDetail": "Unit 1", "StreetNumber": "1",
-            "StreetName": "Sample St", "Suburb": "Melbourne", "State": "VIC",
-            "Postcode": "3000", "Country": "Australia", "Phone": "",
-            "Fax": "", "Mobile": "+61 4xx xxx xxx"
-        }]
-
-    # Process courses
-    courses_config = config.get('applied_courses', [])
-    cleaned_courses = []
-
-    def _to_float(x, dv=0.0):
-        if x is None or x == "":
-            return float(dv)
+        compliance.update(build_visa(compliance_config, offer_id))
+
+    # Assemble final offer
+    offer["ComplianceAndOtherInfo"] = compliance
+    offer["Addresses"] = lists["Addresses"] or [{"OfferId": offer_id, **DEFAULT_ADDRESS}]
+    offer["AppliedCourses"] = lists["AppliedCourses"] or [build_course({}, offer_id)]
+    offer["Disabilities"] = lists["Disabilities"]
+    offer["EmergencyContact"] = build_emergency(config.get('emergency_contact', {}), offer_id)
+    offer["EducationHistoryList"] = lists["EducationHistoryList"]
+    offer["EmploymentHistoryList"] = lists["EmploymentHistoryList"]
+    offer["Leads_MarketingCampaign"] = build_leads(config.get('leads_marketing', {}), offer_id)
+
+    return offer, issues
+
+# ---------------- 批量模式 ----------------
+
+BATCH_EXTENSIONS = (".yaml", ".yml", ".json")
+DOC_SEPARATOR_RE = re.compile(r"^---(?:\s.*)?$", re.MULTILINE)
+BATCH_WINDOW_PER_WORKER = 4   # 每个工作进程最多排队的任务数，保证流式输入内存恒定
+CONFIG_KINDS = ("config", "json")   # CSV 行（已是配置字典）和 JSONL 行
+COLUMNAR_CHUNK_SIZE = 512   # 这两类条目按块交给列式路径（offer_columnar）
+
+def iter_yaml_documents(lines):
+    """按 '---' 分隔行惰性拆分多文档 YAML 文本，跳过空文档；每个文档交给工作进程单独解析，
+    因此某个文档格式错误不会影响其余文档"""
+    doc: List[str] = []
+    for line in lines:
+        if DOC_SEPARATOR_RE.fullmatch(line.rstrip("\r\n")):
+            text = "".join(doc)
+            if text.strip():
+                yield text
+            doc = []
+        else:
+            doc.append(line if line.endswith("\n") else line + "\n")
+    text = "".join(doc)
+    if text.strip():
+        yield text
+
+def _yaml_document_items(stem: str, lines, single_name: Optional[str] = None):
+    """把文档序列转换为批量条目；只有一个文档时使用 single_name（向前多看一个文档）"""
+    docs = iter_yaml_documents(lines)
+    first, second = next(docs, None), next(docs, None)
+    if first is None:
+        return
+    if second is None:
+        yield (single_name or f"{stem}_{1:05d}", "yaml", first)
+        return
+    yield (f"{stem}_{1:05d}", "yaml", first)
+    yield (f"{stem}_{2:05d}", "yaml", second)
+    for i, doc in enumerate(docs, 3):
+        yield (f"{stem}_{i:05d}", "yaml", doc)
+
+# ---------------- SharePoint CSV 导出 ----------------
+
+# "Long Course Student Application Data List.csv" 列名 -> (配置分区, 键)
+CSV_COLUMN_MAP = {
+    "First Name": ("student_info", "first_name"),
+    "Middle Name": ("student_info", "middle_name"),
+    "Family Name": ("student_info", "last_name"),
+    "Gender": ("student_info", "gender"),
+    "DOB": ("student_info", "dob"),
+    "Email": ("student_info", "email"),
+    "Country of Birth": ("compliance", "country_birth"),
+    "Nationality": ("compliance", "nationality"),
+    "Passport No.": ("compliance", "passport_number"),
+    "Expiry Date": ("compliance", "passport_expiry_date"),
+    "Visa Number": ("compliance", "visa_number"),
+    "Visa Expiry Date": ("compliance", "visa_expiry_date"),
+    "Language in Home": ("compliance", "first_language"),
+    "Country": ("address", "country"),
+    "Building/Property Name": ("address", "building_name"),
+    "Flat/Unit Details:": ("address", "flat_unit_detail"),
+    "Street Number": ("address", "street_number"),
+    "Street Name": ("address", "street_name"),
+    "City/Town/Suburb": ("address", "suburb"),
+    "State": ("address", "state"),
+    "Postcode": ("address", "postcode"),
+    "Home Phone": ("address", "phone"),
+    "Mobile Phone": ("address", "mobile"),
+    "Course": ("course", "course_id"),
+}
+COURSE_CODE_RE = re.compile(r"\b([A-Z]{3}[0-9]{5})\b")
+
+def csv_student_origin(value: str) -> Optional[str]:
+    """把 'Are you?' 列的自由文本映射到 StudentOrigin"""
+    t = value.strip().lower()
+    if not t:
+        return None
+    if "resident" in t or "citizen" in t:
+        return "ResidentStudent"
+    if "in australia" in t or "onshore" in t:
+        return "OverseasStudentInAustralia"
+    if "overseas" in t or "offshore" in t or "international" in t:
+        return "OverseasStudent"
+    return None
+
+def csv_row_to_config(row: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """把一行 CSV 映射为与 YAML 相同结构的配置；空单元格不写入，以便使用默认值"""
+    notes: List[str] = []
+    student_info: Dict[str, Any] = {}
+    compliance: Dict[str, Any] = {}
+    address: Dict[str, Any] = {}
+    course: Dict[str, Any] = {}
+    sections = {"student_info": student_info, "compliance": compliance, "address": address, "course": course}
+    for column, (section, key) in CSV_COLUMN_MAP.items():
+        value = (row.get(column) or "").strip()
+        if value:
+            sections[section][key] = value
+
+    if "course_id" in course:
+        m = COURSE_CODE_RE.search(course["course_id"])
+        if m:
+            course["course_id"] = m.group(1)
+        else:
+            notes.append(f"Course '{course['course_id']}' has no course code -> default")
+            del course["course_id"]
+
+    origin_text = (row.get("Are you?") or "").strip()
+    origin = csv_student_origin(origin_text)
+    if origin:
+        student_info["student_origin"] = origin
+    elif origin_text:
+        notes.append(f"'Are you?' value '{origin_text}' not recognised -> default origin")
+
+    # CSV 没有报价编号列：用行内容生成稳定的编号，避免同一批次编号重复
+    import hashlib
+    digest = hashlib.sha1(json.dumps(row, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    config: Dict[str, Any] = {"offer_id": f"OFFER_{digest[:12].upper()}",
+                              "student_info": student_info, "compliance": compliance}
+    if address:
+        address["is_primary"] = True
+        config["addresses"] = [address]
+    if course:
+        config["applied_courses"] = [course]
+    return config, notes
+
+def iter_csv_configs(path: str):
+    """逐行流式读取 CSV，产出 (行号, 配置, 备注)；内存占用与文件大小无关"""
+    import csv
+    with open(path, "rb") as f:
+        sample = f.read(DETECTION_SAMPLE_SIZE)
+    encoding = sniff_encodings(sample)[0]
+    with open(path, "r", encoding=encoding, newline="") as f:
+        reader = csv.DictReader(f)
+        # 列名两侧可能带空格（如 "Residency/Visa proof "）
+        reader.fieldnames = [(n or "").strip() for n in (reader.fieldnames or [])]
+        for row_number, row in enumerate(reader, 2):
+            config, notes = csv_row_to_config(row)
+            yield row_number, config, notes
+
+def iter_jsonl_lines(path: str):
+    """逐行流式读取 JSONL 导出（每行一个配置对象），产出 (行号, 原始文本)；解析放到工作进程中"""
+    with open(path, "rb") as f:
+        sample = f.read(DETECTION_SAMPLE_SIZE)
+    encoding = sniff_encodings(sample)[0]
+    with open(path, "r", encoding=encoding) as f:
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                yield line_number, line
+
+def batch_config(kind: str, payload: Any) -> Tuple[Dict[str, Any], List[str]]:
+    """config（CSV 行）/ json（JSONL 行）条目的 (配置, 备注)"""
+    if kind == "json":
+        config = json.loads(payload)
+        if not isinstance(config, dict):
+            raise ValueError(f"Expected a JSON object, got {type(config).__name__}")
+        return config, []
+    return payload
+
+def collect_batch_items(source: str):
+    """把目录、glob、多文档文件、CSV 或 JSONL 展开为 (名称, 类型, 载荷) 序列"""
+    if source == "-":
+        return _yaml_document_items("stdin", sys.stdin)
+    if os.path.isfile(source) and source.lower().endswith(".csv"):
+        stem = os.path.splitext(os.path.basename(source))[0]
+        return ((f"{stem}_{n:05d}", "config", (config, notes))
+                for n, config, notes in iter_csv_configs(source))
+    if os.path.isfile(source) and source.lower().endswith(".jsonl"):
+        stem = os.path.splitext(os.path.basename(source))[0]
+        return ((f"{stem}_{n:05d}", "json", line) for n, line in iter_jsonl_lines(source))
+    if os.path.isdir(source):
+        paths = sorted(
+            os.path.join(source, n) for n in os.listdir(source)
+            if n.lower().endswith(BATCH_EXTENSIONS)
+        )
+    elif os.path.isfile(source):
+        stem = os.path.splitext(os.path.basename(source))[0]
+        return _yaml_document_items(stem, robust_file_reader(source).splitlines(), single_name=stem)
+    else:
+        import glob
+        paths = sorted(p for p in glob.glob(source, recursive=True) if os.path.isfile(p))
+    if not paths:
+        raise FileNotFoundError(f"No batch inputs matched: {source}")
+
+    items, seen = [], set()
+    for i, path in enumerate(paths, 1):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in seen:
+            name = f"{name}_{i:05d}"
+        seen.add(name)
+        items.append((name, "file", path))
+    return items
+
+# ---------------- 账本生成缓存 ----------------
+
+COMPOSED_CACHE_VERSION = 2
+# 参与生成的源码和参考数据：任一文件变化后，账本中缓存的报价不再复用
+COMPOSER_SOURCES = ("compose_offer_robust.py", "offer_columnar.py", "country_reference.py", "nationality.txt")
+
+@lru_cache(maxsize=1)
+def composer_version() -> str:
+    from offer_ledger import input_hash
+    base = os.path.dirname(os.path.abspath(__file__))
+    parts = [f"composed-v{COMPOSED_CACHE_VERSION}".encode("ascii")]
+    for name in COMPOSER_SOURCES:
         try:
-            return float(x)
-        except:
-            return float(dv)
+            with open(os.path.join(base, name), "rb") as f:
+                parts.append(f.read())
+        except OSError:
+            parts.append(b"")
+    return input_hash(b"\0".join(parts))
+
+def versioned_input_hash(content) -> str:
+    """账本缓存键：生成器版本 + 原始输入的哈希"""
+    from offer_ledger import input_hash
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return input_hash(composer_version().encode("ascii") + content)
+
+def now_fields(offer: Any, log: Dict[str, Tuple[str, int]]) -> List[list]:
+    """报价中由当前时间生成的字段，每项为 [路径..., 种类, 参数]"""
+    found: List[list] = []
+    def walk(value, path):
+        if isinstance(value, dict):
+            for k, v in value.items():
+                walk(v, path + [k])
+        elif isinstance(value, list):
+            for i, v in enumerate(value):
+                walk(v, path + [i])
+        elif isinstance(value, str):
+            hit = log.get(value)
+            if hit is not None:
+                found.append(path + list(hit))
+    walk(offer, [])
+    return found
 
-    def _to_int(x, dv=1):
-        if x is None or x == "":
-            return int(dv)
+NOW_VALUES = {
+    "timestamp": lambda _: timestamp_now(),
+    "offer_id": lambda _: generated_offer_id(),
+    "future": _future_date_text,
+}
+
+def refresh_now_fields(offer: Dict[str, Any], fields: List[list]) -> Dict[str, Any]:
+    """复用缓存的报价时按当前时间重新生成这些字段；同种类的字段取同一个新值（如各实体中的 OfferId）"""
+    fresh: Dict[Tuple[str, int], str] = {}
+    for *path, kind, arg in fields:
+        value = fresh.get((kind, arg))
+        if value is None:
+            value = fresh[(kind, arg)] = NOW_VALUES[kind](arg)
+        target = offer
+        for step in path[:-1]:
+            target = target[step]
+        target[path[-1]] = value
+    return offer
+
+def _start_now_log(track: bool):
+    global _now_log
+    _now_log = {} if track else None
+
+def compose_batch_item(item: Tuple[str, str, Any], track_now: bool = False) -> Dict[str, Any]:
+    """批量工作进程入口 - 失败不会抛出，而是记录在结果中；
+    track_now 为真时结果带上由当前时间生成的字段（now_fields），供账本缓存复用时刷新"""
+    name, kind, payload = item
+    _start_now_log(track_now)
+    with metrics.stage("batch_item", kind=kind) as st:
         try:
-            return int(x)
-        except:
-            return int(dv)
-
-    for course in courses_config:
-        if isinstance(course, dict):
-            course_entry = {
-                "OfferId": offer_id,
-                "CourseId": course.get('course_id', 'CPC50220'),
-                "CampusId": _to_int(course.get('campus_id', 1), 1),
-                "IntakeDate": to_iso8601(course.get('intake_date') or datetime.now(tz=AEST)+timedelta(days=30)),
-                "StartDate": to_iso8601(course.get('start_date') or datetime.now(tz=AEST)+timedelta(days=30)),
-                "FinishDate": to_iso8601(course.get('finish_date') or datetime.now(tz=AEST)+timedelta(days=370)),
-                "ELICOS_NumOfWeeks": _to_int(course.get('elicos_num_of_weeks', 0), 0),
-                "TuitionFee": _to_float(course.get('tuition_fee', 12000.0), 12000.0),
-                "EnrolmentFee": _to_float(course.get('enrolment_fee', 250.0), 250.0),
-                "MaterialFee": _to_float(course.get('material_fee', 300.0), 300.0),
-                "UpfrontFee": _to_float(course.get('upfront_fee', 500.0), 500.0),
-                "SpecialCondition": course.get('special_condition', ''),
-                "ApplicationRequest": course.get('application_request', 'Direct apply'),
-                "Status": course.get('status', '')
-            }
-            cleaned_courses.append(course_entry)
-
-    if not cleaned_courses:
-        cleaned_courses = [{
-            "OfferId": offer_id, "CourseId": "CPC50220", "CampusId": 1,
-            "IntakeDate": to_iso8601(datetime.now(tz=AEST)+timedelta(days=30)),
-            "StartDate": to_iso8601(datetime.now(tz=AEST)+timedelta(days=30)),
-            "FinishDate": to_iso8601(datetime.now(tz=AEST)+timedelta(days=370)),
-            "ELICOS_NumOfWeeks": 0, "TuitionFee": 12000.0, "EnrolmentFee": 250.0,
-            "MaterialFee": 300.0, "UpfrontFee": 500.0, "SpecialCondition": "",
-            "ApplicationRequest": "Direct apply", "Status": ""
-        }]
-
-    # Process disabilities
-    disabilities_config = config.get('disabilities', [])
-    cleaned_disabilities = []
-    for disability in disabilities_config:
-        if isinstance(disability, dict):
-            disability_entry = {
-                "OfferId": offer_id,
-                "DisabilityCode": disability.get('disability_code', ''),
-                "DisabilityName": disability.get('disability_name', ''),
-                "OtherValue": disability.get('other_value', '')
-            }
-            cleaned_disabilities.append(disability_entry)
-
-    # Process education history
-    edu_hist_config = config.get('education_history', [])
-    cleaned_edu_hist = []
-    for edu in edu_hist_config:
-        if isinstance(edu, dict):
-            edu_entry = {
-                "OfferId": offer_id,
-                "QualificationName": edu.get('qualification_name', ''),
-                "InstituteName": edu.get('institute_name', ''),
-                "InstituteLocation": edu.get('institute_location', ''),
-                "YearCompleted": _to_int(edu.get('year_completed', 0), 0),
-                "EducationLevelCode": edu.get('education_level_code', ''),
-                "AchievementRecognitionCode": edu.get('achievement_recognition_code', '')
-            }
-            cleaned_edu_hist.append(edu_entry)
-
-    # Process employment history
-    emp_hist_config = config.get('employment_history', [])
-    cleaned_emp_hist = []
-    for emp in emp_hist_config:
-        if isinstance(emp, dict):
-            emp_entry = {
-                "OfferId": offer_id,
-                "EmployerName": emp.get('employer_name', ''),
-                "JobTitle": emp.get('job_title', ''),
-                "JobDescription": emp.get('job_description', ''),
-                "FromDate": to_iso8601(emp.get('from_date', '')),
-                "ToDate": to_iso8601(emp.get('to_date', ''))
-            }
-            cleaned_emp_hist.append(emp_entry)
-
-    # Process emergency contact
-    emergency_config = config.get('emergency_contact', {})
-    emergency = {
-        "OfferId": offer_id,
-        "ContactType": emergency_config.get('contact_type', 'Emergency'),
-        "Relationship": emergency_config.get('relationship', 'Parent'),
-        "ContactName": emergency_config.get('contact_name', 'Wei Zhang'),
-        "Address": emergency_config.get('address', '123 Collins St, Melbourne VIC 3000'),
-        "Phone": emergency_config.get('phone', '+61 3 xxxx xxxx'),
-        "Email": emergency_config.get('email', 'parent@example.com')
-    }
+            if kind in CONFIG_KINDS:
+                config, notes = batch_config(kind, payload)
+                with_offer_id(config, name)
+                with metrics.stage("coerce"):
+                    offer, issues = coerce_student_offer_from_config(config)
+                issues = notes + issues
+            else:
+                if kind == "file":
+                    yaml_content = robust_file_reader(payload)
+                else:
+                    yaml_content = detect_and_fix_yaml_content(payload)
+                offer, issues = coerce_student_offer_from_yaml_content(yaml_content, name)
+            result = {"source": name, "offer": offer, "issues": issues, "error": None}
+            if track_now:
+                result["now_fields"] = now_fields(offer, _now_log)
+        except Exception as e:
+            st.outcome = "error"
+            result = {"source": name, "offer": None, "issues": [], "error": f"{type(e).__name__}: {e}"}
+        finally:
+            _start_now_log(False)
+    # 工作进程中的阶段观测值随结果带回主进程
+    observations = metrics.drain()
+    if observations:
+        result["metrics"] = observations
+    return result
 
-    # Process leads marketing
-    leads_config = config.get('leads_marketing', {})
-    leads_mkt = {
-        "OfferId": offer_id,
-        "KnowFrom": leads_config.get('know_from', 'Agent'),
-        "LeadSource": leads_config.get('lead_source', 'Web'),
-        "CampaignName": leads_config.get('campaign_name', 'Website')
+def compose_config_chunk(items: List[Tuple[str, str, Any]], track_now: bool = False) -> List[Dict[str, Any]]:
+    """批量工作进程入口：一块 CSV / JSONL 条目走列式路径，结果与逐条调用 compose_batch_item 相同；
+    某行失败只记录在该行的结果中"""
+    import offer_columnar
+    # 作为脚本运行时本模块是 __main__，列式路径使用的是 offer_columnar 导入的另一份模块对象
+    composer = offer_columnar.compose
+    start = time.perf_counter()
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    configs, slots = [], []
+    for n, (name, kind, payload) in enumerate(items):
+        try:
+            config, notes = batch_config(kind, payload)
+        except Exception as e:
+            results[n] = {"source": name, "offer": None, "issues": [], "error": f"{type(e).__name__}: {e}"}
+            continue
+        configs.append(with_offer_id(config, name))
+        slots.append((n, notes))
+    composer._start_now_log(track_now)
+    try:
+        with metrics.stage("coerce", mode="columnar"):
+            coerced = offer_columnar.coerce_configs(configs)
+        log = composer._now_log
+    finally:
+        composer._start_now_log(False)
+    for (n, notes), (offer, issues, error) in zip(slots, coerced):
+        name = items[n][0]
+        if error is None:
+            results[n] = {"source": name, "offer": offer, "issues": notes + issues, "error": None}
+            if track_now:
+                results[n]["now_fields"] = now_fields(offer, log)
+        else:
+            results[n] = {"source": name, "offer": None, "issues": [], "error": f"{type(error).__name__}: {error}"}
+    # 逐条的 batch_item 观测值按块内平均耗时补齐，计数与逐条路径一致
+    share = (time.perf_counter() - start) / max(1, len(items))
+    for (name, kind, _), result in zip(items, results):
+        metrics.observe("batch_item", share, 0, "error" if result["error"] else "ok", {"kind": kind})
+    observations = metrics.drain()
+    if observations and results:
+        results[0]["metrics"] = observations
+    return results
+
+def _batch_input_hash(item: Tuple[str, str, Any]) -> str:
+    name, kind, payload = item
+    if kind == "file":
+        with open(payload, "rb") as f:
+            return versioned_input_hash(f.read())
+    if kind == "config":
+        return versioned_input_hash(json.dumps(payload[0], sort_keys=True, ensure_ascii=False, default=str))
+    return versioned_input_hash(payload)
+
+def iter_batch_results(items, workers: int, ledger=None, columnar: bool = True):
+    """按完成顺序产出结果；输入可以是惰性序列，在途任务数有上限。
+    指定账本时，输入内容和生成器版本都未变的条目直接产出上次的结果（cached=True），
+    其中由当前时间生成的 TimeStamp、OfferId 和默认日期重新生成；新生成的结果带 now_fields 供写入账本。
+    columnar 为真时连续的 CSV / JSONL 条目每 COLUMNAR_CHUNK_SIZE 个合成一个任务走列式路径"""
+    track = ledger is not None
+
+    def dispatch():
+        for item in items:
+            key = None
+            if ledger:
+                key = _batch_input_hash(item)
+                hit = ledger.get_composed(key)
+                if hit:
+                    offer, issues, fields = hit
+                    yield None, {"source": item[0], "offer": refresh_now_fields(offer, fields), "issues": issues,
+                                 "error": None, "cached": True, "input_hash": key}
+                    continue
+            yield item, key
+
+    def tasks():
+        """产出 (函数, 参数, 输入哈希列表)；账本命中的条目产出 (None, 结果, None)"""
+        chunk, chunk_keys = [], []
+        for item, key in dispatch():
+            if item is None:
+                yield None, key, None
+            elif columnar and item[1] in CONFIG_KINDS:
+                chunk.append(item)
+                chunk_keys.append(key)
+                if len(chunk) >= COLUMNAR_CHUNK_SIZE:
+                    yield compose_config_chunk, chunk, chunk_keys
+                    chunk, chunk_keys = [], []
+            else:
+                yield compose_batch_item, item, [key]
+        if chunk:
+            yield compose_config_chunk, chunk, chunk_keys
+
+    def tagged(func, output, keys):
+        for result, key in zip(output if func is compose_config_chunk else [output], keys):
+            metrics.merge(result.pop("metrics", None))
+            if key is not None:
+                result["input_hash"] = key
+            yield result
+
+    if workers <= 1 or (isinstance(items, list) and len(items) <= 1):
+        for func, arg, keys in tasks():
+            if func is None:
+                yield arg
+            else:
+                yield from tagged(func, func(arg, track), keys)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+    window = max(1, workers * BATCH_WINDOW_PER_WORKER)
+    with ProcessPoolExecutor(max_workers=workers, initializer=metrics.configure_worker,
+                             initargs=metrics.worker_settings()) as pool:
+        pending = {}
+        for func, arg, keys in tasks():
+            if func is None:
+                yield arg
+                continue
+            pending[pool.submit(func, arg, track)] = (func, keys)
+            if len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    func, keys = pending.pop(fut)
+                    yield from tagged(func, fut.result(), keys)
+        for fut in as_completed(list(pending)):
+            func, keys = pending.pop(fut)
+            yield from tagged(func, fut.result(), keys)
+
+def run_batch(source: str, out: str, workers: int, summary_path: Optional[str] = None,
+              ledger_path: Optional[str] = None, fmt: Optional[str] = None,
+              columnar: bool = True) -> Dict[str, Any]:
+    """批量生成报价：jsonl / jsonl.gz 格式（或 --out 以 .jsonl / .jsonl.gz 结尾）时写单个文件，
+    否则每个输入写一个 pretty / compact 文件；所有文件都是原子写入。
+    指定账本时，输入内容未变的条目直接复用上次的生成结果"""
+    fmt = format_for_path(out, fmt)
+    items = collect_batch_items(source)
+    ledger = None
+    if ledger_path:
+        from offer_ledger import OfferLedger
+        ledger = OfferLedger(ledger_path)
+    out_path = os.path.abspath(out)
+    if is_stream_format(fmt):
+        stream = OfferWriter(out_path, fmt)
+    else:
+        os.makedirs(out_path, exist_ok=True)
+        stream = None
+
+    count = f"{len(items)} input(s)" if isinstance(items, list) else "streaming input"
+    metrics.info(f"Batch: {count}, {workers} worker(s)", workers=workers)
+    records, unchanged, completed = [], 0, False
+    try:
+        for result in iter_batch_results(items, workers, ledger, columnar):
+            record = {"source": result["source"], "issues": result["issues"], "error": result["error"]}
+            offer = result["offer"]
+            if offer is not None:
+                record["offer_id"] = offer.get("OfferId")
+                if result.get("cached"):
+                    unchanged += 1
+                elif ledger:
+                    ledger.put_composed(result["input_hash"], offer, result["issues"], result.get("now_fields", []))
+                with metrics.stage("write", format=fmt) as st:
+                    if stream:
+                        st.add_bytes(stream.write(offer))
+                    else:
+                        target = os.path.join(out_path, f"{result['source']}.json")
+                        st.add_bytes(write_json(target, offer, fmt))
+                        record["output"] = target
+            records.append(record)
+        completed = True
+    finally:
+        if stream:
+            # 中途失败时丢弃临时文件，保留上一次的完整输出
+            if completed:
+                stream.close()
+            else:
+                stream.abort()
+        if ledger:
+            ledger.close()
+
+    records.sort(key=lambda r: r["source"])
+    failed = [r for r in records if r["error"]]
+    summary = {
+        "total": len(records),
+        "succeeded": len(records) - len(failed),
+        "failed": len(failed),
+        "with_issues": sum(1 for r in records if r["issues"]),
+        "unchanged": unchanged,
+        "output": out_path,
+        "records": records,
     }
+    if summary_path:
+        write_json(summary_path, summary)
 
-    # Assemble final offer
-    offer["ComplianceAndOtherInfo"] = compliance
-    offer["Addresses"] = cleaned_addrs
-    offer["AppliedCourses"] = cleaned_courses
-    offer["Disabilities"] = cleaned_disabilities
-    offer["EmergencyContact"] = emergency
-    offer["EducationHistoryList"] = cleaned_edu_hist
-    offer["EmploymentHistoryList"] = cleaned_emp_hist
-    offer["Leads_MarketingCampaign"] = leads_mkt
+    print(f"Written to {out_path}")
+    metrics.info(f"Batch done: {summary['succeeded']} ok ({unchanged} unchanged), {summary['failed']} failed, "
+                 f"{summary['with_issues']} with auto-fix notes",
+                 succeeded=summary['succeeded'], unchanged=unchanged, failed=summary['failed'],
+                 with_issues=summary['with_issues'])
+    for r in failed:
+        metrics.error(f"{r['source']}: {r['error']}", source=r['source'])
+    return summary
 
-    return offer, issues
+# ---------------- 投放目录监视模式 ----------------
+
+WATCH_EXTENSIONS = BATCH_EXTENSIONS + (".csv",)
+WATCH_OUTPUT_SUFFIX = ".offer"   # 输出写在源文件旁时加在文件名上，监视时忽略这些文件
+WATCH_TICK = 0.5                 # 主循环等待文件事件的最长时间（秒），也是回收完成任务的间隔
+
+def watch_accepts(name: str) -> bool:
+    """只处理输入文件：跳过隐藏文件 / 临时文件（含 AtomicWriter 的 .xxx.tmp）、Office 锁文件和自己的输出"""
+    lower = name.lower()
+    return (not name.startswith((".", "~$")) and lower.endswith(WATCH_EXTENSIONS)
+            and not lower.endswith(WATCH_OUTPUT_SUFFIX + ".json"))
+
+def watch_output_path(path: str, outbox: Optional[str], fmt: str) -> str:
+    """输出文件名保留源文件扩展名（a.yaml -> a.yaml.json / a.yaml.offer.json），
+    同名不同扩展名的投放文件（a.yaml、a.csv、a.json）不会互相覆盖"""
+    name = os.path.basename(path)
+    ext = {"jsonl": ".jsonl", "jsonl.gz": ".jsonl.gz"}.get(fmt, ".json")
+    if outbox:
+        return os.path.join(os.path.abspath(outbox), name + ext)
+    return os.path.join(os.path.dirname(path), name + WATCH_OUTPUT_SUFFIX + ext)
+
+def compose_watch_file(path: str, out_path: str, fmt: str) -> Dict[str, Any]:
+    """监视模式工作进程入口：生成一个投放文件（单 / 多文档 YAML、JSON 或 CSV）中的全部报价并原子写出；
+    一个报价都没有生成时保留原有输出"""
+    result: Dict[str, Any] = {"source": path, "output": out_path, "offers": 0, "issues": 0, "errors": []}
+    observations: List[Tuple] = []
+    try:
+        with OfferWriter(out_path, fmt) as writer:
+            for item in collect_batch_items(path):
+                r = compose_batch_item(item)
+                observations.extend(r.get("metrics") or [])
+                if r["error"]:
+                    result["errors"].append(f"{r['source']}: {r['error']}")
+                    continue
+                with metrics.stage("write", format=fmt) as st:
+                    st.add_bytes(writer.write(r["offer"]))
+                result["issues"] += len(r["issues"])
+            if writer.count == 0:
+                raise ValueError("no offers composed")
+        result["offers"] = writer.count
+    except Exception as e:
+        result["errors"].append(f"{type(e).__name__}: {e}")
+    observations.extend(metrics.drain() or [])
+    if observations:
+        result["metrics"] = observations
+    return result
+
+def run_watch(directory: str, outbox: Optional[str], workers: int, fmt: Optional[str] = None,
+              debounce: float = 2.0, poll_interval: float = 2.0, force_poll: bool = False,
+              ledger_path: Optional[str] = None):
+    """监视投放目录，对新增或内容变化的文件重新生成报价，直到 Ctrl+C / SIGTERM。
+    工作进程数固定为 workers，突发的大量文件只会排队；内容哈希未变的文件直接跳过，
+    指定账本时该缓存跨进程重启保留"""
+    import signal
+    from concurrent.futures import ProcessPoolExecutor
+    from offer_ledger import OfferLedger
+    from offer_watch import DirectoryWatcher
+
+    fmt = fmt or "pretty"
+    if outbox:
+        os.makedirs(outbox, exist_ok=True)
+    ledger = OfferLedger(ledger_path) if ledger_path else None
+    hashes: Dict[str, str] = {}
+    running: Dict[str, Tuple[Any, str]] = {}   # 路径 -> (future, 提交时的内容哈希)
+    changed_while_running = set()
+    totals = {"composed": 0, "unchanged": 0, "failed": 0}
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    def dispatch(path: str):
+        name = os.path.basename(path)
+        if path in running:
+            changed_while_running.add(path)
+            return
+        try:
+            with open(path, "rb") as f:
+                digest = versioned_input_hash(f.read())
+        except OSError as e:
+            metrics.warn(f"{name}: not readable ({e})", source=path)
+            return
+        out_path = watch_output_path(path, outbox, fmt)
+        if hashes.get(path) == digest or (
+                ledger and ledger.get_watched(path) == (digest, out_path) and os.path.exists(out_path)):
+            hashes[path] = digest
+            totals["unchanged"] += 1
+            metrics.debug(f"{name}: content unchanged, skipped", source=path)
+            return
+        running[path] = (pool.submit(compose_watch_file, path, out_path, fmt), digest)
+
+    def reap(block: bool = False):
+        for path, (future, digest) in list(running.items()):
+            if not block and not future.done():
+                continue
+            del running[path]
+            result = future.result()
+            metrics.merge(result.pop("metrics", None))
+            # 失败的文件同样记录哈希：内容不变就不反复重试
+            hashes[path] = digest
+            name = os.path.basename(path)
+            for err in result["errors"]:
+                metrics.error(f"{name}: {err}", source=path)
+            if result["offers"]:
+                totals["composed"] += 1
+                if ledger:
+                    ledger.put_watched(path, digest, result["output"])
+                metrics.success(f"{name} -> {result['output']} ({result['offers']} offer(s), "
+                                f"{result['issues']} auto-fix note(s))",
+                                source=path, output=result["output"], offers=result["offers"])
+            else:
+                totals["failed"] += 1
+            if path in changed_while_running:
+                changed_while_running.discard(path)
+                dispatch(path)
+
+    with DirectoryWatcher(directory, watch_accepts, debounce, poll_interval, force_poll) as watcher, \
+            ProcessPoolExecutor(max_workers=max(1, workers), initializer=metrics.configure_worker,
+                                initargs=metrics.worker_settings()) as pool:
+        metrics.info(f"Watching {watcher.directory} ({watcher.backend}, debounce {debounce:g}s, "
+                     f"{max(1, workers)} worker(s)); output to {os.path.abspath(outbox) if outbox else 'source folder'}",
+                     directory=watcher.directory, backend=watcher.backend)
+        try:
+            while not stop.is_set():
+                for path in watcher.poll(WATCH_TICK):
+                    dispatch(path)
+                reap()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if running:
+                metrics.info(f"Stopping: waiting for {len(running)} file(s) in progress")
+            changed_while_running.clear()
+            reap(block=True)
+            if ledger:
+                ledger.close()
+    metrics.info(f"Watch stopped: {totals['composed']} composed, {totals['unchanged']} unchanged, "
+                 f"{totals['failed']} failed", **totals)
+
+# ---------------- 常驻服务模式 ----------------
+
+def compose_from_request_body(body: bytes, content_type: str = "") -> Tuple[Dict[str, Any], List[str]]:
+    """解析服务请求体：JSON {yaml_content|yaml_base64|config} 或原始 YAML 文本"""
+    text = body.decode("utf-8-sig")
+    payload = None
+    if "json" in content_type.lower() or text.lstrip().startswith("{"):
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            payload = None
+    if isinstance(payload, dict):
+        if payload.get("yaml_content"):
+            yaml_content = payload["yaml_content"]
+        elif payload.get("yaml_base64"):
+            import base64
+            try:
+                yaml_content = base64.b64decode(payload["yaml_base64"], validate=True).decode("utf-8")
+            except (ValueError, TypeError) as e:
+                raise ValueError(f"Invalid 'yaml_base64': {e}")
+        elif isinstance(payload.get("config"), dict):
+            return coerce_student_offer_from_config(payload["config"])
+        else:
+            raise ValueError("Expected one of 'yaml_content', 'yaml_base64' or 'config'")
+    else:
+        yaml_content = text
+    return coerce_student_offer_from_yaml_content(detect_and_fix_yaml_content(yaml_content))
+
+@lru_cache(maxsize=None)
+def _server_classes():
+    """服务相关的类在首次启动服务时才定义：http.server 导入较慢，其他命令行路径用不到"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from socketserver import ThreadingMixIn, UnixStreamServer
+
+    class ComposeRequestHandler(BaseHTTPRequestHandler):
+        """GET /health 健康检查；POST /compose 生成报价"""
+        server_version = "ComposeOffer/1.0"
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status: int, payload: Dict[str, Any]):
+            data = dumps(payload)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/") != "/health":
+                return self._send_json(404, {"error": f"Unknown path {self.path}"})
+            stats = self.server.compose_stats
+            self._send_json(200, {
+                "status": "ok",
+                "yaml": _load_yaml() is not None,
+                "max_concurrency": self.server.max_concurrency,
+                "in_flight": stats["in_flight"],
+                "served": stats["served"],
+                "failed": stats["failed"],
+                "rejected": stats["rejected"],
+            })
+
+        def _reject(self, status: int, message: str, counter: str = "failed"):
+            """请求体未读取就返回错误：关闭连接，剩余的请求体不会被当成下一个请求"""
+            self.close_connection = True
+            with self.server.stats_lock:
+                self.server.compose_stats[counter] += 1
+            self._send_json(status, {"error": message})
+
+        def do_POST(self):
+            if self.path.rstrip("/") not in ("", "/compose"):
+                self.close_connection = True
+                return self._send_json(404, {"error": f"Unknown path {self.path}"})
+            server = self.server
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                return self._reject(400, f"Invalid Content-Length: {self.headers.get('Content-Length')!r}")
+            if server.max_body and length > server.max_body:
+                return self._reject(413, f"Request body of {length} bytes exceeds the {server.max_body}-byte limit")
+            # 先占用生成槽位再读请求体：同时缓冲的请求体不超过 max_concurrency 个
+            if not server.compose_slots.acquire(timeout=server.queue_timeout):
+                return self._reject(503, "Server busy, retry later", "rejected")
+            with server.stats_lock:
+                server.compose_stats["in_flight"] += 1
+            try:
+                body = self.rfile.read(length) if length else b""
+                offer, issues = compose_from_request_body(body, self.headers.get("Content-Type", ""))
+            except Exception as e:
+                with server.stats_lock:
+                    server.compose_stats["failed"] += 1
+                return self._send_json(400, {"error": str(e)})
+            finally:
+                with server.stats_lock:
+                    server.compose_stats["in_flight"] -= 1
+                server.compose_slots.release()
+            with server.stats_lock:
+                server.compose_stats["served"] += 1
+            self._send_json(200, {"offer": offer, "issues": issues})
+
+        def log_message(self, format, *args):
+            metrics.info(f"{self.command} {self.path} - {format % args}")
+
+    class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+        daemon_threads = True
+
+    return ComposeRequestHandler, ThreadingHTTPServer, ThreadingUnixHTTPServer
+
+def _remove_stale_socket(path: str):
+    """上次未正常退出留下的套接字文件：没有进程在监听就删除；仍有服务在监听或不是套接字时报错"""
+    import socket, stat
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(f"{path} exists and is not a socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(f"{path} is in use by a running server")
+
+DEFAULT_MAX_BODY = 1024 * 1024   # 单个报价的 YAML / JSON 通常只有几 KB
+
+def build_compose_server(host: str = "127.0.0.1", port: int = 8765, unix_socket: Optional[str] = None,
+                         max_concurrency: int = 4, queue_timeout: float = 30.0,
+                         max_body: int = DEFAULT_MAX_BODY):
+    """创建常驻服务，所有请求共享同一个已预热的生成流程"""
+    ComposeRequestHandler, ThreadingHTTPServer, ThreadingUnixHTTPServer = _server_classes()
+    if unix_socket:
+        _remove_stale_socket(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, ComposeRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ComposeRequestHandler)
+        server.daemon_threads = True
+    server.max_concurrency = max_concurrency
+    server.queue_timeout = queue_timeout
+    server.max_body = max_body
+    server.compose_slots = threading.BoundedSemaphore(max_concurrency)
+    server.stats_lock = threading.Lock()
+    server.compose_stats = {"in_flight": 0, "served": 0, "failed": 0, "rejected": 0}
+    return server
+
+def serve(host: str, port: int, unix_socket: Optional[str], max_concurrency: int,
+          max_body: int = DEFAULT_MAX_BODY):
+    """启动常驻服务直到 Ctrl+C / SIGTERM"""
+    import signal
+    if _load_yaml() is None:
+        raise ImportError("PyYAML not installed. Run: pip install pyyaml")
+    # 预热：首次调用会完成所有惰性初始化
+    coerce_student_offer_from_config({})
+    server = build_compose_server(host, port, unix_socket, max_concurrency, max_body=max_body)
+    where = unix_socket or f"http://{host}:{port}"
+    metrics.info(f"Compose server listening on {where} (max concurrency {max_concurrency})")
+    # shutdown() 等待 serve_forever 退出，不能在运行 serve_forever 的主线程（信号处理函数）中直接调用
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+
+def print_issues(issues: List[str], label: str = ""):
+    if issues:
+        metrics.warn(f"Auto-fix notes{label}:" + "".join(f"\n - {it}" for it in issues), issues=issues)
+
+def write_offer_stream(results, out: str, fmt: Optional[str] = None) -> int:
+    """边生成边写出报价（原子替换 --out）；格式见 offer_output.OfferWriter"""
+    with OfferWriter(out, fmt) as writer:
+        for offer, issues in results:
+            with metrics.stage("write", format=writer.format) as st:
+                st.add_bytes(writer.write(offer))
+            label = f" (document {writer.count}, {offer.get('OfferId')})" if writer.count > 1 else ""
+            print_issues(issues, label)
+        if writer.count == 0:
+            raise ValueError("No YAML documents found in input")
+    if writer.count == 1:
+        print(f"Written to {writer.path}")
+    else:
+        print(f"Written {writer.count} offers to {writer.path}")
+    return writer.count
 
 def build_arg_parser():
     p = argparse.ArgumentParser(description="Compose StudentOffer JSON - Robust Edition")
-    p.add_argument("--out", required=True, help="Output JSON file path")
+    p.add_argument("--out", help="Output JSON file path (batch: directory, or a .jsonl / .jsonl.gz file)")
+    p.add_argument("--format", choices=OUTPUT_FORMATS,
+                   help="Output format (default: inferred from --out; .jsonl, .jsonl.gz, otherwise pretty)")
 
     # Power Automate 专用参数
     p.add_argument("--yaml-content", help="YAML content as string")
@@ -437,10 +1564,74 @@ def build_arg_parser():
     p.add_argument("--config", help="Configuration file (YAML or JSON)")
     p.add_argument("--quick", action="store_true", help="Generate with default test data")
 
+    # 批量模式
+    p.add_argument("--batch", help="Directory, glob, multi-document YAML file, SharePoint CSV or JSONL export ('-' for stdin)")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Batch worker processes")
+    p.add_argument("--summary", help="Write batch summary JSON to this path")
+    p.add_argument("--no-columnar", action="store_true",
+                   help="Coerce CSV / JSONL rows one at a time instead of in NumPy column batches")
+    p.add_argument("--ledger", help="SQLite ledger; inputs whose content is unchanged reuse the stored offer")
+
+    # 投放目录监视模式
+    p.add_argument("--watch", metavar="DIR",
+                   help="Watch a drop folder and compose new/changed YAML, JSON and CSV files "
+                        "(--out: outbox directory, e.g. a.yaml -> <outbox>/a.yaml.json; "
+                        "default: a.yaml.offer.json next to each file)")
+    p.add_argument("--debounce", type=float, default=2.0,
+                   help="Watch: seconds a file must stay unchanged before it is composed")
+    p.add_argument("--poll", action="store_true",
+                   help="Watch: poll instead of inotify (needed for network shares)")
+    p.add_argument("--poll-interval", type=float, default=2.0, help="Watch: seconds between directory scans")
+
+    # 常驻服务模式
+    p.add_argument("--serve", action="store_true", help="Run as a long-lived compose server")
+    p.add_argument("--host", default="127.0.0.1", help="Server bind address")
+    p.add_argument("--port", type=int, default=8765, help="Server port")
+    p.add_argument("--unix-socket", help="Listen on a Unix socket instead of TCP")
+    p.add_argument("--max-concurrency", type=int, default=4, help="Concurrent compose requests")
+    p.add_argument("--max-body", type=int, default=DEFAULT_MAX_BODY,
+                   help=f"Largest accepted request body in bytes; larger requests get 413 (default {DEFAULT_MAX_BODY}, 0: no limit)")
+
+    # 计时与事件
+    metrics.add_arguments(p)
+    offer_profile.add_arguments(p)
+
     return p
 
 def main():
-    args = build_arg_parser().parse_args()
+    parser = build_arg_parser()
+    args = parser.parse_args()
+    metrics.configure(args.log_level, args.log_format, args.metrics, service="compose")
+    offer_profile.start(args)
+
+    if args.serve:
+        try:
+            serve(args.host, args.port, args.unix_socket, args.max_concurrency, args.max_body)
+        except Exception as e:
+            metrics.error(str(e))
+            sys.exit(1)
+        return
+    if args.watch:
+        try:
+            run_watch(args.watch, args.out, args.workers, args.format, args.debounce, args.poll_interval,
+                      args.poll, args.ledger)
+        except Exception as e:
+            metrics.error(str(e))
+            sys.exit(1)
+        return
+    if not args.out:
+        parser.error("--out is required unless --serve or --watch is used")
+
+    if args.batch:
+        try:
+            summary = run_batch(args.batch, args.out, args.workers, args.summary, args.ledger, args.format,
+                                columnar=not args.no_columnar)
+        except Exception as e:
+            metrics.error(str(e))
+            sys.exit(1)
+        if summary["total"] and not summary["succeeded"]:
+            sys.exit(1)
+        return
 
     try:
         # 处理不同的输入方式
@@ -450,29 +1641,30 @@ def main():
             offer, issues = coerce_student_offer_from_yaml_content(yaml_content)
         elif args.yaml_base64:
             # 从 Base64 编码的 YAML 读取
+            import base64
             try:
-                yaml_content = base64.b64decode(args.yaml_base64).decode('utf-8')
+                yaml_content = base64.b64decode(args.yaml_base64, validate=True).decode('utf-8')
                 yaml_content = detect_and_fix_yaml_content(yaml_content)
                 offer, issues = coerce_student_offer_from_yaml_content(yaml_content)
             except Exception as e:
-                print(f"[ERROR] Failed to decode Base64 YAML: {e}")
+                metrics.error(f"Failed to decode Base64 YAML: {e}")
                 sys.exit(1)
         elif args.yaml_stdin:
-            # 从标准输入读取 YAML
-            yaml_content = sys.stdin.read()
-            yaml_content = detect_and_fix_yaml_content(yaml_content)
-            offer, issues = coerce_student_offer_from_yaml_content(yaml_content)
+            # 从标准输入读取 YAML - 多文档输入逐个解析，不整体读入
+            write_offer_stream(iter_offers_from_yaml_stream(FixedLineStream(sys.stdin), "stdin"), args.out, args.format)
+            return
         elif args.config:
             # 从配置文件读取 - 使用强健的文件读取器
-            if yaml is None:
-                print("[ERROR] PyYAML not installed. Run: pip install pyyaml")
+            if _load_yaml() is None:
+                metrics.error("PyYAML not installed. Run: pip install pyyaml")
                 sys.exit(1)
             try:
                 yaml_content = robust_file_reader(args.config)
-                offer, issues = coerce_student_offer_from_yaml_content(yaml_content)
+                write_offer_stream(iter_offers_from_yaml_stream(yaml_content, os.path.basename(args.config)), args.out, args.format)
             except Exception as e:
-                print(f"[ERROR] Failed to load config file: {e}")
+                metrics.error(f"Failed to load config file: {e}")
                 sys.exit(1)
+            return
         elif args.quick:
             # 快速测试模式
             quick_yaml = """
@@ -499,22 +1691,14 @@ leads_marketing: {}
 """
             offer, issues = coerce_student_offer_from_yaml_content(quick_yaml)
         else:
-            print("[ERROR] No input method specified. Use --yaml-content, --yaml-base64, --yaml-stdin, --config, or --quick")
+            metrics.error("No input method specified. Use --yaml-content, --yaml-base64, --yaml-stdin, --config, or --quick")
             sys.exit(1)
 
         # 写入输出文件
-        out_path = os.path.abspath(args.out)
-        with open(out_path, "w", encoding="utf-8") as f:
-            f.write(json.dumps(offer, ensure_ascii=False, indent=2))
-        print(f"Written to {out_path}")
-
-        if issues:
-            print("[WARN] Auto-fix notes:")
-            for it in issues:
-                print(f" - {it}")
+        write_offer_stream([(offer, issues)], args.out, args.format)
 
     except Exception as e:
-        print(f"[ERROR] {e}")
+        metrics.error(str(e))
         sys.exit(1)
 
 if __name__ == "__main__":
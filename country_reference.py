@@ -0,0 +1,165 @@
+# country_reference.py
+# 国家 / 国籍参考数据 - 由 nationality.txt（门户下拉框的 <option> 列表）构建的预计算索引
+
+import os, re, json, difflib, tempfile, unicodedata
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REFERENCE_FILE = os.path.join(BASE_DIR, "nationality.txt")
+INDEX_CACHE_FILE = os.environ.get("COUNTRY_INDEX_CACHE") or os.path.join(BASE_DIR, ".nationality.idx.json")
+INDEX_VERSION = 1
+
+NGRAM_SIZE = 2
+FUZZY_CANDIDATES = 10
+FUZZY_MIN_RATIO = 0.75   # 近似匹配只用于"did you mean"提示，调用方不应直接替换原值
+
+SELECT_RE = re.compile(r'<select[^>]*name="[^"]*drop(Country|Nationality)"[^>]*>(.*?)</select>', re.S | re.I)
+OPTION_RE = re.compile(r'<option[^>]*value="([^"]*)"', re.I)
+PAREN_RE = re.compile(r"\([^)]*\)")
+NON_WORD_RE = re.compile(r"[^0-9a-z]+")
+
+# 常见的非正式写法；目标值不在门户列表中的别名会在构建时被忽略
+ALIASES = {
+    "country": {
+        "prc": "China", "mainland china": "China", "peoples republic of china": "China", "中国": "China",
+        "hk": "Hong Kong", "hksar": "Hong Kong (SAR of China)", "macao": "Macau (SAR of China)",
+        "usa": "United States of America", "us": "United States of America", "united states": "United States of America",
+        "america": "United States of America", "uk": "United Kingdom", "great britain": "United Kingdom",
+        "britain": "United Kingdom", "england": "United Kingdom", "uae": "United Arab Emirates",
+        "south korea": "Korea, Republic of (South)", "republic of korea": "Korea, Republic of (South)",
+        "north korea": "Korea, Democratic People's Republic of (North)", "viet nam": "Vietnam",
+    },
+    "nationality": {
+        "china": "Chinese", "prc": "Chinese", "mainland chinese": "Chinese", "中国": "Chinese", "中国人": "Chinese",
+        "hong kong": "Hong Konger", "usa": "American", "us": "American", "united states": "American",
+        "south korea": "South Korean", "korea": "Korean", "taiwan": "Taiwanese", "vietnam": "Vietnamese",
+        "viet nam": "Vietnamese", "india": "Indian", "nepal": "Nepalese", "japan": "Japanese",
+        "thailand": "Thai", "indonesia": "Indonesian", "malaysia": "Malaysian", "philippines": "Filipino",
+        "australia": "Australian", "uk": "English", "england": "English",
+    },
+}
+
+def fold(text: str) -> str:
+    """大小写折叠 + 去除重音"""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in text if not unicodedata.combining(c)).strip()
+
+def loose_key(text: str) -> str:
+    """宽松键：去掉括号内容和标点，只保留字母数字"""
+    return NON_WORD_RE.sub(" ", PAREN_RE.sub(" ", fold(text))).strip()
+
+def ngrams(text: str) -> List[str]:
+    padded = f" {loose_key(text)} "
+    return sorted({padded[i:i + NGRAM_SIZE] for i in range(max(1, len(padded) - NGRAM_SIZE + 1))})
+
+def parse_reference(html: str) -> Dict[str, List[str]]:
+    """从 HTML 中解析 Country / Nationality 两个下拉框的选项"""
+    lists: Dict[str, List[str]] = {}
+    for kind, body in SELECT_RE.findall(html):
+        values = [v.strip() for v in OPTION_RE.findall(body) if v.strip()]
+        lists[kind.lower()] = list(dict.fromkeys(values))
+    return lists
+
+def build_index(values: List[str], aliases: Dict[str, str]) -> Dict[str, object]:
+    """预计算：折叠键 / 宽松键 / 别名 -> 序号，以及 n-gram 倒排索引"""
+    keys: Dict[str, int] = {}
+    grams: Dict[str, List[int]] = {}
+    position = {v: i for i, v in enumerate(values)}
+    for i, value in enumerate(values):
+        for key in (fold(value), loose_key(value)):
+            if key:
+                keys.setdefault(key, i)
+        for g in ngrams(value):
+            grams.setdefault(g, []).append(i)
+    for alias, target in aliases.items():
+        if target in position:
+            for key in (fold(alias), loose_key(alias)):
+                if key:
+                    keys.setdefault(key, position[target])
+    return {"values": values, "keys": keys, "grams": grams}
+
+def _source_signature(path: str) -> List[float]:
+    st = os.stat(path)
+    return [st.st_mtime, st.st_size]
+
+def _write_cache(cache_path: str, payload: Dict[str, object]):
+    d = os.path.dirname(cache_path) or "."
+    fd, tmp = tempfile.mkstemp(dir=d, prefix=".nationality-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, cache_path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+def load_index(path: str = REFERENCE_FILE, cache_path: Optional[str] = INDEX_CACHE_FILE) -> Dict[str, Dict[str, object]]:
+    """加载索引；缓存文件与源文件签名一致时跳过 HTML 解析"""
+    signature = _source_signature(path)
+    if cache_path:
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("version") == INDEX_VERSION and cached.get("source") == signature:
+                return cached["lists"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    with open(path, "r", encoding="utf-8") as f:
+        lists = parse_reference(f.read())
+    index = {kind: build_index(values, ALIASES.get(kind, {})) for kind, values in lists.items()}
+    if cache_path:
+        try:
+            _write_cache(cache_path, {"version": INDEX_VERSION, "source": signature, "lists": index})
+        except OSError:
+            pass  # 只读部署目录：下次启动重新解析
+    return index
+
+_INDEX: Optional[Dict[str, Dict[str, object]]] = None
+
+def _get_index(kind: str) -> Dict[str, object]:
+    global _INDEX
+    if _INDEX is None:
+        _INDEX = load_index()
+    return _INDEX[kind]
+
+@lru_cache(maxsize=2048)
+def lookup(kind: str, value: str) -> Tuple[Optional[str], str]:
+    """规范化自由文本；返回 (门户标准值或 None, 匹配方式 exact/alias/fuzzy/none)。
+    fuzzy 只是最接近的候选（如 Holland -> Poland），不能当作同一个值"""
+    index = _get_index(kind)
+    values, keys, grams = index["values"], index["keys"], index["grams"]
+    text = value.strip()
+    if not text:
+        return None, "none"
+    for key in (fold(text), loose_key(text)):
+        if key and key in keys:
+            canonical = values[keys[key]]
+            return canonical, "exact" if canonical == text else "alias"
+
+    # 近似匹配：n-gram 倒排索引取候选，再用 difflib 精排
+    counts: Dict[int, int] = {}
+    for g in ngrams(text):
+        for i in grams.get(g, ()):
+            counts[i] = counts.get(i, 0) + 1
+    if not counts:
+        return None, "none"
+    query = loose_key(text)
+    if not query:
+        return None, "none"
+    best, best_ratio = None, 0.0
+    for i in sorted(counts, key=counts.get, reverse=True)[:FUZZY_CANDIDATES]:
+        ratio = difflib.SequenceMatcher(None, query, loose_key(values[i])).ratio()
+        if ratio > best_ratio:
+            best, best_ratio = values[i], ratio
+    if best_ratio >= FUZZY_MIN_RATIO:
+        return best, "fuzzy"
+    return None, "none"
+
+def normalize_country(value: str) -> Tuple[Optional[str], str]:
+    return lookup("country", value)
+
+def normalize_nationality(value: str) -> Tuple[Optional[str], str]:
+    return lookup("nationality", value)
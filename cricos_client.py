@@ -0,0 +1,611 @@
+# cricos_client.py
+# CRICOS StudentOffers 异步客户端 - 令牌获取 / 刷新、Validate、Submit、先验证后提交，
+# submit_many 并发处理异步迭代器中的报价并按完成顺序产出结果。
+# 安装了 aiohttp 时使用其连接池；否则退回 requests 连接池 + 线程池。错误以 CricosError 抛出。
+# 请求体由 offer_wire 编码一次（可选 gzip、去掉空的可选字段），验证和提交复用同一份字节
+
+import os, json, time, random, asyncio, tempfile
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple, Union
+from urllib.parse import urlencode
+
+# aiohttp 导入耗时上百毫秒，到创建传输层时才加载（见 make_transport）
+_UNLOADED = object()
+aiohttp: Any = _UNLOADED
+
+import offer_metrics as metrics
+from offer_wire import GZIP_MODES, WireBody
+
+DEFAULT_BASE = "https://cricosapi.dotedu.com.au"
+TOKEN_PATH = "/token"
+VALIDATE_PATH = "/api/V1/StudentOffers/Validate"
+SUBMIT_PATH = "/api/V1/StudentOffers"
+STAGE_NAMES = {VALIDATE_PATH: "validate", SUBMIT_PATH: "submit"}
+
+DEFAULT_TOKEN_CACHE = os.environ.get("CRICOS_TOKEN_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "cricos_tokens.json")
+TOKEN_REFRESH_MARGIN = 60   # 到期前多少秒主动刷新（有效期很短时取其一半）
+DEFAULT_TOKEN_TTL = 300     # 响应缺少 expires_in 时的保守有效期
+DEFAULT_TIMEOUT = 120.0
+TOKEN_TIMEOUT = 30.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+THROTTLE_STATUSES = {429, 503}
+# Submit 不是幂等的：只在服务器明确没有处理（限流 / 不可用）或请求还没发出（连接失败）时重试
+SAFE_RETRY_STATUSES = THROTTLE_STATUSES
+
+class CricosError(Exception):
+    """客户端错误基类"""
+
+class TransportError(CricosError):
+    """连接失败或超时（可重试）；sent 为 False 表示连接没有建立，请求一定没有到达服务器"""
+
+    def __init__(self, message: str, sent: bool = True):
+        super().__init__(message)
+        self.sent = sent
+
+class OutcomeUnknown(CricosError):
+    """非幂等请求（Submit）超时、连接中断或返回 500/502/504：服务器可能已经处理，不自动重发，
+    需要人工核对后再提交"""
+
+    def __init__(self, message: str, status: Optional[int] = None, body: Any = None):
+        super().__init__(message)
+        self.status, self.body = status, body
+
+class TokenError(CricosError):
+    def __init__(self, message: str, status: Optional[int] = None, body: Any = None):
+        super().__init__(message)
+        self.status, self.body = status, body
+
+class ApiResponse:
+    __slots__ = ("status", "content", "headers")
+
+    def __init__(self, status: int, content: bytes, headers):
+        self.status, self.content, self.headers = status, content, headers
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", "replace")
+
+    def json_or_text(self) -> Any:
+        try:
+            return json.loads(self.content)
+        except ValueError:
+            return self.text
+
+# ---------------- 传输层 ----------------
+
+class AiohttpTransport:
+    """aiohttp 连接池；会话在首次请求时于当前事件循环中创建"""
+    name = "aiohttp"
+
+    def __init__(self, pool_size: int = 10):
+        self.pool_size = pool_size
+        self._session = None
+
+    async def post(self, url: str, data: bytes, headers: Dict[str, str], timeout: float) -> ApiResponse:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+        try:
+            async with self._session.post(url, data=data, headers=headers,
+                                          timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                return ApiResponse(r.status, await r.read(), r.headers)
+        except aiohttp.ClientConnectorError as e:
+            raise TransportError(f"{type(e).__name__}: {e}", sent=False) from e
+        except aiohttp.ClientError as e:
+            raise TransportError(f"{type(e).__name__}: {e}") from e
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+class ThreadTransport:
+    """没有 aiohttp 时的退路：requests keep-alive 连接池，阻塞调用放到专用线程池中执行。
+    取消只会让等待方立即返回，已发出的请求在线程中继续到超时为止"""
+    name = "threads"
+
+    def __init__(self, pool_size: int = 10):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from concurrent.futures import ThreadPoolExecutor
+        self._requests = requests
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._pool = ThreadPoolExecutor(pool_size, thread_name_prefix="cricos")
+
+    def _post(self, url: str, data: bytes, headers: Dict[str, str], timeout: float) -> ApiResponse:
+        try:
+            r = self._session.post(url, data=data, headers=headers, timeout=timeout)
+        except self._requests.RequestException as e:
+            raise TransportError(f"{type(e).__name__}: {e}", sent=not self._connect_failed(e)) from e
+        return ApiResponse(r.status_code, r.content, r.headers)
+
+    def _connect_failed(self, e: Exception) -> bool:
+        """连接超时或无法建立连接（NewConnectionError）时请求没有发出"""
+        if isinstance(e, self._requests.ConnectTimeout):
+            return True
+        if isinstance(e, self._requests.ConnectionError):
+            from urllib3.exceptions import NewConnectionError
+            reason = getattr(e.args[0], "reason", e.args[0]) if e.args else None
+            return isinstance(reason, NewConnectionError)
+        return False
+
+    async def post(self, url: str, data: bytes, headers: Dict[str, str], timeout: float) -> ApiResponse:
+        return await asyncio.get_running_loop().run_in_executor(self._pool, self._post, url, data, headers, timeout)
+
+    async def close(self):
+        self._pool.shutdown(wait=False)
+        self._session.close()
+
+def _load_aiohttp():
+    global aiohttp
+    if aiohttp is _UNLOADED:
+        try:
+            import aiohttp as module
+        except ImportError:
+            module = None
+        aiohttp = module
+    return aiohttp
+
+def make_transport(pool_size: int = 10):
+    return AiohttpTransport(pool_size) if _load_aiohttp() is not None else ThreadTransport(pool_size)
+
+# ---------------- 自适应并发控制 ----------------
+
+async def _wait(cond: asyncio.Condition, timeout: float):
+    try:
+        await asyncio.wait_for(cond.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+class ApiController:
+    """CRICOS 调用的自适应并发控制：
+    - 抖动指数退避重试，遵循 Retry-After
+    - AIMD：成功且延迟达标时加性增加并发上限，被限流或延迟超标时减半
+    - 熔断：连续失败达到阈值后暂停 cooldown 秒，之后放行单个探测请求
+    """
+
+    def __init__(self, initial: int = 4, min_limit: int = 1, max_limit: int = 16, max_retries: int = 4,
+                 backoff_base: float = 0.5, backoff_cap: float = 30.0, target_latency: float = 5.0,
+                 breaker_threshold: int = 5, breaker_cooldown: float = 30.0):
+        self.min_limit, self.max_limit = min_limit, max(min_limit, max_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.max_retries, self.backoff_base, self.backoff_cap = max_retries, backoff_base, backoff_cap
+        self.target_latency = target_latency
+        self.breaker_threshold, self.breaker_cooldown = breaker_threshold, breaker_cooldown
+        self.in_flight = 0
+        self.state = "closed"
+        self.open_until = 0.0
+        self.consecutive_failures = 0
+        self.last_decrease = 0.0
+        self.latencies = deque(maxlen=2048)
+        self.counts = {"requests": 0, "retries": 0, "throttled": 0, "server_errors": 0,
+                       "connection_errors": 0, "breaker_trips": 0}
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def _effective_limit(self) -> int:
+        return 1 if self.state == "half_open" else int(self.limit)
+
+    async def _acquire(self):
+        cond = self._condition()
+        async with cond:
+            while True:
+                now = time.monotonic()
+                if self.state == "open":
+                    if now < self.open_until:
+                        await _wait(cond, self.open_until - now)
+                        continue
+                    self.state = "half_open"
+                if self.in_flight < self._effective_limit():
+                    self.in_flight += 1
+                    return
+                await _wait(cond, 1.0)
+
+    async def _release(self, latency: Optional[float], status: Optional[int]):
+        cond = self._condition()
+        async with cond:
+            self.in_flight -= 1
+            if status is not False:
+                self._record(latency, status)
+            cond.notify_all()
+
+    def _decrease(self):
+        now = time.monotonic()
+        # 同一轮并发请求的连续限流只减半一次
+        if now - self.last_decrease >= max(1.0, self.percentile(50)):
+            self.limit = max(float(self.min_limit), self.limit / 2)
+            self.last_decrease = now
+
+    def _record(self, latency: Optional[float], status: Optional[int]):
+        self.counts["requests"] += 1
+        if latency is not None:
+            self.latencies.append(latency)
+        failure = status is None or status >= 500
+        if status in THROTTLE_STATUSES:
+            self.counts["throttled"] += 1
+        if status is None:
+            self.counts["connection_errors"] += 1
+        elif status >= 500:
+            self.counts["server_errors"] += 1
+
+        if failure:
+            self.consecutive_failures += 1
+        else:
+            self.consecutive_failures = 0
+
+        if failure and (self.state == "half_open" or self.consecutive_failures >= self.breaker_threshold):
+            if self.state == "closed":
+                self.counts["breaker_trips"] += 1
+                metrics.warn(f"Upstream failing, pausing submissions for {self.breaker_cooldown:g}s",
+                             cooldown=self.breaker_cooldown)
+            self.state = "open"
+            self.open_until = time.monotonic() + self.breaker_cooldown
+            self.limit = float(self.min_limit)
+        elif status in THROTTLE_STATUSES or failure or (latency or 0) > self.target_latency:
+            self._decrease()
+        else:
+            if self.state == "half_open":
+                self.state = "closed"
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / max(self.limit, 1.0))
+
+    def _retry_delay(self, attempt: int, response: Optional[ApiResponse]) -> float:
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                wait = float(retry_after)
+            except ValueError:
+                from email.utils import parsedate_to_datetime
+                try:
+                    wait = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    wait = 0.0
+            delay = max(delay, min(wait, self.backoff_cap * 4))
+        return delay
+
+    async def request(self, send: Callable[[], Any], idempotent: bool = True) -> ApiResponse:
+        """执行 await send()（返回 ApiResponse），按需退避重试；取消时释放占用的并发名额。
+        idempotent 为 False 时只在 429/503 和连接没有建立时重试，其他失败原样返回 / 抛出"""
+        for attempt in range(self.max_retries + 1):
+            await self._acquire()
+            t0 = time.perf_counter()
+            response, error = None, None
+            try:
+                response = await send()
+            except TransportError as e:
+                error = e
+            except BaseException:
+                await asyncio.shield(self._release(None, False))
+                raise
+            await self._release(time.perf_counter() - t0 if error is None else None,
+                                response.status if response is not None else None)
+
+            if idempotent:
+                retryable = error is not None or response.status in RETRY_STATUSES
+            else:
+                retryable = not error.sent if error is not None else response.status in SAFE_RETRY_STATUSES
+            if not retryable or attempt == self.max_retries:
+                if error is not None:
+                    raise error
+                return response
+            self.counts["retries"] += 1
+            await asyncio.sleep(self._retry_delay(attempt, response))
+
+    def percentile(self, q: float) -> float:
+        data = sorted(self.latencies)
+        if not data:
+            return 0.0
+        return data[min(len(data) - 1, int(round(q / 100.0 * (len(data) - 1))))]
+
+    def snapshot(self) -> dict:
+        snap = {"state": self.state, "concurrency_limit": self._effective_limit(),
+                "in_flight": self.in_flight, **self.counts}
+        for q in (50, 95, 99):
+            snap[f"latency_p{q}_ms"] = round(self.percentile(q) * 1000, 1)
+        return snap
+
+# ---------------- 令牌缓存 ----------------
+
+def _token_key(base: str, username: str) -> str:
+    return f"{base.rstrip('/')}|{username}"
+
+def _load_token_store(path: str) -> dict:
+    try:
+        with open(path,"r",encoding="utf-8") as f:
+            store = json.load(f)
+        return store if isinstance(store, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def _save_token_store(path: str, store: dict):
+    d = os.path.dirname(path) or "."
+    os.makedirs(d, mode=0o700, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=d, prefix=".tokens-")
+    try:
+        os.chmod(tmp, 0o600)
+        with os.fdopen(fd,"w",encoding="utf-8") as f:
+            json.dump(store, f)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp): os.unlink(tmp)
+        raise
+
+def _token_fresh(entry) -> bool:
+    if not entry:
+        return False
+    margin = min(TOKEN_REFRESH_MARGIN, entry.get("ttl", DEFAULT_TOKEN_TTL) / 2)
+    return entry.get("expires_at",0) - margin > time.time()
+
+# ---------------- 客户端 ----------------
+
+async def _aiter(offers):
+    if hasattr(offers, "__aiter__"):
+        async for item in offers:
+            yield item
+    else:
+        for item in offers:
+            yield item
+
+async def _anext(iterator) -> Tuple[bool, Any]:
+    try:
+        return True, await iterator.__anext__()
+    except StopAsyncIteration:
+        return False, None
+
+class CricosClient:
+    """async with CricosClient(base, username, password) as client:
+           code, res = await client.validate(offer)
+    Submit 不自动重发：超时、连接中断和 500/502/504 以 OutcomeUnknown 抛出。
+    令牌按 (base, username) 缓存在内存和磁盘（权限 0600，token_cache=None 时只在内存），临近过期自动刷新；
+    接口返回 401 时刷新令牌并重试一次。每个调用可单独指定 timeout（秒）。
+    gzip："off" 不压缩；"on" 总是以 Content-Encoding: gzip 发送；"auto" 只用 Validate 探测：
+    压缩发送，成功（< 400）后 Submit 也压缩；返回 415 时不压缩重发这次 Validate，之后都不再压缩。
+    Submit 不参与探测（服务器确认接受 gzip 之前不压缩），收到 415 也不重发。
+    drop_empty 时不发送值为空的可选字段（见 offer_wire.OPTIONAL_FIELDS）"""
+
+    def __init__(self, base: str = DEFAULT_BASE, username: Optional[str] = None, password: Optional[str] = None,
+                 token_cache: Optional[str] = DEFAULT_TOKEN_CACHE, timeout: float = DEFAULT_TIMEOUT,
+                 token_timeout: float = TOKEN_TIMEOUT, pool_size: int = 10,
+                 controller: Optional[ApiController] = None, transport=None, gzip: str = "off",
+                 drop_empty: bool = False):
+        self.base = base.rstrip("/")
+        self.username = username or os.environ.get("CRICOS_USERNAME")
+        self.password = password or os.environ.get("CRICOS_PASSWORD")
+        if not self.username or not self.password:
+            raise CricosError("CRICOS credentials missing: pass username/password or set CRICOS_USERNAME / CRICOS_PASSWORD")
+        self.token_cache = token_cache
+        self.timeout, self.token_timeout, self.pool_size = timeout, token_timeout, pool_size
+        self.controller = controller or ApiController(initial=pool_size, max_limit=pool_size)
+        if gzip not in GZIP_MODES:
+            raise CricosError(f"Unknown gzip mode '{gzip}' (choose from {', '.join(GZIP_MODES)})")
+        self.gzip, self.drop_empty = gzip, drop_empty
+        self._gzip_accepted: Optional[bool] = None   # auto 模式下服务器是否接受 gzip 请求体（None 为未确定）
+        self._transport = transport   # 首次请求时才创建：只做本地检查的路径不需要加载 HTTP 库
+        self._tokens: Dict[str, Dict[str, Any]] = {}
+        self._token_lock: Optional[asyncio.Lock] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            self._transport = make_transport(max(self.pool_size, self.controller.max_limit))
+        return self._transport
+
+    async def close(self):
+        if self._transport is not None:
+            await self._transport.close()
+
+    async def _post(self, path: str, data: bytes, headers: Dict[str, str], timeout: float) -> ApiResponse:
+        try:
+            return await asyncio.wait_for(self.transport.post(self.base + path, data, headers, timeout), timeout)
+        except asyncio.TimeoutError:
+            raise TransportError(f"{path} timed out after {timeout:g}s") from None
+
+    # ---- 令牌 ----
+
+    async def fetch_token(self) -> Dict[str, Any]:
+        """向 /token 申请新令牌，返回 {"access_token", "expires_at", "ttl"}"""
+        data = urlencode({"grant_type": "password", "username": self.username, "password": self.password}).encode()
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        with metrics.stage("fetch_token") as st:
+            r = await self.controller.request(lambda: self._post(TOKEN_PATH, data, headers, self.token_timeout))
+            st.outcome = f"http_{r.status}"
+        if r.status != 200:
+            raise TokenError(f"Token {r.status}: {r.text}", r.status, r.text)
+        try:
+            payload = json.loads(r.content)
+            token = payload["access_token"]
+        except (ValueError, KeyError, TypeError):
+            raise TokenError(f"Token parse error: {r.text}", r.status, r.text)
+        try: ttl = int(payload.get("expires_in") or DEFAULT_TOKEN_TTL)
+        except (TypeError, ValueError): ttl = DEFAULT_TOKEN_TTL
+        return {"access_token": token, "expires_at": time.time() + ttl, "ttl": ttl}
+
+    async def get_token(self, force_refresh: bool = False, stale: Optional[str] = None) -> str:
+        """内存优先，其次磁盘，最后申请新令牌；stale 为被拒绝的令牌时，
+        若其他调用已经换过新令牌则直接使用，避免并发 401 时重复申请"""
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            with metrics.stage("get_token") as st:
+                key = _token_key(self.base, self.username)
+                entry = self._tokens.get(key)
+                if stale and entry and entry["access_token"] != stale and _token_fresh(entry):
+                    st.outcome = "memory"
+                    return entry["access_token"]
+                if not force_refresh:
+                    st.outcome = "memory"
+                    if not _token_fresh(entry) and self.token_cache:
+                        st.outcome = "disk"
+                        entry = _load_token_store(self.token_cache).get(key)
+                    if _token_fresh(entry):
+                        self._tokens[key] = entry
+                        return entry["access_token"]
+
+                st.outcome = "fetched"
+                entry = await self.fetch_token()
+                self._tokens[key] = entry
+                if self.token_cache:
+                    try:
+                        store = {k:v for k,v in _load_token_store(self.token_cache).items() if _token_fresh(v)}
+                        store[key] = entry
+                        _save_token_store(self.token_cache, store)
+                    except OSError as e:
+                        metrics.warn(f"Token cache not written: {e}")
+                return entry["access_token"]
+
+    # ---- 接口调用 ----
+
+    def encode(self, offer: Any) -> WireBody:
+        """序列化一次；把返回值传给 validate / submit 可复用同一份请求体"""
+        return offer if isinstance(offer, WireBody) else WireBody(offer, self.drop_empty)
+
+    def gzip_body(self, path: str) -> bool:
+        """是否压缩发往 path 的请求体；auto 模式下只有 Validate 在未确定时试探"""
+        if self.gzip != "auto":
+            return self.gzip == "on"
+        return self._gzip_accepted is True or (path == VALIDATE_PATH and self._gzip_accepted is None)
+
+    async def _post_json(self, path: str, token: str, body: bytes, gzipped: bool,
+                         timeout: Optional[float]) -> Tuple[int, Any]:
+        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json",
+                   "Accept": "application/json, text/json"}
+        if gzipped:
+            headers["Content-Encoding"] = "gzip"
+        idempotent = path != SUBMIT_PATH
+        with metrics.stage(STAGE_NAMES.get(path, "api")) as st:
+            try:
+                r = await self.controller.request(lambda: self._post(path, body, headers, timeout or self.timeout),
+                                                  idempotent=idempotent)
+            except TransportError as e:
+                if idempotent or not e.sent:
+                    raise
+                st.outcome = "unknown"
+                raise OutcomeUnknown(f"Submit outcome unknown: {e}; check the portal before resubmitting") from e
+            st.outcome = f"http_{r.status}"
+            st.add_bytes(len(body) + len(r.content))
+        if not idempotent and r.status in RETRY_STATUSES - SAFE_RETRY_STATUSES:
+            raise OutcomeUnknown(f"Submit outcome unknown: HTTP {r.status}; check the portal before resubmitting",
+                                 r.status, r.json_or_text())
+        return r.status, r.json_or_text()
+
+    async def _send(self, path: str, token: str, wire: WireBody, timeout: Optional[float]) -> Tuple[int, Any]:
+        data, gzipped = wire.payload(self.gzip_body(path))
+        wire.sent_bytes = len(data)
+        code, res = await self._post_json(path, token, data, gzipped, timeout)
+        if not gzipped or self.gzip != "auto":
+            return code, res
+        if code == 415:
+            if self._gzip_accepted is not False:
+                metrics.warn("Server rejected a gzip request body (415), sending uncompressed")
+            self._gzip_accepted = False
+            if path != VALIDATE_PATH:
+                return code, res   # Submit 请求体从不重发
+            wire.sent_bytes = len(wire.data)
+            return await self._post_json(path, token, wire.data, False, timeout)
+        if code < 400:
+            self._gzip_accepted = True
+        return code, res
+
+    async def call(self, path: str, offer: Any, timeout: Optional[float] = None) -> Tuple[int, Any]:
+        """带令牌调用接口，返回 (状态码, 响应 JSON 或文本)；401 时刷新令牌并重试一次。
+        offer 可以是报价或 encode() 的结果"""
+        wire = self.encode(offer)
+        token = await self.get_token()
+        code, res = await self._send(path, token, wire, timeout)
+        if code == 401:
+            token = await self.get_token(force_refresh=True, stale=token)
+            code, res = await self._send(path, token, wire, timeout)
+        return code, res
+
+    async def validate(self, offer: Any, timeout: Optional[float] = None) -> Tuple[int, Any]:
+        return await self.call(VALIDATE_PATH, offer, timeout)
+
+    async def submit(self, offer: Any, timeout: Optional[float] = None) -> Tuple[int, Any]:
+        return await self.call(SUBMIT_PATH, offer, timeout)
+
+    async def validate_and_submit(self, offer: Any, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """先 /Validate，通过（< 400）后再提交；两次调用发送同一份请求体"""
+        wire = self.encode(offer)
+        r = {"validate": None, "validate_response": None, "submit": None, "submit_response": None}
+        r["validate"], r["validate_response"] = await self.validate(wire, timeout)
+        if r["validate"] < 400:
+            r["submit"], r["submit_response"] = await self.submit(wire, timeout)
+        r["wire"] = wire.sizes()
+        return r
+
+    async def submit_many(self, offers, concurrency: Optional[int] = None,
+                          validate: Union[bool, Callable[[Any], bool]] = False, submit: bool = True,
+                          timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """并发处理 offers（异步或普通可迭代对象；元素为报价或 (key, 报价)），按完成顺序产出结果：
+        {"key", "offer_id", "validate", "validate_response", "submit", "submit_response", "error", "ok", "seconds",
+         "wire"}，wire 为 {"bytes_before", "bytes_after"}（编码失败时为 None）。
+        validate 可以是布尔值或以 key 为参数的函数；验证返回 >= 400 时不提交。
+        同时进行的报价不超过 concurrency（默认为控制器上限）；提前停止迭代会取消未完成的请求"""
+        concurrency = max(1, concurrency or self.controller.max_limit)
+
+        async def run(key, offer):
+            r = {"key": key, "offer_id": offer.get("OfferId") if isinstance(offer, dict) else None,
+                 "validate": None, "validate_response": None, "submit": None, "submit_response": None,
+                 "error": None, "wire": None}
+            t0 = time.perf_counter()
+            wire = None
+            try:
+                wire = self.encode(offer)
+                if validate(key) if callable(validate) else validate:
+                    r["validate"], r["validate_response"] = await self.validate(wire, timeout)
+                if submit and (r["validate"] is None or r["validate"] < 400):
+                    r["submit"], r["submit_response"] = await self.submit(wire, timeout)
+            except Exception as e:
+                r["error"] = str(e) or type(e).__name__
+                if isinstance(e, OutcomeUnknown):
+                    r["outcome_unknown"] = True
+            if wire is not None:
+                r["wire"] = wire.sizes()
+            r["seconds"] = time.perf_counter() - t0
+            final = r["submit"] if submit else r["validate"]
+            r["ok"] = r["error"] is None and final is not None and final < 400
+            return r
+
+        source = _aiter(offers)
+        pending: set = set()
+        next_item: Optional[asyncio.Future] = None
+        exhausted = False
+        try:
+            while True:
+                if not exhausted and next_item is None and len(pending) < concurrency:
+                    next_item = asyncio.ensure_future(_anext(source))
+                waiting = pending | ({next_item} if next_item else set())
+                if not waiting:
+                    return
+                done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if next_item in done:
+                    more, item = next_item.result()
+                    next_item = None
+                    if more:
+                        key, offer = item if isinstance(item, tuple) else (None, item)
+                        pending.add(asyncio.ensure_future(run(key, offer)))
+                    else:
+                        exhausted = True
+                for task in done:
+                    if task in pending:
+                        pending.discard(task)
+                        yield task.result()
+        finally:
+            leftovers = list(pending) + ([next_item] if next_item else [])
+            for task in leftovers:
+                task.cancel()
+            if leftovers:
+                await asyncio.gather(*leftovers, return_exceptions=True)
@@ -0,0 +1,404 @@
+# cricos_standin.py
+# 本地 CRICOS API 替身与压测驱动 - 离线评估提交并发
+#   serve：实现 /token、/api/V1/StudentOffers/Validate、/api/V1/StudentOffers，
+#          可配置延迟分布、错误率 / 429 比例、令牌有效期与服务端容量
+#   drive：以目标速率重放 N 个报价（走 cricos_client 的真实调用路径），
+#          报告吞吐、p50/p95/p99 延迟和错误分类；--concurrency 可给多个值做并发扫描
+
+import os, json, gzip, math, time, random, asyncio, secrets, argparse, threading
+from collections import Counter
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import offer_metrics as metrics
+from offer_wire import GZIP_MODES
+
+DEFAULT_PORT = 8780
+TOKEN_PATH = "/token"
+VALIDATE_PATH = "/api/V1/StudentOffers/Validate"
+SUBMIT_PATH = "/api/V1/StudentOffers"
+STATS_PATH = "/__stats"
+ENDPOINTS = {TOKEN_PATH: "token", VALIDATE_PATH: "validate", SUBMIT_PATH: "submit"}
+DENIED_MESSAGE = "Authorization has been denied for this request."
+
+# ---------------- 延迟分布 ----------------
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """延迟分布（秒）：'0.05' / 'fixed:0.05' / 'uniform:LO,HI' / 'normal:MEAN,SD' /
+    'lognormal:MEDIAN,SIGMA' / 'exp:MEAN'"""
+    kind, _, args = spec.partition(":")
+    if not args:
+        kind, args = "fixed", kind
+    try:
+        values = [float(v) for v in args.split(",")]
+    except ValueError:
+        raise ValueError(f"Invalid latency spec '{spec}'")
+    expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exp": 1}
+    if expected.get(kind) != len(values) or any(v < 0 for v in values):
+        raise ValueError(f"Invalid latency spec '{spec}' (e.g. fixed:0.05, uniform:0.02,0.2, "
+                         f"normal:0.1,0.03, lognormal:0.08,0.5, exp:0.1)")
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        mu = math.log(values[0]) if values[0] > 0 else 0.0
+        return lambda rng: rng.lognormvariate(mu, values[1]) if values[0] > 0 else 0.0
+    return lambda rng: rng.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(math.ceil(q / 100.0 * len(sorted_values))) - 1)]
+
+# ---------------- 替身服务 ----------------
+
+class UnsupportedEncoding(Exception):
+    """--reject-gzip 时收到 gzip 请求体"""
+
+class StandinState:
+    """替身服务的配置与运行状态（令牌表、按端点 / 状态码的计数）"""
+
+    def __init__(self, latency: str = "lognormal:0.08,0.5", validate_latency: Optional[str] = None,
+                 submit_latency: Optional[str] = None, token_latency: str = "fixed:0.05",
+                 error_rate: float = 0.0, throttle_rate: float = 0.0, retry_after: float = 1.0,
+                 token_ttl: int = 3600, capacity: int = 0, strict: bool = False, seed: Optional[int] = None,
+                 reject_gzip: bool = False):
+        self.latency = {
+            "validate": parse_latency(validate_latency or latency),
+            "submit": parse_latency(submit_latency or latency),
+            "token": parse_latency(token_latency),
+        }
+        self.error_rate, self.throttle_rate, self.retry_after = error_rate, throttle_rate, retry_after
+        self.token_ttl = token_ttl
+        self.strict, self.reject_gzip = strict, reject_gzip
+        self.rng = random.Random(seed)
+        # 容量满时请求排队等待，模拟服务端处理能力；0 表示不限
+        self.capacity = threading.BoundedSemaphore(capacity) if capacity > 0 else None
+        self.tokens: Dict[str, float] = {}
+        self.counts: Counter = Counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.request_bytes: Counter = Counter()   # 按端点统计收到的请求体字节数（解压前）
+        self.lock = threading.Lock()
+
+    def issue_token(self) -> Tuple[str, int]:
+        token = secrets.token_urlsafe(24)
+        with self.lock:
+            now = time.time()
+            self.tokens = {t: exp for t, exp in self.tokens.items() if exp > now}
+            self.tokens[token] = now + self.token_ttl
+        return token, self.token_ttl
+
+    def token_valid(self, token: str) -> bool:
+        with self.lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            counts: Dict[str, Dict[str, int]] = {}
+            for (endpoint, status), n in sorted(self.counts.items()):
+                counts.setdefault(endpoint, {})[str(status)] = n
+            return {"counts": counts, "request_bytes": dict(self.request_bytes),
+                    "in_flight": self.in_flight, "peak_in_flight": self.peak_in_flight,
+                    "live_tokens": sum(1 for exp in self.tokens.values() if exp > time.time())}
+
+def make_handler(state: StandinState):
+    class StandinHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True   # 否则小响应会叠加约 40ms 的延迟确认，测出的不是配置的延迟
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, endpoint: str, status: int, payload: Any, headers: Optional[Dict[str, str]] = None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            with state.lock:
+                state.counts[(endpoint, status)] += 1
+
+        def _read_body(self, endpoint: Optional[str]) -> bytes:
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            with state.lock:
+                state.request_bytes[endpoint or "other"] += len(body)
+            if self.headers.get("Content-Encoding", "").lower() == "gzip":
+                if state.reject_gzip:
+                    raise UnsupportedEncoding()
+                body = gzip.decompress(body)
+            return body
+
+        def do_GET(self):
+            if self.path == STATS_PATH:
+                return self._send("stats", 200, state.snapshot())
+            self._send("other", 404, {"Message": f"No HTTP resource was found that matches '{self.path}'."})
+
+        def do_POST(self):
+            endpoint = ENDPOINTS.get(self.path.split("?", 1)[0])
+            try:
+                body = self._read_body(endpoint)
+            except UnsupportedEncoding:
+                return self._send(endpoint or "other", 415, {"Message": "Content-Encoding gzip is not supported"},
+                                  {"Accept-Encoding": "identity"})
+            except (OSError, ValueError):
+                return self._send(endpoint or "other", 400, {"Message": "Unreadable request body"})
+            if endpoint is None:
+                return self._send("other", 404, {"Message": f"No HTTP resource was found that matches '{self.path}'."})
+            with metrics.stage("standin", endpoint=endpoint) as st:
+                with state.lock:
+                    state.in_flight += 1
+                    state.peak_in_flight = max(state.peak_in_flight, state.in_flight)
+                try:
+                    st.outcome = f"http_{self._handle(endpoint, body)}"
+                finally:
+                    with state.lock:
+                        state.in_flight -= 1
+
+        def _handle(self, endpoint: str, body: bytes) -> int:
+            if endpoint == "token":
+                form = parse_qs(body.decode("utf-8", "replace"))
+                time.sleep(state.latency["token"](state.rng))
+                if form.get("grant_type") != ["password"] or not form.get("username"):
+                    self._send(endpoint, 400, {"error": "unsupported_grant_type"})
+                    return 400
+                token, ttl = state.issue_token()
+                self._send(endpoint, 200, {"access_token": token, "token_type": "bearer", "expires_in": ttl})
+                return 200
+
+            auth = self.headers.get("Authorization", "")
+            if not auth.startswith("Bearer ") or not state.token_valid(auth[7:]):
+                self._send(endpoint, 401, {"Message": DENIED_MESSAGE})
+                return 401
+
+            roll = state.rng.random()
+            if roll < state.throttle_rate:
+                self._send(endpoint, 429, {"Message": "Too many requests"}, {"Retry-After": f"{state.retry_after:g}"})
+                return 429
+
+            with state.capacity or nullcontext():
+                time.sleep(state.latency[endpoint](state.rng))
+            if roll < state.throttle_rate + state.error_rate:
+                self._send(endpoint, 500, {"Message": "An error has occurred."})
+                return 500
+
+            try:
+                offer = json.loads(body)
+            except ValueError:
+                self._send(endpoint, 400, {"Message": "The request is invalid.", "ModelState": {"offer": ["Invalid JSON"]}})
+                return 400
+            if not isinstance(offer, dict):
+                self._send(endpoint, 400, {"Message": "The request is invalid.", "ModelState": {"offer": ["Expected an object"]}})
+                return 400
+
+            if state.strict:
+                from offer_rules import validate_offer
+                violations = validate_offer(offer)
+                if violations:
+                    model_state: Dict[str, List[str]] = {}
+                    for where, message in violations:
+                        model_state.setdefault(where.lstrip("$."), []).append(message)
+                    self._send(endpoint, 400, {"Message": "The request is invalid.", "ModelState": model_state})
+                    return 400
+
+            if endpoint == "validate":
+                self._send(endpoint, 200, {"IsValid": True, "OfferId": offer.get("OfferId"), "Errors": []})
+            else:
+                self._send(endpoint, 200, {"OfferId": offer.get("OfferId"),
+                                           "StudentOfferId": f"SO{state.rng.randrange(10 ** 8):08d}"})
+            return 200
+
+    return StandinHandler
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+def serve(host: str, port: int, state: StandinState) -> StandinServer:
+    """创建（不启动）替身服务；调用方执行 serve_forever()，或放进线程里用于测试"""
+    return StandinServer((host, port), make_handler(state))
+
+# ---------------- 压测驱动 ----------------
+
+def load_offers(paths: List[str], n: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """读取报价文件 / 目录；未给出路径时用基准套件的生成器合成"""
+    if paths:
+        from submit_offer import iter_bulk_offers
+        offers = [offer for _, offer, error in iter_bulk_offers(paths) if error is None and isinstance(offer, dict)]
+        if not offers:
+            raise SystemExit("[ERROR] No loadable offers in the given paths")
+        return offers
+    from bench_offer_pipeline import config_pool
+    from compose_offer_robust import coerce_student_offer_from_config
+    return [coerce_student_offer_from_config(c)[0] for c in config_pool(min(n, 500), seed=seed)]
+
+async def run_load(base: str, offers: List[Dict[str, Any]], n: int, rate: float, concurrency: int,
+                   mode: str = "submit", adaptive: bool = False, max_retries: int = 4, gzip_mode: str = "off",
+                   drop_empty: bool = False) -> Dict[str, Any]:
+    """重放 n 个报价（循环使用 offers）。rate > 0 时按固定间隔开环发送，延迟从计划发送时刻算起，
+    因此包含排队时间；rate = 0 时尽快发送，延迟从实际开始时刻算起"""
+    from cricos_client import ApiController, CricosClient
+    controller = ApiController(initial=concurrency, max_limit=concurrency * 2 if adaptive else concurrency,
+                               max_retries=max_retries)
+
+    async def schedule():
+        begin = time.perf_counter()
+        for i in range(n):
+            scheduled = None
+            if rate > 0:
+                scheduled = begin + i / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield scheduled, offers[i % len(offers)]
+
+    results = []
+    wire_before = wire_after = 0
+    async with CricosClient(base, "loadtest", "loadtest", token_cache=None, controller=controller,
+                            gzip=gzip_mode, drop_empty=drop_empty) as client:
+        await client.get_token()
+        start = time.perf_counter()
+        async for r in client.submit_many(schedule(), validate=mode in ("validate", "both"), submit=mode != "validate"):
+            done = time.perf_counter()
+            if r["error"]:
+                outcome = r["error"].split(":", 1)[0]
+            else:
+                outcome = f"http_{r['submit'] if r['submit'] is not None else r['validate']}"
+            scheduled = r["key"] if r["key"] is not None else done - r["seconds"]
+            results.append((outcome, done - scheduled, r["seconds"]))
+            if r["wire"]:
+                wire_before += r["wire"]["bytes_before"]
+                wire_after += r["wire"]["bytes_after"]
+        elapsed = time.perf_counter() - start
+
+    outcomes = Counter(r[0] for r in results)
+    latencies = sorted(r[1] for r in results)
+    service = sorted(r[2] for r in results)
+    ok = sum(n for outcome, n in outcomes.items() if outcome.startswith("http_") and int(outcome[5:]) < 400)
+    report = {
+        "mode": mode, "offers": n, "target_rate": rate, "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput": round(n / elapsed, 2) if elapsed else None,
+        "ok": ok, "failed": n - ok,
+        "gzip": gzip_mode, "drop_empty": drop_empty, "wire_bytes_before": wire_before, "wire_bytes_after": wire_after,
+        "outcomes": dict(outcomes.most_common()),
+        "controller": controller.snapshot(),
+    }
+    for label, values in (("latency", latencies), ("service", service)):
+        for q in (50, 95, 99):
+            report[f"{label}_p{q}_ms"] = round(percentile(values, q) * 1000, 1)
+        report[f"{label}_max_ms"] = round(values[-1] * 1000, 1) if values else 0.0
+    return report
+
+def fetch_server_stats(base: str) -> Optional[Dict[str, Any]]:
+    import requests
+    try:
+        r = requests.get(f"{base.rstrip('/')}{STATS_PATH}", timeout=5)
+        return r.json() if r.status_code == 200 else None
+    except (requests.RequestException, ValueError):
+        return None
+
+def print_load_table(reports: List[Dict[str, Any]]):
+    print(f"\n{'conc':>5} {'offers':>7} {'secs':>8} {'thru/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'ok':>6} {'retries':>7} {'429s':>5}  errors")
+    for r in reports:
+        errors = ", ".join(f"{k}={v}" for k, v in r["outcomes"].items() if not (k.startswith("http_") and int(k[5:]) < 400))
+        print(f"{r['concurrency']:>5} {r['offers']:>7} {r['seconds']:>8.2f} {r['throughput'] or 0:>8.1f} "
+              f"{r['latency_p50_ms']:>8.1f} {r['latency_p95_ms']:>8.1f} {r['latency_p99_ms']:>8.1f} "
+              f"{r['ok']:>6} {r['controller']['retries']:>7} {r['controller']['throttled']:>5}  {errors or '-'}")
+
+# ---------------- 命令行 ----------------
+
+def build_parser():
+    p = argparse.ArgumentParser(description="Local CRICOS API stand-in and load-test driver")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    s = sub.add_parser("serve", help="Run the stand-in API server")
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--port", type=int, default=DEFAULT_PORT)
+    s.add_argument("--latency", default="lognormal:0.08,0.5",
+                   help="Latency distribution for Validate and Submit, in seconds "
+                        "(fixed:S, uniform:LO,HI, normal:MEAN,SD, lognormal:MEDIAN,SIGMA, exp:MEAN)")
+    s.add_argument("--validate-latency", help="Override --latency for Validate")
+    s.add_argument("--submit-latency", help="Override --latency for Submit")
+    s.add_argument("--token-latency", default="fixed:0.05", help="Latency distribution for /token")
+    s.add_argument("--error-rate", type=float, default=0.0, help="Fraction of API calls answered with 500")
+    s.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of API calls answered with 429")
+    s.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429")
+    s.add_argument("--token-ttl", type=int, default=3600, help="Token lifetime (s); expired tokens get 401")
+    s.add_argument("--capacity", type=int, default=0, help="Requests processed concurrently; extra requests queue (0 = unlimited)")
+    s.add_argument("--strict", action="store_true", help="Reject offers failing the local rules with 400")
+    s.add_argument("--reject-gzip", action="store_true",
+                   help="Answer gzip-encoded request bodies with 415 (exercises the client's gzip fallback)")
+    s.add_argument("--seed", type=int, help="Random seed for latency and error injection")
+    metrics.add_arguments(s)
+
+    d = sub.add_parser("drive", help="Replay offers against a server and report latency/throughput")
+    d.add_argument("--base", default=f"http://127.0.0.1:{DEFAULT_PORT}")
+    d.add_argument("--offers", nargs="+", metavar="PATH", default=[],
+                   help="Offer .json/.jsonl files or directories (default: synthetic offers)")
+    d.add_argument("-n", "--count", type=int, default=1000, help="Offers to replay (inputs are cycled)")
+    d.add_argument("--rate", type=float, default=0.0, help="Target offers/s (0 = as fast as possible)")
+    d.add_argument("--concurrency", default="8", help="In-flight limit; comma-separated values run a sweep")
+    d.add_argument("--mode", choices=("submit", "validate", "both"), default="submit",
+                   help="Submit only, Validate only, or Validate then Submit")
+    d.add_argument("--adaptive", action="store_true", help="Let the AIMD controller grow up to 2x --concurrency")
+    d.add_argument("--max-retries", type=int, default=4)
+    d.add_argument("--gzip", choices=GZIP_MODES, default="off", help="Request body compression (see submit_offer.py)")
+    d.add_argument("--drop-empty", action="store_true", help="Do not send empty optional fields")
+    d.add_argument("--report", help="Write the reports (and server stats) as JSON")
+    metrics.add_arguments(d)
+    return p
+
+def main():
+    args = build_parser().parse_args()
+
+    if args.command == "serve":
+        metrics.configure(args.log_level, args.log_format, args.metrics, service="standin")
+        try:
+            state = StandinState(args.latency, args.validate_latency, args.submit_latency, args.token_latency,
+                                 args.error_rate, args.throttle_rate, args.retry_after, args.token_ttl,
+                                 args.capacity, args.strict, args.seed, args.reject_gzip)
+        except ValueError as e:
+            raise SystemExit(f"[ERROR] {e}")
+        server = serve(args.host, args.port, state)
+        metrics.info(f"CRICOS stand-in listening on http://{args.host}:{server.server_address[1]}",
+                     port=server.server_address[1])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            print(json.dumps(state.snapshot(), indent=2))
+        return
+
+    metrics.configure(args.log_level, args.log_format, args.metrics, service="loadtest")
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    offers = load_offers(args.offers, args.count)
+    metrics.info(f"Replaying {args.count} offers ({len(offers)} distinct) against {args.base}")
+    reports = []
+    for level in levels:
+        reports.append(asyncio.run(run_load(args.base, offers, args.count, args.rate, max(1, level), args.mode,
+                                            args.adaptive, args.max_retries, args.gzip, args.drop_empty)))
+        r = reports[-1]
+        metrics.info(f"concurrency {r['concurrency']}: {r['throughput']} offers/s, "
+                     f"p50 {r['latency_p50_ms']} ms, p99 {r['latency_p99_ms']} ms, {r['failed']} failed",
+                     **{k: v for k, v in r.items() if k not in ("outcomes", "controller")})
+    print_load_table(reports)
+    server_stats = fetch_server_stats(args.base)
+    if args.report:
+        from offer_output import write_json
+        write_json(args.report, {"base": args.base, "reports": reports, "server": server_stats})
+        metrics.info(f"Report written to {os.path.abspath(args.report)}")
+
+if __name__ == "__main__":
+    main()
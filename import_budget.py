@@ -0,0 +1,115 @@
+# import_budget.py
+# 冷启动预算 - 用 python -X importtime 测量各命令行入口的导入耗时，并检查不应在该路径上加载的模块
+#
+# 用法：
+#   python import_budget.py                全部检查；超出预算或加载了禁止的模块时退出码为 1
+#   python import_budget.py --top 8        另外列出每项中最慢的顶层导入
+#   python import_budget.py --scale 1.5    按比例放宽预算（较慢的 CI 机器）
+#
+# 只统计解释器启动（site 及 .pth 文件）之后的导入，预算取 --repeat 次运行中的最小值。
+# 测量前先在允许写字节码的环境下预热一次，编译 .py 的时间不计入（PYTHONDONTWRITEBYTECODE 会被忽略）。
+#
+# 重的依赖只在用到它们的路径上加载：
+#   chardet             BOM / UTF-8 都判断不了编码时（compose_offer_robust._load_chardet）
+#   yaml                首次解析 YAML 时（compose_offer_robust._load_yaml）
+#   base64              --yaml-base64 / 服务请求中的 yaml_base64（PyYAML 本身也会导入）
+#   csv、hashlib        SharePoint CSV 导出
+#   concurrent.futures  --batch 多进程 / --watch
+#   http.server         --serve
+#   sqlite3             --ledger
+#   requests / aiohttp  首次发出 HTTP 请求时（cricos_client.CricosClient.transport）
+#   cProfile、tracemalloc  --profile / --trace-memory（offer_profile.start）
+
+import os, sys, argparse, subprocess, tempfile
+from typing import Dict, List, Optional, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+COMPOSE_LAZY = ("chardet", "http.server", "socketserver", "concurrent.futures", "base64", "csv",
+                "sqlite3", "requests", "aiohttp", "cProfile", "pstats", "tracemalloc")
+SUBMIT_LAZY = ("chardet", "yaml", "http.server", "sqlite3", "requests", "aiohttp", "cProfile", "pstats", "tracemalloc")
+
+# (名称, python 参数, 预算毫秒, 不应加载的模块)；{tmp} 替换为临时目录
+CHECKS: List[Tuple[str, List[str], float, Tuple[str, ...]]] = [
+    ("import compose_offer_robust", ["-c", "import compose_offer_robust"], 50, COMPOSE_LAZY + ("yaml",)),
+    ("compose --help", ["compose_offer_robust.py", "--help"], 60, COMPOSE_LAZY + ("yaml",)),
+    # PyYAML 自己会导入 base64（!!binary），解析 YAML 的路径上不检查它
+    ("compose --quick", ["compose_offer_robust.py", "--quick", "--out", "{tmp}/quick.json", "--log-level", "off"],
+     80, tuple(m for m in COMPOSE_LAZY if m != "base64")),
+    ("import cricos_client", ["-c", "import cricos_client"], 100, ("requests", "aiohttp", "email.utils")),
+    ("import submit_offer", ["-c", "import submit_offer"], 130, SUBMIT_LAZY),
+    ("submit --help", ["submit_offer.py", "--help"], 140, SUBMIT_LAZY),
+]
+
+ImportLine = Tuple[int, int, str]   # (深度, 累计微秒, 模块名)
+
+def parse_importtime(stderr: str) -> List[ImportLine]:
+    """解析 -X importtime 输出，只保留最后一个顶层 site 之后的记录"""
+    lines: List[ImportLine] = []
+    for raw in stderr.splitlines():
+        if not raw.startswith("import time:"):
+            continue
+        parts = raw[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue   # 表头
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if depth == 0 and name == "site":
+            lines.clear()
+            continue
+        lines.append((depth, int(parts[1]), name))
+    return lines
+
+def measure(args: List[str], env: Dict[str, str]) -> Tuple[float, List[ImportLine]]:
+    proc = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=HERE, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        tail = "\n".join(l for l in proc.stderr.splitlines() if not l.startswith("import time:"))[-500:]
+        raise RuntimeError(f"{' '.join(args)} exited with {proc.returncode}: {tail}")
+    lines = parse_importtime(proc.stderr)
+    return sum(cum for depth, cum, _ in lines if depth == 0) / 1000.0, lines
+
+def run_checks(repeat: int, scale: float, top: int, only: Optional[str]) -> int:
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    failures = 0
+    print(f"{'check':<30} {'best ms':>8} {'budget':>8}  result")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, args, budget, lazy in CHECKS:
+            if only and only not in name:
+                continue
+            args = [a.replace("{tmp}", tmp) for a in args]
+            subprocess.run([sys.executable, *args], cwd=HERE, env=env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)   # 预热字节码缓存
+            runs = [measure(args, env) for _ in range(repeat)]
+            best, lines = min(runs, key=lambda r: r[0])
+            loaded = {n for _, run_lines in runs for _, _, n in run_lines}
+            eager = [m for m in lazy if m in loaded]
+            limit = budget * scale
+            problems = ([f"over budget by {best - limit:.1f} ms"] if best > limit else []) + \
+                       ([f"loaded {', '.join(eager)}"] if eager else [])
+            failures += bool(problems)
+            print(f"{name:<30} {best:>8.1f} {limit:>8.0f}  {'; '.join(problems) or 'ok'}")
+            if top:
+                # -c "import X" 只有一个顶层记录，改为列出它的直接依赖
+                level = 1 if sum(1 for l in lines if l[0] == 0) == 1 else 0
+                for _, cum, module in sorted((l for l in lines if l[0] == level), key=lambda l: -l[1])[:top]:
+                    print(f"{'':<4}{module:<40} {cum / 1000.0:>8.1f} ms")
+    return failures
+
+def main():
+    p = argparse.ArgumentParser(description="Check cold-start import time of the command-line entry points")
+    p.add_argument("--repeat", type=int, default=5, help="Runs per check; the fastest one is compared (default 5)")
+    p.add_argument("--scale", type=float, default=1.0, help="Multiply every budget by this factor")
+    p.add_argument("--top", type=int, default=0, help="Also list the N slowest top-level imports per check")
+    p.add_argument("--only", help="Run only checks whose name contains this text")
+    args = p.parse_args()
+    failures = run_checks(max(1, args.repeat), args.scale, args.top, args.only)
+    if failures:
+        print(f"[ERROR] {failures} check(s) failed")
+        sys.exit(1)
+    print("[SUCCESS] All entry points within budget")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+# offer_columnar.py
+# 列式批量生成 - 把一批配置中的课程、教育 / 工作经历行按字段收集成列，费用、校区、年份等数值列
+# 和日期列用 NumPy 成批转换，再逐行组装出与 coerce_student_offer_from_config 完全相同的报价。
+# 每列只转换其中不同的取值；NumPy 不可用或向量化转换失败时退回原有的逐个转换函数
+
+import gc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import compose_offer_robust as compose
+from compose_offer_robust import _MISSING, IF_SET, OR_NONE, _to_float, _to_int, to_iso8601
+
+Result = Tuple[Optional[Dict[str, Any]], List[str], Optional[Exception]]   # (报价, 自动修正说明, 异常)
+
+NUMERIC_DTYPES = {_to_float: "float64", _to_int: "int64"}
+
+def _per_value(values: List[Any], scalar: Callable[[Any], Any]) -> List[Any]:
+    """逐个转换；同一列中相同的字符串只转换一次"""
+    done: Dict[str, Any] = {}
+    out = []
+    for v in values:
+        if v.__class__ is str:
+            r = done.get(v, _MISSING)
+            if r is _MISSING:
+                r = done[v] = scalar(v)
+        else:
+            r = scalar(v)
+        out.append(r)
+    return out
+
+def _numbers(values: List[Any], func, extra: Tuple, scalar: Callable[[Any], Any]) -> List[Any]:
+    """_to_float / _to_int 的向量化版本：空值先换成默认结果，其余交给 NumPy 一次转换。
+    NumPy 的字符串 / 数字转换规则与 float() / int() 相同；有值转换失败时整列逐个转换"""
+    empty, missing = func(None, *extra), scalar(_MISSING)
+    filled = [missing if v is _MISSING else empty if v is None or v == "" else v for v in values]
+    try:
+        arr = np.array(filled, dtype=NUMERIC_DTYPES[func])
+        if arr.shape == (len(filled),):
+            return arr.tolist()
+    except (TypeError, ValueError, OverflowError):
+        pass
+    return _per_value(values, scalar)
+
+def _iso_candidate(s: str) -> Optional[str]:
+    """日期快速路径（compose._fast_date_text）能识别的字符串，改写为 NumPy 可直接解析的本地时间文本；
+    其他格式返回 None，交给逐个转换"""
+    m = compose.ISO_DATETIME_RE.fullmatch(s)
+    if m:
+        year, _, _, hour, minute, second, _, tz, tz_h, tz_m = m.groups()
+        if year < "1000" or (tz_h is not None and (tz_h > "23" or tz_m > "59")):
+            return None
+        if hour is not None and (hour > "23" or minute > "59" or (second or "00") > "59"):
+            return None
+        # 快速路径忽略时区、保留本地时间，这里同样去掉时区后缀
+        return s[:m.start(8)] if tz else s
+    m = compose.DMY_RE.fullmatch(s)
+    if m:
+        day, month, year = m.groups()
+        return None if year < "1000" else f"{year}-{int(month):02d}-{int(day):02d}"
+    return None
+
+def _dates(values: List[Any], scalar: Callable[[Any], Any], memo: Dict[str, str]) -> List[Any]:
+    """to_iso8601 的向量化版本：memo 中没有的日期字符串去重后用 datetime64[ms] 一次解析并格式化
+    （毫秒截断，与快速路径一致）；时间戳、空值和其他格式逐个转换。
+    memo 跨块保留解析结果（与逐条路径的字段 memo 一样，只记可解析的字符串，最多 FIELD_MEMO_SIZE 个）"""
+    out = [memo.get(v, _MISSING) if v.__class__ is str else scalar(v) for v in values]
+    if _MISSING not in out:
+        return out
+    table: Dict[str, Any] = {}
+    keys, texts = [], []
+    for v in dict.fromkeys(v for v, r in zip(values, out) if r is _MISSING):
+        text = _iso_candidate(v.strip())
+        if text is None:
+            table[v] = scalar(v)
+        else:
+            keys.append(v)
+            texts.append(text)
+    if texts:
+        try:
+            parsed = np.datetime_as_string(np.array(texts, dtype="datetime64[ms]"), unit="ms").tolist()
+        except ValueError:
+            # 含无效日期（如 2 月 30 日）：逐个转换，无效值走原有的慢速路径和默认值
+            parsed = None
+        for n, v in enumerate(keys):
+            if parsed:
+                table[v] = parsed[n] + "+10:00"
+                if len(memo) < compose.FIELD_MEMO_SIZE:
+                    memo[v] = table[v]
+            else:
+                table[v] = scalar(v)
+    return [table[v] if r is _MISSING else r for v, r in zip(values, out)]
+
+def _vector_kind(coerce) -> Optional[str]:
+    func, extra = (coerce[0], coerce[1:]) if isinstance(coerce, tuple) else (coerce, ())
+    if func in NUMERIC_DTYPES:
+        return "number"
+    if func is to_iso8601 and not extra:
+        return "date"
+    return None
+
+def _column(source: str, coerce, default, mode) -> Callable[[List[Dict[str, Any]]], List[Any]]:
+    """一个需要转换的字段：srcs -> 结果列，语义与 compile_entity_builder 生成的对应表达式相同"""
+    func, extra = (coerce[0], coerce[1:]) if isinstance(coerce, tuple) else (coerce, ())
+    scalar = lambda v: func(default, *extra) if v is _MISSING else func(v, *extra)
+    kind = _vector_kind(coerce)
+    if kind == "number":
+        convert = lambda vals: _numbers(vals, func, extra, scalar)
+    elif kind == "date":
+        memo: Dict[str, str] = {}
+        convert = lambda vals: _dates(vals, scalar, memo)
+    else:
+        convert = lambda vals: _per_value(vals, scalar)
+
+    if mode == IF_SET:
+        def column(srcs):
+            raw = [s.get(source) for s in srcs]
+            converted = iter(convert([v for v in raw if v]))
+            return [next(converted) if v else '' for v in raw]
+    elif mode == OR_NONE:
+        def column(srcs):
+            return convert([s.get(source) or None for s in srcs])
+    else:
+        def column(srcs):
+            return convert([s.get(source, _MISSING) for s in srcs])
+    return column
+
+def compile_columnar_builder(name: str, fields):
+    """build(srcs, offer_ids) -> [dict]，结果与对每行调用 compile_entity_builder 生成的函数相同。
+    需要转换的字段先整列转换，其余字段与行组装一起在生成的推导式中完成"""
+    ns: Dict[str, Any] = {}
+    columns, names, parts = [], [], ['"OfferId": o']
+    for i, (target, source, coerce, default, mode) in enumerate(fields):
+        if coerce is None:
+            ns[f"d{i}"] = default
+            parts.append(f"{target!r}: s.get({source!r}, d{i})")
+        else:
+            columns.append(_column(source, coerce, default, mode))
+            names.append(f"v{i}")
+            parts.append(f"{target!r}: v{i}")
+    ns["columns"] = columns
+    code = (f"def {name}(srcs, offer_ids):\n"
+            f"    cols = [column(srcs) for column in columns]\n"
+            f"    return [{{{', '.join(parts)}}} for s, o{''.join(', ' + n for n in names)} in zip(srcs, offer_ids, *cols)]")
+    exec(code, ns)
+    return ns[name]
+
+# 只有含数值 / 日期字段的实体走列式构建（地址、残障信息没有需要转换的列，逐行构建即可）
+COLUMNAR_BUILDERS = {target: compile_columnar_builder(f"columnar_{source}", fields)
+                     for target, source, fields, _ in compose.LIST_ENTITIES
+                     if any(f[2] is not None and _vector_kind(f[2]) for f in fields)}
+
+def _coerce_one(config: Any) -> Result:
+    try:
+        offer, issues = compose.coerce_student_offer_from_config(config)
+        return offer, issues, None
+    except Exception as e:
+        return None, [], e
+
+def coerce_configs(configs: List[Any]) -> List[Result]:
+    """批量生成，结果顺序与输入相同；每行的报价和自动修正说明与逐条生成一致，某行出错只影响该行"""
+    if np is None:
+        return [_coerce_one(c) for c in configs]
+    # 报价只由 dict / list / 标量组成，不会产生循环引用；整块存活的大量新对象会反复触发
+    # 分代垃圾回收的全量扫描，因此块内暂停回收
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _coerce_chunk(configs)
+    finally:
+        if enabled:
+            gc.enable()
+
+def _coerce_chunk(configs: List[Any]) -> List[Result]:
+    results: List[Optional[Result]] = [None] * len(configs)
+    prepared = []   # (下标, 配置, 报价编号, 按 LIST_ENTITIES 顺序的源行列表)
+    for i, config in enumerate(configs):
+        try:
+            offer_id = compose.config_offer_id(config)
+            rows = [compose.entity_rows(config, source) for _, source, _, _ in compose.LIST_ENTITIES]
+        except Exception:
+            results[i] = _coerce_one(config)   # 由逐条路径给出同样的错误
+            continue
+        prepared.append((i, config, offer_id, rows))
+
+    try:
+        lists: List[Dict[str, List[Dict[str, Any]]]] = [{} for _ in prepared]
+        for k, (target, _, _, build) in enumerate(compose.LIST_ENTITIES):
+            builder = COLUMNAR_BUILDERS.get(target)
+            if builder is None:
+                for entry, (_, _, offer_id, rows) in zip(lists, prepared):
+                    entry[target] = [build(src, offer_id) for src in rows[k]]
+                continue
+            built = builder([src for p in prepared for src in p[3][k]],
+                            [p[2] for p in prepared for _ in p[3][k]])
+            offset = 0
+            for entry, p in zip(lists, prepared):
+                n = len(p[3][k])
+                entry[target] = built[offset:offset + n]
+                offset += n
+    except Exception:
+        # 列式构建本身出错时整块退回逐条生成，错误仍然只落在出问题的行上
+        return [r or _coerce_one(c) for r, c in zip(results, configs)]
+
+    for (i, config, offer_id, _), entry in zip(prepared, lists):
+        try:
+            offer, issues = compose.assemble_offer(config, offer_id, entry)
+            results[i] = (offer, issues, None)
+        except Exception as e:
+            results[i] = (None, [], e)
+    return results
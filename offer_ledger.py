@@ -0,0 +1,165 @@
+# offer_ledger.py
+# 本地 SQLite 幂等账本 - 记录已生成 / 已验证 / 已提交的报价，重跑时跳过未变化的部分
+
+import json, hashlib, threading, time
+from typing import Any, Dict, List, Optional, Tuple
+
+# 每次生成都会变化、不影响报价内容的字段
+VOLATILE_FIELDS = {"TimeStamp"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS offers (
+    offer_hash        TEXT PRIMARY KEY,
+    offer_id          TEXT,
+    source            TEXT,
+    validate_status   INTEGER,
+    validate_response TEXT,
+    submit_status     INTEGER,
+    submit_response   TEXT,
+    updated_at        REAL
+);
+CREATE TABLE IF NOT EXISTS shapes (
+    shape_hash  TEXT PRIMARY KEY,
+    passed_at   REAL
+);
+CREATE TABLE IF NOT EXISTS composed (
+    input_hash  TEXT PRIMARY KEY,
+    offer_hash  TEXT,
+    offer       TEXT,
+    issues      TEXT,
+    now_fields  TEXT,
+    created_at  REAL
+);
+CREATE TABLE IF NOT EXISTS watched (
+    path        TEXT PRIMARY KEY,
+    input_hash  TEXT,
+    output      TEXT,
+    updated_at  REAL
+);
+"""
+
+def _strip_volatile(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _strip_volatile(v) for k, v in value.items() if k not in VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_strip_volatile(v) for v in value]
+    return value
+
+def offer_hash(offer: Dict[str, Any]) -> str:
+    """报价的规范化哈希：去掉易变字段、键排序、紧凑序列化后取 SHA-256"""
+    canonical = json.dumps(_strip_volatile(offer), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def input_hash(content) -> str:
+    """原始输入（YAML 文本或文件字节）的哈希"""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+def _succeeded(status: Optional[int]) -> bool:
+    return status is not None and status < 400
+
+class OfferLedger:
+    """线程安全的账本；每次写入立即提交，进程崩溃后可从中断处继续"""
+
+    def __init__(self, path: str):
+        import sqlite3   # offer_hash / input_hash 不需要 sqlite3，未使用账本的命令行路径不加载它
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(composed)")}
+        if "now_fields" not in columns:
+            # 旧版账本：缓存键不含生成器版本，其中的报价不再复用
+            self._conn.execute("DELETE FROM composed")
+            self._conn.execute("ALTER TABLE composed ADD COLUMN now_fields TEXT")
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def lookup(self, offer_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT offer_id, source, validate_status, submit_status FROM offers WHERE offer_hash = ?",
+                (offer_hash,)).fetchone()
+        if row is None:
+            return None
+        return {"offer_id": row[0], "source": row[1], "validate_status": row[2], "submit_status": row[3]}
+
+    def is_validated(self, entry: Optional[Dict[str, Any]]) -> bool:
+        return bool(entry) and _succeeded(entry["validate_status"])
+
+    def is_submitted(self, entry: Optional[Dict[str, Any]]) -> bool:
+        return bool(entry) and _succeeded(entry["submit_status"])
+
+    def _record(self, column: str, offer_hash: str, offer_id: Optional[str], source: Optional[str],
+                status: Optional[int], response: Any):
+        text = response if isinstance(response, str) else json.dumps(response, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO offers (offer_hash, offer_id, source, {column}_status, {column}_response, updated_at) "
+                f"VALUES (?, ?, ?, ?, ?, ?) "
+                f"ON CONFLICT(offer_hash) DO UPDATE SET offer_id = excluded.offer_id, source = excluded.source, "
+                f"{column}_status = excluded.{column}_status, {column}_response = excluded.{column}_response, "
+                f"updated_at = excluded.updated_at",
+                (offer_hash, offer_id, source, status, text, time.time()))
+            self._conn.commit()
+
+    def record_validate(self, offer_hash: str, offer_id: Optional[str], source: Optional[str],
+                        status: Optional[int], response: Any):
+        self._record("validate", offer_hash, offer_id, source, status, response)
+
+    def record_submit(self, offer_hash: str, offer_id: Optional[str], source: Optional[str],
+                      status: Optional[int], response: Any):
+        self._record("submit", offer_hash, offer_id, source, status, response)
+
+    def shape_passed(self, shape_hash: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM shapes WHERE shape_hash = ?", (shape_hash,)).fetchone() is not None
+
+    def record_shape(self, shape_hash: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO shapes (shape_hash, passed_at) VALUES (?, ?)",
+                               (shape_hash, time.time()))
+            self._conn.commit()
+
+    def get_composed(self, input_hash: str) -> Optional[Tuple[Dict[str, Any], List[str], List[list]]]:
+        """缓存的 (报价, 自动修正说明, 由当前时间生成的字段)"""
+        with self._lock:
+            row = self._conn.execute("SELECT offer, issues, now_fields FROM composed WHERE input_hash = ?",
+                                     (input_hash,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), json.loads(row[1]), json.loads(row[2] or "[]")
+
+    def put_composed(self, input_hash: str, offer: Dict[str, Any], issues: List[str],
+                     now_fields: Optional[List[list]] = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO composed (input_hash, offer_hash, offer, issues, now_fields, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (input_hash, offer_hash(offer), json.dumps(offer, ensure_ascii=False),
+                 json.dumps(issues, ensure_ascii=False), json.dumps(now_fields or []), time.time()))
+            self._conn.commit()
+
+    def get_watched(self, path: str) -> Optional[Tuple[str, str]]:
+        """监视模式：文件上次生成时的 (输入哈希, 输出路径)"""
+        with self._lock:
+            row = self._conn.execute("SELECT input_hash, output FROM watched WHERE path = ?", (path,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def put_watched(self, path: str, input_hash: str, output: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO watched (path, input_hash, output, updated_at) VALUES (?, ?, ?, ?)",
+                               (path, input_hash, output, time.time()))
+            self._conn.commit()
@@ -0,0 +1,255 @@
+# offer_metrics.py
+# 分阶段计时与结构化事件 - 记录每个阶段的耗时、字节数和结果，
+# 输出为 JSON lines 或 Prometheus 文本格式（node_exporter textfile collector 可直接读取）
+
+import os, json, time, atexit, threading
+from typing import Any, Dict, List, Optional, Tuple
+
+LEVELS = {"debug": 10, "info": 20, "success": 25, "warn": 30, "error": 40, "off": 100}
+LOG_FORMATS = ("text", "json")
+DURATION_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+FLUSH_INTERVAL = 5.0   # Prometheus 文件最短重写间隔（秒），长时间运行的服务也能看到更新
+
+_level = LEVELS["info"]
+_log_format = "text"
+_service = "compose"
+_registry: Optional["Registry"] = None
+_collected: Optional[List[Tuple]] = None   # 工作进程中暂存的观测值，随结果返回主进程
+_tracer: Any = None   # 阶段进入 / 退出钩子（offer_profile --trace-memory），提供 enter(stage) / exit(stage)
+_lock = threading.Lock()
+
+# ---------------- 事件 ----------------
+
+def enabled(level: str) -> bool:
+    return LEVELS[level] >= _level
+
+def event(level: str, message: str, **fields):
+    """输出一条分级事件；text 格式保持原有的 [INFO] 前缀样式，json 格式每行一个对象"""
+    if LEVELS[level] < _level:
+        return
+    if _log_format == "json":
+        record = {"ts": round(time.time(), 3), "level": level, "service": _service, "msg": message}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False, default=str)
+    else:
+        line = f"[{level.upper()}] {message}"
+    with _lock:
+        print(line, flush=level in ("warn", "error"))
+
+def debug(message: str, **fields):
+    event("debug", message, **fields)
+
+def info(message: str, **fields):
+    event("info", message, **fields)
+
+def success(message: str, **fields):
+    event("success", message, **fields)
+
+def warn(message: str, **fields):
+    event("warn", message, **fields)
+
+def error(message: str, **fields):
+    event("error", message, **fields)
+
+# ---------------- 阶段计时 ----------------
+
+class _NoopStage:
+    """指标关闭时使用的共享空对象：不取时间、不分配"""
+    __slots__ = ()
+    outcome = "ok"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass   # 忽略 st.outcome = ... 之类的赋值
+
+    def add_bytes(self, n: int):
+        pass
+
+NOOP_STAGE = _NoopStage()
+
+class Stage:
+    __slots__ = ("name", "labels", "bytes", "outcome", "_start")
+
+    def __init__(self, name: str, labels: Dict[str, str]):
+        self.name, self.labels, self.bytes, self.outcome = name, labels, 0, "ok"
+
+    def add_bytes(self, n: int):
+        self.bytes += n
+
+    def __enter__(self):
+        if _tracer is not None:
+            _tracer.enter(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._start
+        if _tracer is not None:
+            _tracer.exit(self)
+        if exc_type is not None and self.outcome == "ok":
+            self.outcome = "error"
+        observe(self.name, seconds, self.bytes, self.outcome, self.labels)
+        return False
+
+def stage(name: str, **labels):
+    """with stage("yaml_load") as s: ...; s.add_bytes(n); s.outcome = "..." """
+    if _registry is None and _collected is None and _tracer is None:
+        return NOOP_STAGE
+    return Stage(name, labels)
+
+def metrics_enabled() -> bool:
+    return _registry is not None or _collected is not None
+
+def set_stage_tracer(tracer: Any):
+    """安装 / 移除阶段钩子；未安装时 stage() 的开销不变"""
+    global _tracer
+    _tracer = tracer
+
+def observe(name: str, seconds: float, nbytes: int = 0, outcome: str = "ok", labels: Optional[Dict[str, str]] = None):
+    labels = labels or {}
+    if _collected is not None:
+        _collected.append((name, seconds, nbytes, outcome, labels))
+    elif _registry is not None:
+        _registry.record(name, seconds, nbytes, outcome, labels)
+
+# ---------------- 汇总与输出 ----------------
+
+def _label_text(labels: Dict[str, str]) -> str:
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+class Registry:
+    """按 (阶段, 结果, 标签) 聚合；.prom 路径写 Prometheus 文本，其余路径逐条追加 JSON lines"""
+
+    def __init__(self, path: str, service: str):
+        self.path = os.path.abspath(path)
+        self.service = service
+        self.prometheus = self.path.endswith(".prom")
+        self._series: Dict[Tuple, List[Any]] = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._jsonl = None if self.prometheus else open(self.path, "a", encoding="utf-8", buffering=1)
+
+    def record(self, name: str, seconds: float, nbytes: int, outcome: str, labels: Dict[str, str]):
+        key = (name, outcome, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0, 0.0, 0, [0] * len(DURATION_BUCKETS)]
+            series[0] += 1
+            series[1] += seconds
+            series[2] += nbytes
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    series[3][i] += 1
+            if self._jsonl:
+                record = {"ts": round(time.time(), 3), "service": self.service, "stage": name,
+                          "seconds": round(seconds, 6), "bytes": nbytes, "outcome": outcome}
+                record.update(labels)
+                self._jsonl.write(json.dumps(record, ensure_ascii=False) + "\n")
+            due = self.prometheus and time.monotonic() - self._last_flush >= FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"stage": name, "outcome": outcome, **dict(labels), "count": s[0],
+                     "seconds": s[1], "bytes": s[2]}
+                    for (name, outcome, labels), s in sorted(self._series.items())]
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP offer_stage_duration_seconds Wall time per pipeline stage",
+            "# TYPE offer_stage_duration_seconds histogram",
+        ]
+        byte_lines = [
+            "# HELP offer_stage_bytes_total Bytes processed per pipeline stage",
+            "# TYPE offer_stage_bytes_total counter",
+        ]
+        with self._lock:
+            items = sorted(self._series.items())
+            for (name, outcome, labels), (count, seconds, nbytes, buckets) in items:
+                base = {"service": self.service, "stage": name, "outcome": outcome, **dict(labels)}
+                for bound, n in zip(DURATION_BUCKETS, buckets):
+                    lines.append(f"offer_stage_duration_seconds_bucket{_label_text({**base, 'le': repr(bound)})} {n}")
+                lines.append(f"offer_stage_duration_seconds_bucket{_label_text({**base, 'le': '+Inf'})} {count}")
+                lines.append(f"offer_stage_duration_seconds_sum{_label_text(base)} {seconds:.6f}")
+                lines.append(f"offer_stage_duration_seconds_count{_label_text(base)} {count}")
+                byte_lines.append(f"offer_stage_bytes_total{_label_text(base)} {nbytes}")
+        return "\n".join(lines + byte_lines) + "\n"
+
+    def flush(self):
+        if self.prometheus:
+            from offer_output import AtomicWriter
+            text = self.to_prometheus()
+            with AtomicWriter(self.path) as f:
+                f.write(text.encode("utf-8"))
+            self._last_flush = time.monotonic()
+        elif self._jsonl:
+            self._jsonl.flush()
+
+    def close(self):
+        self.flush()
+        if self._jsonl:
+            self._jsonl.close()
+            self._jsonl = None
+
+# ---------------- 配置 ----------------
+
+def configure(level: str = "info", log_format: str = "text", metrics_path: Optional[str] = None,
+              service: str = "compose"):
+    """命令行入口调用一次；未指定 metrics_path 时 stage() 为零开销空操作"""
+    global _level, _log_format, _service, _registry
+    _level, _log_format, _service = LEVELS[level], log_format, service
+    if _registry is not None:
+        _registry.close()
+        _registry = None
+    if metrics_path:
+        _registry = Registry(metrics_path, service)
+        atexit.register(shutdown)
+
+def shutdown():
+    global _registry
+    if _registry is not None:
+        _registry.close()
+        _registry = None
+
+def worker_settings() -> Tuple[str, str, bool, str]:
+    """传给工作进程初始化函数 configure_worker 的参数"""
+    level = next(k for k, v in LEVELS.items() if v == _level)
+    return level, _log_format, metrics_enabled(), _service
+
+def configure_worker(level: str = "info", log_format: str = "text", collect: bool = False, service: str = "compose"):
+    """工作进程：事件直接输出，阶段观测值暂存，由 drain() 随结果带回主进程"""
+    global _level, _log_format, _service, _registry, _collected, _tracer
+    _level, _log_format, _service, _registry, _tracer = LEVELS[level], log_format, service, None, None
+    _collected = [] if collect else None
+
+def drain() -> Optional[List[Tuple]]:
+    """取出工作进程中暂存的观测值"""
+    global _collected
+    if _collected is None:
+        return None
+    out, _collected = _collected, []
+    return out
+
+def merge(observations: Optional[List[Tuple]]):
+    """主进程合并工作进程带回的观测值"""
+    if _registry is None or not observations:
+        return
+    for name, seconds, nbytes, outcome, labels in observations:
+        _registry.record(name, seconds, nbytes, outcome, labels)
+
+def add_arguments(parser):
+    """两个命令行共用的参数"""
+    parser.add_argument("--log-level", choices=list(LEVELS), default="info",
+                        help="Minimum event level printed (off disables all events)")
+    parser.add_argument("--log-format", choices=LOG_FORMATS, default="text",
+                        help="Event format: text ([INFO] ... lines) or json (one object per line)")
+    parser.add_argument("--metrics",
+                        help="Record per-stage timings: *.prom writes a Prometheus text file, otherwise JSON lines")
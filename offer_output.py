@@ -0,0 +1,170 @@
+# offer_output.py
+# 报价输出 - 可选格式（pretty / compact / jsonl / jsonl.gz）、缓冲写入、临时文件 + 重命名的原子替换
+
+import os, io, json, gzip, tempfile
+from typing import Any, Optional
+
+try:
+    import orjson
+    # datetime / dataclass / str、int、dict、list 的子类交给 default，与标准库接受的输入一致
+    ORJSON_PASSTHROUGH = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+                          | orjson.OPT_PASSTHROUGH_SUBCLASS)
+except ImportError:
+    orjson = None
+
+OUTPUT_FORMATS = ("pretty", "compact", "jsonl", "jsonl.gz")
+WRITE_BUFFER_SIZE = 1024 * 1024
+GZIP_LEVEL = 6
+
+def _orjson_differs(obj: Any) -> bool:
+    """是否含 orjson 与标准库输出不同的值：NaN / Infinity（orjson 写成 null）、
+    repr 为指数形式的浮点数（绝对值 >= 1e16 或非零且 < 1e-4；orjson 写成 1e16 / 0.00001，标准库为 1e+16 / 1e-05），
+    以及 orjson 原生支持、没有 passthrough 选项的 UUID / Enum 等非 JSON 类型"""
+    stack = [(obj,)]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            value = value.values()
+        for item in value:
+            if item.__class__ is str:
+                continue
+            if isinstance(item, float):
+                if not -1e16 < item < 1e16 or (item != 0 and -1e-4 < item < 1e-4):
+                    return True
+            elif isinstance(item, (dict, list, tuple)):
+                stack.append(item)
+            elif item is not None and not isinstance(item, (str, int)):
+                return True
+    return False
+
+def _not_json(obj: Any):
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps(obj: Any, pretty: bool = False) -> bytes:
+    """序列化为 UTF-8 字节，结果与标准库 json.dumps 逐字节相同，接受和拒绝的输入也相同
+    （date / datetime 等非 JSON 类型抛出 TypeError）；优先使用 orjson，
+    遇到其不支持的类型或输出会不同的值时退回标准库"""
+    if orjson is not None and not _orjson_differs(obj):
+        try:
+            return orjson.dumps(obj, default=_not_json,
+                                option=ORJSON_PASSTHROUGH | (orjson.OPT_INDENT_2 if pretty else 0))
+        except TypeError:
+            pass
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def format_for_path(path: str, fmt: Optional[str] = None) -> str:
+    """未显式指定格式时按扩展名推断：.jsonl.gz / .jsonl / 其余为 pretty"""
+    if fmt:
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format '{fmt}' (choose from {', '.join(OUTPUT_FORMATS)})")
+        return fmt
+    lower = path.lower()
+    if lower.endswith((".jsonl.gz", ".ndjson.gz")):
+        return "jsonl.gz"
+    if lower.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return "pretty"
+
+def is_stream_format(fmt: str) -> bool:
+    return fmt in ("jsonl", "jsonl.gz")
+
+class AtomicWriter:
+    """写入同目录下的临时文件，成功关闭后 os.replace 到目标路径；出错时删除临时文件，
+    读取方只会看到旧文件或完整的新文件"""
+
+    def __init__(self, path: str, compress: bool = False):
+        self.path = os.path.abspath(path)
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(self.path)}.", suffix=".tmp")
+        self._raw = os.fdopen(fd, "wb", buffering=WRITE_BUFFER_SIZE)
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=GZIP_LEVEL) if compress else None
+        self._file: io.BufferedIOBase = self._gzip or self._raw
+
+    def write(self, data: bytes):
+        self._file.write(data)
+
+    def commit(self):
+        if self._gzip:
+            self._gzip.close()
+        self._raw.close()
+        os.chmod(self.tmp_path, 0o644)
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        try:
+            if self._gzip:
+                self._gzip.close()
+            self._raw.close()
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.unlink(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+class OfferWriter:
+    """按所选格式流式写出多个报价：
+    jsonl / jsonl.gz 每行一个；pretty / compact 写成 JSON 数组（只有一个报价时写成单个对象）"""
+
+    def __init__(self, path: str, fmt: Optional[str] = None):
+        self.format = format_for_path(path, fmt)
+        self.path = os.path.abspath(path)
+        self.count = 0
+        self._pretty = self.format == "pretty"
+        self._pending: Optional[bytes] = None   # 第一个报价暂存，直到确定不止一个
+        self._out = AtomicWriter(self.path, compress=self.format == "jsonl.gz")
+
+    def write(self, offer: Any) -> int:
+        """写出一个报价，返回序列化后的字节数"""
+        self.count += 1
+        if is_stream_format(self.format):
+            data = dumps(offer) + b"\n"
+            self._out.write(data)
+            return len(data)
+        data = dumps(offer, pretty=self._pretty)
+        if self.count == 1:
+            self._pending = data
+            return len(data)
+        if self._pending is not None:
+            self._out.write(b"[\n" + self._pending)
+            self._pending = None
+        self._out.write(b",\n" + data)
+        return len(data)
+
+    def close(self):
+        if not is_stream_format(self.format):
+            if self._pending is not None:
+                self._out.write(self._pending)
+            elif self.count > 1:
+                self._out.write(b"\n]")
+            else:
+                self._out.write(b"[]")
+        self._out.commit()
+
+    def abort(self):
+        self._out.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write_json(path: str, obj: Any, fmt: str = "pretty") -> int:
+    """原子写出单个 JSON 文档，返回字节数"""
+    data = dumps(obj, pretty=fmt == "pretty") + (b"\n" if is_stream_format(fmt) else b"")
+    with AtomicWriter(path, compress=fmt == "jsonl.gz") as f:
+        f.write(data)
+    return len(data)
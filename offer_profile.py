@@ -0,0 +1,202 @@
+# offer_profile.py
+# 运行剖析 - --profile 用 cProfile 记录整次运行，写出 pstats 文件和最耗时函数的文本摘要；
+# --trace-memory 用 tracemalloc 按阶段（offer_metrics.stage：read_file、fix_yaml、yaml_load、coerce、
+# write、validate / submit 等）记录内存峰值，并保存各阶段峰值最高时新增的分配位置
+#
+# 两个选项都未指定时 start() 直接返回：不导入 cProfile / tracemalloc，stage() 仍是共享空对象。
+# 只剖析主进程的主线程；--batch 多进程时工作进程中的生成不在结果中（需要时用 --workers 1）
+
+import os, json, atexit, threading
+from typing import Any, Dict, List, Optional
+
+import offer_metrics as metrics
+
+DEFAULT_TOP = 25
+SNAPSHOT_GROWTH = 1.1   # 阶段峰值比已记录的最大值高出 10% 以上才重新拍快照（快照开销与存活对象数成正比）
+
+_profiler = None
+_tracer: Optional["StageMemory"] = None
+_settings: Dict[str, Any] = {}
+_fork_hook = False
+
+def add_arguments(parser):
+    """两个命令行共用的参数"""
+    parser.add_argument("--profile", metavar="PATH",
+                        help="Profile the run with cProfile: write pstats to PATH and a top-N summary to PATH.txt")
+    parser.add_argument("--trace-memory", metavar="PATH",
+                        help="Trace allocations with tracemalloc: write per-stage peak memory and "
+                             "top allocation sites to PATH (JSON)")
+    parser.add_argument("--profile-top", type=int, default=DEFAULT_TOP,
+                        help=f"Functions / allocation sites listed per report (default {DEFAULT_TOP})")
+
+def _format_bytes(n: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if abs(n) < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024.0
+    return f"{n:.1f} GiB"
+
+# ---------------- 按阶段的内存峰值 ----------------
+
+class StageMemory:
+    """offer_metrics 的阶段钩子：记录每个阶段内 tracemalloc 峰值相对进入时已分配量的增长。
+    阶段可以嵌套（batch_item 内的 coerce），也可以在多个线程 / 协程中交错；进入新阶段前先把当前峰值
+    计入所有未结束的阶段再重置峰值。并发阶段（submit 的 asyncio 请求）的峰值包含彼此的分配"""
+
+    def __init__(self, top: int):
+        import tracemalloc
+        self.tracemalloc = tracemalloc
+        self.top = top
+        self.baseline = self.tracemalloc.take_snapshot()
+        self.stats: Dict[str, Dict[str, Any]] = {}
+        self._open: Dict[int, List[int]] = {}   # id(Stage) -> [进入时已分配, 期间峰值]
+        self._lock = threading.Lock()
+
+    def _fold(self):
+        peak = self.tracemalloc.get_traced_memory()[1]
+        for entry in self._open.values():
+            if peak > entry[1]:
+                entry[1] = peak
+
+    def enter(self, stage):
+        with self._lock:
+            self._fold()
+            self.tracemalloc.reset_peak()
+            current = self.tracemalloc.get_traced_memory()[0]
+            self._open[id(stage)] = [current, current]
+
+    def exit(self, stage):
+        with self._lock:
+            self._fold()
+            entry = self._open.pop(id(stage), None)
+            if entry is None:
+                return
+            start, peak = entry
+            growth, retained = peak - start, self.tracemalloc.get_traced_memory()[0] - start
+            st = self.stats.get(stage.name)
+            if st is None:
+                st = self.stats[stage.name] = {"count": 0, "peak_bytes": 0, "total_peak_bytes": 0,
+                                               "max_retained_bytes": 0, "top": []}
+            st["count"] += 1
+            st["total_peak_bytes"] += growth
+            st["max_retained_bytes"] = max(st["max_retained_bytes"], retained)
+            snapshot = growth > st["peak_bytes"] * SNAPSHOT_GROWTH
+            st["peak_bytes"] = max(st["peak_bytes"], growth)
+        if snapshot:
+            st["top"] = self.capture()
+
+    def capture(self) -> List[Dict[str, Any]]:
+        """拍快照并汇总；期间暂停 cProfile，同时开启两个选项时快照本身不计入 CPU 剖析"""
+        profiler = _profiler
+        if profiler is not None:
+            profiler.disable()
+        try:
+            return self.top_sites(self.tracemalloc.take_snapshot())
+        finally:
+            if profiler is not None:
+                profiler.enable()
+
+    def top_sites(self, snapshot) -> List[Dict[str, Any]]:
+        """相对运行开始时新增的分配，按源码行汇总（不含 tracemalloc 和本模块自身的分配）"""
+        own = (self.tracemalloc.__file__, __file__)
+        sites = []
+        for d in snapshot.compare_to(self.baseline, "lineno"):
+            if len(sites) >= self.top or d.size_diff <= 0:
+                break
+            frame = d.traceback[0]
+            if frame.filename not in own:
+                sites.append({"site": f"{frame.filename}:{frame.lineno}",
+                              "size_diff": d.size_diff, "count_diff": d.count_diff})
+        return sites
+
+    def report(self) -> Dict[str, Any]:
+        current, peak = self.tracemalloc.get_traced_memory()
+        stages = [{"stage": name, "count": st["count"], "peak_bytes": st["peak_bytes"],
+                   "mean_peak_bytes": st["total_peak_bytes"] // max(1, st["count"]),
+                   "max_retained_bytes": st["max_retained_bytes"], "top": st["top"]}
+                  for name, st in sorted(self.stats.items(), key=lambda kv: -kv[1]["peak_bytes"])]
+        return {"traced_bytes": current, "traced_peak_bytes": peak, "stages": stages,
+                "end_of_run_top": self.capture()}
+
+# ---------------- 开始 / 结束 ----------------
+
+def start(args):
+    """命令行入口在 metrics.configure 之后调用一次；结束时（包括 sys.exit）由 atexit 写出报告"""
+    global _profiler, _tracer, _fork_hook
+    profile_path, trace_path = getattr(args, "profile", None), getattr(args, "trace_memory", None)
+    if not profile_path and not trace_path:
+        return
+    top = max(1, getattr(args, "profile_top", DEFAULT_TOP))
+    _settings.update(profile=profile_path, trace_memory=trace_path, top=top)
+    if getattr(args, "batch", None) and getattr(args, "workers", 1) > 1:
+        metrics.warn("--profile / --trace-memory only cover the main process; use --workers 1 to include compose work")
+    if not _fork_hook:
+        os.register_at_fork(after_in_child=_stop_in_child)
+        _fork_hook = True
+    atexit.register(stop)
+    if trace_path:
+        import tracemalloc
+        tracemalloc.start()
+        _tracer = StageMemory(top)
+        metrics.set_stage_tracer(_tracer)
+    if profile_path:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+def _stop_in_child():
+    """fork 出的工作进程不继续剖析（它们的结果不会写出）"""
+    global _profiler, _tracer
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler = None
+    if _tracer is not None:
+        metrics.set_stage_tracer(None)
+        _tracer.tracemalloc.stop()
+        _tracer = None
+
+def stop():
+    """停止剖析并写出报告；可重复调用"""
+    global _profiler, _tracer
+    profiler, tracer = _profiler, _tracer
+    _profiler = _tracer = None
+    if profiler is not None:
+        profiler.disable()
+        try:
+            write_profile(profiler, _settings["profile"], _settings["top"])
+        except Exception as e:
+            metrics.error(f"Failed to write profile: {e}")
+    if tracer is not None:
+        metrics.set_stage_tracer(None)
+        try:
+            write_memory(tracer, _settings["trace_memory"])
+        except Exception as e:
+            metrics.error(f"Failed to write memory trace: {e}")
+        finally:
+            tracer.tracemalloc.stop()
+
+def write_profile(profiler, path: str, top: int):
+    """pstats 原始文件（可用 python -m pstats / snakeviz 打开）+ 按自身耗时和累计耗时排序的文本摘要"""
+    import io, pstats
+    profiler.dump_stats(path)
+    stats = pstats.Stats(profiler)
+    text = io.StringIO()
+    for key, title in (("tottime", "by own time"), ("cumulative", "by cumulative time")):
+        print(f"=== top {top} functions {title} ===", file=text)
+        pstats.Stats(profiler, stream=text).strip_dirs().sort_stats(key).print_stats(top)
+    with open(path + ".txt", "w", encoding="utf-8") as f:
+        f.write(text.getvalue())
+    metrics.info(f"Profile written: {path} (summary {path}.txt, {stats.total_tt:.3f}s profiled)")
+    hotspots = sorted(stats.stats.items(), key=lambda kv: -kv[1][2])[:min(top, 10)]
+    for (filename, lineno, func), (_, calls, own, cumulative, _) in hotspots:
+        metrics.info(f"  {own:8.3f}s own {cumulative:8.3f}s cum {calls:>9} calls  "
+                     f"{os.path.basename(filename)}:{lineno}({func})")
+
+def write_memory(tracer: StageMemory, path: str):
+    report = tracer.report()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    metrics.info(f"Memory trace written: {path} (peak {_format_bytes(report['traced_peak_bytes'])} traced)")
+    for st in report["stages"]:
+        metrics.info(f"  {st['stage']:<16} peak +{_format_bytes(st['peak_bytes']):>10}  "
+                     f"mean +{_format_bytes(st['mean_peak_bytes']):>10}  x{st['count']}")
@@ -0,0 +1,219 @@
+# offer_rules.py
+# 本地预验证引擎 - 在调用 /Validate 之前一次性检查整个报价，报告所有违规项及其 JSON 路径。
+# RULES 是门户肯定会拒绝的硬性规则（必填字段、取值列表、邮箱 / 日期格式等），违反时不再发送请求；
+# HEURISTIC_RULES 是比门户已知要求更严的经验规则，只作为警告
+
+import re, json, hashlib
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from compose_offer_robust import AEST, ALLOWED_TITLES, ALLOWED_GENDERS, ALLOWED_ORIGINS, EMAIL_RE
+
+Violation = Tuple[str, str]   # (JSON 路径, 说明)
+
+# 英语考试各项分数的合法范围：(最小值, 最大值, 步长)
+ENG_TEST_RANGES = {
+    "ielts": {"section": (0, 9, 0.5), "overall": (0, 9, 0.5)},
+    "pte": {"section": (10, 90, 1), "overall": (10, 90, 1)},
+    "toefl": {"section": (0, 30, 1), "overall": (0, 120, 1)},
+    "cambridge": {"section": (80, 230, 1), "overall": (80, 230, 1)},
+    "oet": {"section": (0, 500, 10), "overall": (0, 500, 10)},
+}
+ENG_SCORE_FIELDS = ("EngTestListeningScore", "EngTestReadingScore", "EngTestWritingScore", "EngTestSpeakingScore")
+FEE_FIELDS = ("TuitionFee", "EnrolmentFee", "MaterialFee", "UpfrontFee")
+PATH_TOKEN_RE = re.compile(r"([^.\[\]]+)|\[\*\]")
+
+# ---------------- 路径编译 ----------------
+
+def compile_path(path: str) -> Callable[[Any], Iterator[Tuple[str, Any]]]:
+    """把 'AppliedCourses[*].StartDate' 编译为产出 (具体路径, 值) 的访问函数；缺失的键不产出"""
+    getter: Callable[[Any, str], Iterator[Tuple[str, Any]]] = lambda node, where: iter(((where, node),))
+    for m in reversed(list(PATH_TOKEN_RE.finditer(path))):
+        key, inner = m.group(1), getter
+        if key is None:
+            def getter(node, where, inner=inner):
+                if isinstance(node, list):
+                    for i, item in enumerate(node):
+                        yield from inner(item, f"{where}[{i}]")
+        else:
+            def getter(node, where, inner=inner, key=key):
+                if isinstance(node, dict) and key in node:
+                    yield from inner(node[key], f"{where}.{key}")
+    return lambda offer: getter(offer, "$")
+
+# ---------------- 检查函数 ----------------
+
+def _parse_date(value: Any) -> Optional[datetime]:
+    """带时区的时间；没有时区的值按 AEST（与生成器的输出一致）"""
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=AEST)
+
+def one_of(allowed) -> Callable[[Any], Optional[str]]:
+    choices = ", ".join(sorted(allowed))
+    return lambda v: None if v in allowed else f"'{v}' not one of: {choices}"
+
+def email(optional: bool = False) -> Callable[[Any], Optional[str]]:
+    def check(v):
+        if optional and not v:
+            return None
+        return None if isinstance(v, str) and EMAIL_RE.match(v) else f"'{v}' is not a valid email"
+    return check
+
+def iso_date(optional: bool = False, past: bool = False) -> Callable[[Any], Optional[str]]:
+    def check(v):
+        if optional and v in ("", None):
+            return None
+        dt = _parse_date(v)
+        if dt is None:
+            return f"'{v}' is not an ISO 8601 date"
+        if past and dt > datetime.now(tz=AEST):
+            return f"'{v}' is in the future"
+        return None
+    return check
+
+def required(v) -> Optional[str]:
+    return None if v not in ("", None) else "required for overseas students"
+
+def non_negative_number(v) -> Optional[str]:
+    if isinstance(v, bool) or not isinstance(v, (int, float)):
+        return f"'{v}' is not a number"
+    return None if v >= 0 else f"{v} is negative"
+
+def positive_int(v) -> Optional[str]:
+    return None if isinstance(v, int) and not isinstance(v, bool) and v > 0 else f"'{v}' is not a positive integer"
+
+def course_dates_ordered(course: Dict[str, Any]) -> Iterable[Violation]:
+    start, finish = _parse_date(course.get("StartDate")), _parse_date(course.get("FinishDate"))
+    if start and finish and finish < start:
+        yield "FinishDate", f"finish {course['FinishDate']} is before start {course['StartDate']}"
+
+def employment_dates_ordered(job: Dict[str, Any]) -> Iterable[Violation]:
+    start, finish = _parse_date(job.get("FromDate")), _parse_date(job.get("ToDate"))
+    if start and finish and finish < start:
+        yield "ToDate", f"to {job['ToDate']} is before from {job['FromDate']}"
+
+def _eng_scores(info: Dict[str, Any]) -> Iterator[Tuple[str, Any, Optional[float]]]:
+    """已填写的各项分数：(字段, 原值, 数值或 None)"""
+    for field in ENG_SCORE_FIELDS + ("EngTestOverallScore",):
+        raw = info.get(field)
+        if raw in ("", None):
+            continue
+        try:
+            yield field, raw, float(raw)
+        except (TypeError, ValueError):
+            yield field, raw, None
+
+def eng_test_numbers(info: Dict[str, Any]) -> Iterable[Violation]:
+    for field, raw, score in _eng_scores(info):
+        if score is None:
+            yield field, f"'{raw}' is not a number"
+
+def eng_test_scores(info: Dict[str, Any]) -> Iterable[Violation]:
+    """按考试类型检查分数范围和步长（经验规则）"""
+    test = str(info.get("EngTestType") or "").strip().lower()
+    ranges = next((r for name, r in ENG_TEST_RANGES.items() if name in test), None)
+    for field, raw, score in _eng_scores(info):
+        if score is None:
+            continue
+        if ranges is None:
+            if score < 0:
+                yield field, f"{raw} is negative"
+            continue
+        lo, hi, step = ranges["overall" if field == "EngTestOverallScore" else "section"]
+        if not lo <= score <= hi:
+            yield field, f"{raw} outside {test.upper()} range {lo}-{hi}"
+        elif abs((score - lo) / step - round((score - lo) / step)) > 1e-9:
+            yield field, f"{raw} is not a valid {test.upper()} score (step {step})"
+
+# ---------------- 条件 ----------------
+
+def is_overseas(offer: Dict[str, Any]) -> bool:
+    return str(offer.get("StudentOrigin", "")).startswith("Overseas")
+
+def is_onshore_overseas(offer: Dict[str, Any]) -> bool:
+    return offer.get("StudentOrigin") == "OverseasStudentInAustralia"
+
+# ---------------- 规则表 ----------------
+# ("field", 路径, 检查函数, 条件)：对路径上的每个值调用检查函数
+# ("item",  路径, 检查函数, 条件)：对路径上的每个对象调用检查函数，产出 (子字段, 说明)
+
+RULES = [
+    ("field", "Title", one_of(ALLOWED_TITLES), None),
+    ("field", "Gender", one_of(ALLOWED_GENDERS), None),
+    ("field", "StudentOrigin", one_of(ALLOWED_ORIGINS), None),
+    ("field", "Email", email(), None),
+    ("field", "DoB", iso_date(past=True), None),
+    ("field", "EmergencyContact.Email", email(optional=True), None),
+    ("field", "ComplianceAndOtherInfo.PassportExpiryDate", iso_date(optional=True), None),
+    ("field", "ComplianceAndOtherInfo.EngTestDate", iso_date(optional=True), None),
+    ("field", "ComplianceAndOtherInfo.VisaType", required, is_overseas),
+    ("field", "ComplianceAndOtherInfo.VisaExpiryDate", iso_date(optional=True), is_overseas),
+    ("field", "AppliedCourses[*].CampusId", positive_int, None),
+    ("field", "AppliedCourses[*].IntakeDate", iso_date(), None),
+    ("field", "AppliedCourses[*].StartDate", iso_date(), None),
+    ("field", "AppliedCourses[*].FinishDate", iso_date(), None),
+    *[("field", f"AppliedCourses[*].{fee}", non_negative_number, None) for fee in FEE_FIELDS],
+    ("item", "AppliedCourses[*]", course_dates_ordered, None),
+    ("item", "EmploymentHistoryList[*]", employment_dates_ordered, None),
+    ("item", "ComplianceAndOtherInfo", eng_test_numbers, None),
+]
+
+HEURISTIC_RULES = [
+    ("field", "ComplianceAndOtherInfo.EngTestDate", iso_date(optional=True, past=True), None),
+    ("field", "ComplianceAndOtherInfo.VisaNumber", required, is_onshore_overseas),
+    ("field", "ComplianceAndOtherInfo.VisaExpiryDate", required, is_onshore_overseas),
+    ("item", "ComplianceAndOtherInfo", eng_test_scores, None),
+]
+
+def compile_rules(rules) -> Callable[[Dict[str, Any]], List[Violation]]:
+    """预编译路径访问函数，返回单次遍历检查整个报价的函数"""
+    compiled = [(kind, compile_path(path), check, when) for kind, path, check, when in rules]
+
+    def validate(offer: Dict[str, Any]) -> List[Violation]:
+        if not isinstance(offer, dict):
+            return [("$", "offer is not a JSON object")]
+        violations: List[Violation] = []
+        for kind, access, check, when in compiled:
+            if when is not None and not when(offer):
+                continue
+            for where, value in access(offer):
+                if kind == "field":
+                    message = check(value)
+                    if message:
+                        violations.append((where, message))
+                elif isinstance(value, dict):
+                    violations.extend((f"{where}.{sub}", message) for sub, message in check(value))
+        return violations
+
+    return validate
+
+validate_offer = compile_rules(RULES)
+offer_warnings = compile_rules(HEURISTIC_RULES)
+
+def validate_offers(offers: Iterable[Dict[str, Any]]) -> Dict[int, List[Violation]]:
+    """批量检查；只返回有违规的报价（按输入序号）"""
+    return {i: v for i, v in ((i, validate_offer(o)) for i, o in enumerate(offers)) if v}
+
+def offer_shape(offer: Any) -> str:
+    """报价的结构指纹：字段路径 + 值类型（不含具体值），列表元素按 [*] 合并"""
+    shape = set()
+
+    def walk(node, where):
+        if isinstance(node, dict):
+            for k, v in node.items():
+                walk(v, f"{where}.{k}")
+        elif isinstance(node, list):
+            for item in node:
+                walk(item, f"{where}[*]")
+            if not node:
+                shape.add((f"{where}[*]", "empty"))
+        else:
+            shape.add((where, type(node).__name__))
+
+    walk(offer, "$")
+    return hashlib.sha256(json.dumps(sorted(shape)).encode("utf-8")).hexdigest()
@@ -0,0 +1,158 @@
+# offer_watch.py
+# 投放目录监视 - Linux 上通过 ctypes 使用 inotify，不可用时（其他系统、网络共享目录）退回定时轮询；
+# 文件在 debounce 秒内大小和修改时间都不再变化才视为写入完成
+
+import os, time, select, struct
+from typing import Callable, Dict, List, Optional, Tuple
+
+import offer_metrics as metrics
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct("iIII")   # struct inotify_event: wd, mask, cookie, len，其后是 len 字节的文件名
+READ_SIZE = 64 * 1024
+
+Signature = Tuple[int, int]   # (mtime_ns, size)
+
+class Inotify:
+    """单个目录的 inotify 句柄（非递归）"""
+
+    def __init__(self, directory: str):
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1: {os.strerror(err)}")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch: {os.strerror(err)}", directory)
+
+    def read(self, timeout: float) -> List[Tuple[int, str]]:
+        """最多等待 timeout 秒，返回 (mask, 文件名) 列表"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset + EVENT_HEADER.size <= len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            events.append((mask, os.fsdecode(data[offset:offset + length].rstrip(b"\0"))))
+            offset += length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class DirectoryWatcher:
+    """poll() 返回已写入完成的新增或变化的文件；启动时目录中已有的文件也会返回一次
+    （是否真的需要处理由调用方的内容哈希决定）"""
+
+    def __init__(self, directory: str, accept: Callable[[str], bool], debounce: float = 2.0,
+                 poll_interval: float = 2.0, force_poll: bool = False):
+        self.directory = os.path.abspath(directory)
+        if not os.path.isdir(self.directory):
+            raise FileNotFoundError(f"Watch directory not found: {directory}")
+        self.accept, self.debounce, self.poll_interval = accept, debounce, poll_interval
+        self._pending: Dict[str, Tuple[float, Optional[Signature]]] = {}   # 路径 -> (最近变化时刻, 当时的签名)
+        self._signatures: Dict[str, Signature] = {}
+        self._next_scan = 0.0
+        self._inotify: Optional[Inotify] = None
+        if not force_poll:
+            try:
+                self._inotify = Inotify(self.directory)
+            except (OSError, AttributeError) as e:
+                metrics.warn(f"inotify unavailable ({e}), polling every {poll_interval:g}s")
+        self.backend = "inotify" if self._inotify else "polling"
+        self._scan(time.monotonic())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+    @staticmethod
+    def _signature(path: str) -> Optional[Signature]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _scan(self, now: float):
+        seen = set()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not self.accept(entry.name) or not entry.is_file():
+                    continue
+                st = entry.stat()
+                sig = (st.st_mtime_ns, st.st_size)
+                seen.add(entry.path)
+                if self._signatures.get(entry.path) != sig:
+                    self._signatures[entry.path] = sig
+                    self._pending[entry.path] = (now, sig)
+        for path in [p for p in self._signatures if p not in seen]:
+            del self._signatures[path]
+            self._pending.pop(path, None)
+        self._next_scan = now + self.poll_interval
+
+    def poll(self, timeout: float) -> List[str]:
+        """等待最多 timeout 秒，返回已稳定的文件（按路径排序）"""
+        if self._inotify:
+            for mask, name in self._inotify.read(timeout):
+                now = time.monotonic()
+                if mask & IN_Q_OVERFLOW:
+                    # 事件队列溢出，可能丢了事件：全量重扫
+                    self._signatures.clear()
+                    self._scan(now)
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    raise FileNotFoundError(f"Watch directory removed: {self.directory}")
+                elif name and self.accept(name):
+                    path = os.path.join(self.directory, name)
+                    if mask & (IN_DELETE | IN_MOVED_FROM):
+                        self._pending.pop(path, None)
+                    else:
+                        self._pending[path] = (now, self._signature(path))
+        else:
+            time.sleep(max(0.0, min(timeout, self._next_scan - time.monotonic())))
+            if time.monotonic() >= self._next_scan:
+                self._scan(time.monotonic())
+        return self._ready(time.monotonic())
+
+    def _ready(self, now: float) -> List[str]:
+        ready = []
+        for path, (since, sig) in list(self._pending.items()):
+            if now - since < self.debounce:
+                continue
+            current = self._signature(path)
+            if current is None:
+                del self._pending[path]
+            elif current != sig:
+                self._pending[path] = (now, current)   # 仍在写入，重新计时
+            else:
+                del self._pending[path]
+                ready.append(path)
+        return sorted(ready)
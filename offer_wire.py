@@ -0,0 +1,82 @@
+# offer_wire.py
+# 提交请求体编码 - 报价只序列化一次为紧凑 JSON 字节，Validate 和 Submit 复用同一份（及其 gzip 压缩结果）；
+# 可选去掉空的可选字段（生成器为缺失的可选字段填入的 ""），并记录编码前后的字节数
+
+from typing import Any, Dict, FrozenSet, Optional
+
+from offer_output import dumps
+
+GZIP_MODES = ("off", "auto", "on")
+GZIP_LEVEL = 6
+GZIP_MIN_BYTES = 1024   # 更小的请求体压缩后省不了多少，不压缩
+
+# 值为 "" / None 时可以不发送的字段，按所在对象分组（"$" 为报价顶层）。
+# 必填字段和本地规则按条件要求的字段（VisaType、VisaNumber、VisaExpiryDate 等）不在其中，
+# 子对象中重复的 OfferId 也保留
+OPTIONAL_FIELDS: Dict[str, FrozenSet[str]] = {
+    "$": frozenset({"MiddleName"}),
+    "ComplianceAndOtherInfo": frozenset({
+        "PassportNumber", "PassportExpiryDate", "HowWellEngSpeak", "StudyReason", "CurrentEmployStatus",
+        "IndustryEmployment", "OccupationCode", "USI", "EngTestType", "EngTestDate", "EngTestListeningScore",
+        "EngTestReadingScore", "EngTestWritingScore", "EngTestSpeakingScore", "EngTestOverallScore", "SchoolType",
+    }),
+    "Addresses": frozenset({"BuildingName", "FlatUnitDetail", "Phone", "Fax", "Mobile"}),
+    "AppliedCourses": frozenset({"SpecialCondition", "Status"}),
+    "Disabilities": frozenset({"OtherValue"}),
+    "EducationHistoryList": frozenset({"InstituteLocation", "EducationLevelCode", "AchievementRecognitionCode"}),
+    "EmploymentHistoryList": frozenset({"JobDescription"}),
+    "EmergencyContact": frozenset({"Address", "Phone", "Email"}),
+    "Leads_MarketingCampaign": frozenset({"LeadSource", "CampaignName"}),
+}
+
+def _drop(record: Any, optional: FrozenSet[str]) -> Any:
+    if not isinstance(record, dict) or not any(record.get(k, 0) in ("", None) for k in optional):
+        return record
+    return {k: v for k, v in record.items() if not (k in optional and v in ("", None))}
+
+def drop_empty_optional(offer: Any) -> Any:
+    """返回去掉空的可选字段后的报价（浅复制，原报价不变；没有可去掉的字段时原样返回）"""
+    if not isinstance(offer, dict):
+        return offer
+    out = _drop(offer, OPTIONAL_FIELDS["$"])
+    if out is offer:
+        out = dict(offer)
+    for key, optional in OPTIONAL_FIELDS.items():
+        value = out.get(key) if key != "$" else None
+        if isinstance(value, list):
+            out[key] = [_drop(item, optional) for item in value]
+        elif isinstance(value, dict):
+            out[key] = _drop(value, optional)
+    return out
+
+class WireBody:
+    """一个报价的请求体：data 为紧凑 JSON，gzipped 首次使用时压缩并缓存。
+    json_bytes 为未去掉空字段时的紧凑 JSON 大小（drop_empty 为 False 时即 len(data)），
+    sent_bytes 为最近一次实际发送的字节数"""
+    __slots__ = ("offer", "data", "json_bytes", "sent_bytes", "_gzipped")
+
+    def __init__(self, offer: Any, drop_empty: bool = False):
+        self.offer = offer
+        full = dumps(offer)
+        self.data = dumps(drop_empty_optional(offer)) if drop_empty else full
+        self.json_bytes = len(full)
+        self.sent_bytes: Optional[int] = None
+        self._gzipped: Optional[bytes] = None
+
+    @property
+    def gzipped(self) -> bytes:
+        if self._gzipped is None:
+            import gzip
+            self._gzipped = gzip.compress(self.data, compresslevel=GZIP_LEVEL, mtime=0)
+        return self._gzipped
+
+    def payload(self, gzip_body: bool):
+        """(要发送的字节, 是否 gzip)；小于 GZIP_MIN_BYTES 的请求体不压缩"""
+        if gzip_body and len(self.data) >= GZIP_MIN_BYTES:
+            return self.gzipped, True
+        return self.data, False
+
+    def sizes(self) -> Dict[str, int]:
+        """编码前（完整的紧凑 JSON）和实际发送（尚未发送时为编码后未压缩）的字节数"""
+        return {"bytes_before": self.json_bytes,
+                "bytes_after": self.sent_bytes if self.sent_bytes is not None else len(self.data)}
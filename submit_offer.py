@@ -1,12 +1,17 @@
 # submit_offer.py
 # -*- coding: utf-8 -*-
+# 命令行入口：HTTP 调用、令牌与并发控制都在 cricos_client.CricosClient 中
 
-import json, argparse
-import requests
+import os, json, time, asyncio, argparse
+from typing import Optional
+from cricos_client import ApiController, CricosClient, CricosError, DEFAULT_BASE, DEFAULT_TOKEN_CACHE
+from offer_wire import GZIP_MODES
+from offer_ledger import OfferLedger, offer_hash
+from offer_rules import validate_offer, offer_warnings, offer_shape
+import offer_metrics as metrics
+import offer_profile
 
-DEFAULT_BASE = "https://cricosapi.dotedu.com.au"
-USERNAME = "origininst_live"
-PASSWORD = "$rigininst_l1ve2o22"
+TOKEN_CACHE_PATH = DEFAULT_TOKEN_CACHE
 
 def pretty(title, payload):
     print(f"\n=== {title} ===")
@@ -15,53 +20,272 @@ def pretty(title, payload):
     else:
         print(str(payload))
 
-def get_token(base: str) -> str:
-    url = f"{base.rstrip('/')}/token"
-    data = {"grant_type":"password","username":USERNAME,"password":PASSWORD}
-    r = requests.post(url, data=data, headers={"Content-Type":"application/x-www-form-urlencoded"}, timeout=30)
-    if r.status_code != 200:
-        raise SystemExit(f"[ERROR] Token {r.status_code}: {r.text}")
-    try:
-        return r.json()["access_token"]
-    except Exception:
-        raise SystemExit(f"[ERROR] Token parse error: {r.text}")
+def make_client(base: str, cache_path=TOKEN_CACHE_PATH, controller: Optional[ApiController] = None,
+                gzip: str = "off", drop_empty: bool = False,
+                username: Optional[str] = None, password: Optional[str] = None) -> CricosClient:
+    """凭据取命令行参数，其次 CRICOS_USERNAME / CRICOS_PASSWORD；都没有时报错，不使用内置账号"""
+    username = username or os.environ.get("CRICOS_USERNAME")
+    password = password or os.environ.get("CRICOS_PASSWORD")
+    if not username or not password:
+        raise CricosError("CRICOS credentials missing: pass --username/--password or set CRICOS_USERNAME / CRICOS_PASSWORD")
+    return CricosClient(base, username, password, token_cache=cache_path, controller=controller,
+                        gzip=gzip, drop_empty=drop_empty)
 
-def post_json(base: str, token: str, path: str, body):
-    url = f"{base.rstrip('/')}{path}"
-    h = {"Authorization":f"Bearer {token}","Content-Type":"application/json","Accept":"application/json, text/json"}
-    r = requests.post(url, headers=h, json=body, timeout=120)
-    try: return r.status_code, r.json()
-    except Exception: return r.status_code, r.text
+def wire_summary(before: int, after: int) -> str:
+    saved = 100.0 * (before - after) / before if before else 0.0
+    return f"{before} -> {after} bytes ({saved:.1f}% smaller)"
 
 def load_offer(path: str):
-    with open(path,"r",encoding="utf-8") as f:
-        return json.loads(f.read())
+    with metrics.stage("load_offer") as st, open(path,"r",encoding="utf-8") as f:
+        text = f.read()
+        st.add_bytes(len(text))
+        return json.loads(text)
+
+def iter_bulk_offers(paths):
+    """展开 .json 文件、.jsonl 文件和目录，逐个产出 (来源, 报价, 错误)"""
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(n for n in os.listdir(path) if n.lower().endswith((".json",".jsonl")))
+            yield from iter_bulk_offers([os.path.join(path, n) for n in names])
+        elif path.lower().endswith(".jsonl"):
+            with open(path,"r",encoding="utf-8") as f:
+                for i, line in enumerate(f, 1):
+                    if not line.strip(): continue
+                    try: yield f"{path}:{i}", json.loads(line), None
+                    except ValueError as e: yield f"{path}:{i}", None, f"JSON error: {e}"
+        else:
+            try: yield path, load_offer(path), None
+            except (OSError, ValueError) as e: yield path, None, f"Load error: {e}"
+
+async def run_bulk(client: CricosClient, paths, validate: bool = False, submit: bool = True,
+                   ledger: Optional[OfferLedger] = None, local_rules: bool = True, skip_known_shapes: bool = False):
+    """批量提交：报价逐个读入并在本地筛选（账本、批内重复、本地规则、已知结构），
+    其余交给 client.submit_many 并发验证 / 提交，实际在途请求数由 client 的自适应控制器约束。
+    硬性本地规则不通过的报价不再调用 /Validate，经验规则只记为 warnings；
+    skip_known_shapes 时结构已验证通过且没有警告的报价也跳过 /Validate"""
+    await client.get_token()
+    results = []
+    seen, known_shapes = set(), set()
+
+    def shape_known(shape):
+        return shape in known_shapes or (ledger is not None and ledger.shape_passed(shape))
+
+    def remember_shape(shape):
+        if shape not in known_shapes:
+            known_shapes.add(shape)
+            if ledger:
+                ledger.record_shape(shape)
+
+    def finish(r):
+        final = r["submit"] if submit else r["validate"]
+        r["ok"] = r.get("skipped") or (r["error"] is None and final is not None and final < 400)
+
+    def pending():
+        """本地处理完的报价直接记入结果；需要调用接口的产出 ((结果, 报价), 报价)，结果中的 _validate 表示是否先验证"""
+        for source, offer, error in iter_bulk_offers(paths):
+            r = {"source": source, "offer_id": offer.get("OfferId") if isinstance(offer, dict) else None,
+                 "validate": None, "submit": None, "error": error}
+            results.append(r)
+            entry = None
+            if ledger and not error:
+                r["hash"] = offer_hash(offer)
+                entry = ledger.lookup(r["hash"])
+                if ledger.is_submitted(entry) or (not submit and ledger.is_validated(entry)):
+                    r.update(validate=entry["validate_status"], submit=entry["submit_status"], skipped=True)
+                elif r["hash"] in seen:
+                    # 同一批次内重复的报价只发送一次
+                    r.update(skipped=True, error="duplicate in batch")
+                seen.add(r["hash"])
+            if validate and not (error or r.get("skipped")) and not (ledger and ledger.is_validated(entry)):
+                with metrics.stage("local_rules") as st:
+                    violations = validate_offer(offer) if local_rules else []
+                    warnings = offer_warnings(offer) if local_rules and not violations else []
+                    st.outcome = "violations" if violations else "warnings" if warnings else "ok"
+                if warnings:
+                    r["warnings"] = warnings
+                    metrics.warn(f"{source}: " + "; ".join(f"{p}: {m}" for p, m in warnings), source=source)
+                if violations:
+                    r.update(violations=violations, error=f"local rules: {len(violations)} violation(s)")
+                elif skip_known_shapes and not warnings:
+                    r["shape"] = offer_shape(offer)
+                    if shape_known(r["shape"]):
+                        r["validate_skipped"] = "shape"
+                        if not submit:
+                            r.update(skipped=True, error="shape already validated")
+            if error or r.get("skipped") or r.get("violations"):
+                r["seconds"] = 0.0
+                finish(r)
+                continue
+            if r.get("validate_skipped"):
+                r["_validate"] = False
+            elif validate and ledger and ledger.is_validated(entry):
+                r["validate"] = entry["validate_status"]
+                r["_validate"] = False
+            else:
+                r["_validate"] = validate
+            yield (r, offer), offer
+
+    start = time.perf_counter()
+    async for res in client.submit_many(pending(), validate=lambda key: key[0].pop("_validate"), submit=submit):
+        r, offer = res["key"]
+        if res["validate"] is not None:
+            r["validate"], r["validate_response"] = res["validate"], res["validate_response"]
+            if ledger:
+                ledger.record_validate(r["hash"], r["offer_id"], r["source"], r["validate"], r["validate_response"])
+            if r["validate"] < 400:
+                remember_shape(r.get("shape") or offer_shape(offer))
+        if res["submit"] is not None:
+            r["submit"], r["submit_response"] = res["submit"], res["submit_response"]
+            if ledger:
+                ledger.record_submit(r["hash"], r["offer_id"], r["source"], r["submit"], r["submit_response"])
+        r["error"], r["seconds"], r["wire"] = res["error"], res["seconds"], res["wire"]
+        finish(r)
+    return results, time.perf_counter() - start
+
+def print_bulk_table(results, elapsed: float):
+    print(f"\n{'#':>5}  {'OfferId':<28} {'Validate':>8} {'Submit':>6} {'Time(s)':>8}  Result")
+    for i, r in enumerate(results, 1):
+        v = r["validate"] if r["validate"] is not None else r.get("validate_skipped", "-")
+        s = r["submit"] if r["submit"] is not None else "-"
+        status = f"skipped ({r['error'] or 'ledger'})" if r.get("skipped") else "ok" if r["ok"] else (r["error"] or "failed")
+        print(f"{i:>5}  {str(r['offer_id'] or r['source'])[:28]:<28} {v:>8} {s:>6} {r['seconds']:>8.2f}  {status}")
+    ok = sum(1 for r in results if r["ok"])
+    skipped = sum(1 for r in results if r.get("skipped"))
+    rate = len(results) / elapsed if elapsed else 0.0
+    print()
+    wired = [r["wire"] for r in results if r.get("wire")]
+    if wired:
+        before, after = sum(w["bytes_before"] for w in wired), sum(w["bytes_after"] for w in wired)
+        metrics.info(f"Request bodies: {wire_summary(before, after)} for {len(wired)} offer(s)",
+                     wire_bytes_before=before, wire_bytes_after=after)
+    metrics.info(f"{len(results)} offers in {elapsed:.2f}s ({rate:.1f} offers/s): "
+                 f"{ok} ok ({skipped} skipped via ledger), {len(results) - ok} failed",
+                 offers=len(results), seconds=round(elapsed, 3), ok=ok, skipped=skipped, failed=len(results) - ok)
+
+def report_controller(controller: ApiController, stats_path: Optional[str] = None):
+    snap = controller.snapshot()
+    pretty("CONTROLLER STATS", snap)
+    if stats_path:
+        with open(stats_path,"w",encoding="utf-8") as f:
+            json.dump(snap, f, indent=2)
 
 def build_parser():
     p = argparse.ArgumentParser(description="Submit StudentOffer from output.json")
     p.add_argument("--base", default=DEFAULT_BASE)
+    p.add_argument("--username", help="CRICOS API username (default: $CRICOS_USERNAME)")
+    p.add_argument("--password", help="CRICOS API password (default: $CRICOS_PASSWORD)")
     p.add_argument("--file", default="output.json")
     p.add_argument("--validate", action="store_true", help="Call /Validate before submit")
     p.add_argument("--no-submit", action="store_true", help="Skip submit (validate only)")
+    p.add_argument("--token-cache", default=TOKEN_CACHE_PATH, help="On-disk token cache file")
+    p.add_argument("--no-token-cache", action="store_true", help="Keep tokens in memory only")
+    p.add_argument("--bulk", nargs="+", metavar="PATH", help="Offer .json/.jsonl files or directories to submit")
+    p.add_argument("--concurrency", type=int, default=4, help="Initial in-flight request limit in bulk mode")
+    p.add_argument("--max-concurrency", type=int, default=16, help="Upper bound for the adaptive in-flight limit")
+    p.add_argument("--max-retries", type=int, default=4, help="Retries for 429/5xx/connection errors")
+    p.add_argument("--target-latency", type=float, default=5.0, help="Latency (s) above which concurrency backs off")
+    p.add_argument("--no-local-rules", action="store_true",
+                   help="Do not pre-check offers locally before /Validate (heuristic rules only ever warn)")
+    p.add_argument("--skip-known-shapes", action="store_true",
+                   help="Skip /Validate for offers that pass local rules and whose structure already passed remotely")
+    p.add_argument("--ledger", help="SQLite ledger; offers already validated/submitted unchanged are skipped")
+    p.add_argument("--stats", help="Write controller metrics (concurrency, retries, latency percentiles) as JSON")
+    p.add_argument("--results", help="Bulk mode: write per-offer results (with responses) as JSONL")
+    p.add_argument("--gzip", choices=GZIP_MODES, default="off",
+                   help="Compress request bodies: on always; auto probes with Validate, falls back to plain "
+                        "on 415, and compresses Submit only once a gzip Validate has succeeded")
+    p.add_argument("--drop-empty", action="store_true", help="Do not send optional fields whose value is empty")
+    metrics.add_arguments(p)
+    offer_profile.add_arguments(p)
     return p
 
-def main():
-    args = build_parser().parse_args()
-
+async def submit_single(args, client: CricosClient, ledger: Optional[OfferLedger]):
     offer = load_offer(args.file)
     pretty("LOADED OFFER", offer)
 
-    token = get_token(args.base)
+    key = offer_hash(offer)
+    entry = ledger.lookup(key) if ledger else None
+    if ledger and (ledger.is_submitted(entry) or (args.no_submit and ledger.is_validated(entry))):
+        metrics.info(f"Offer {offer.get('OfferId')} unchanged and already "
+                     f"{'submitted' if ledger.is_submitted(entry) else 'validated'} (ledger), skipping")
+        return
+
+    need_validate = (args.validate or args.no_submit) and not (ledger and ledger.is_validated(entry))
+    if need_validate and not args.no_local_rules:
+        with metrics.stage("local_rules") as st:
+            violations = validate_offer(offer)
+            warnings = offer_warnings(offer) if not violations else []
+            st.outcome = "violations" if violations else "warnings" if warnings else "ok"
+        if violations:
+            pretty(f"LOCAL VALIDATION ({len(violations)} violation(s))", [{"path": p, "message": m} for p, m in violations])
+            return
+        if warnings:
+            metrics.warn("Local rule warnings (not blocking):" + "".join(f"\n - {p}: {m}" for p, m in warnings))
+        elif args.skip_known_shapes and ledger and ledger.shape_passed(offer_shape(offer)):
+            metrics.info("Offer structure already passed /Validate and local rules pass, skipping remote validate")
+            need_validate = False
+            if args.no_submit:
+                return
+
+    token = await client.get_token()
     pretty("ACCESS TOKEN", token[:8] + "...")
 
-    if args.validate or args.no_submit:
-        code_v, res_v = post_json(args.base, token, "/api/V1/StudentOffers/Validate", offer)
+    wire = client.encode(offer)   # 验证和提交发送同一份请求体
+    if need_validate:
+        code_v, res_v = await client.validate(wire)
         pretty(f"VALIDATE RESULT ({code_v})", res_v)
+        if ledger:
+            ledger.record_validate(key, offer.get("OfferId"), args.file, code_v, res_v)
+            if code_v < 400:
+                ledger.record_shape(offer_shape(offer))
         if args.no_submit or code_v >= 400:
+            report_wire(wire)
             return
 
-    code_s, res_s = post_json(args.base, token, "/api/V1/StudentOffers", offer)
+    code_s, res_s = await client.submit(wire)
     pretty(f"SUBMIT RESULT ({code_s})", res_s)
+    report_wire(wire)
+    if ledger:
+        ledger.record_submit(key, offer.get("OfferId"), args.file, code_s, res_s)
+
+def report_wire(wire):
+    sizes = wire.sizes()
+    metrics.info(f"Request body: {wire_summary(sizes['bytes_before'], sizes['bytes_after'])}", **sizes)
+
+async def run(args, controller: ApiController, ledger: Optional[OfferLedger]):
+    cache_path = None if args.no_token_cache else args.token_cache
+    async with make_client(args.base, cache_path, controller, args.gzip, args.drop_empty,
+                           args.username, args.password) as client:
+        if not args.bulk:
+            await submit_single(args, client, ledger)
+            return
+        results, elapsed = await run_bulk(client, args.bulk, validate=args.validate or args.no_submit,
+                                          submit=not args.no_submit, ledger=ledger,
+                                          local_rules=not args.no_local_rules, skip_known_shapes=args.skip_known_shapes)
+    print_bulk_table(results, elapsed)
+    report_controller(controller, args.stats)
+    if args.results:
+        with open(args.results,"w",encoding="utf-8") as f:
+            for r in results:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+def main():
+    args = build_parser().parse_args()
+    metrics.configure(args.log_level, args.log_format, args.metrics, service="submit")
+    offer_profile.start(args)
+    controller = ApiController(initial=max(1, args.concurrency), max_limit=max(1, args.concurrency, args.max_concurrency),
+                               max_retries=args.max_retries, target_latency=args.target_latency)
+
+    ledger = OfferLedger(args.ledger) if args.ledger else None
+    try:
+        asyncio.run(run(args, controller, ledger))
+    except CricosError as e:
+        raise SystemExit(f"[ERROR] {e}")
+    finally:
+        if ledger:
+            ledger.close()
+        if args.stats and not args.bulk:
+            report_controller(controller, args.stats)
 
 if __name__ == "__main__":
     main()
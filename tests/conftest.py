@@ -0,0 +1,8 @@
+# tests/conftest.py
+# 仓库的模块都在根目录：直接运行 pytest（不经 python -m）时也能导入
+
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
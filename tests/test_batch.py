@@ -0,0 +1,162 @@
+# tests/test_batch.py
+# 批量生成：列式路径与逐条路径一致、CSV 行映射、账本缓存命中 / 未命中
+
+import copy, csv, json
+
+import pytest
+
+import bench_offer_pipeline as bench
+import compose_offer_robust as compose
+import offer_columnar
+from offer_ledger import OfferLedger
+
+CSV_HEADER = ["Are you?", "First Name", "Family Name", "Gender", "DOB", "Email", "Country of Birth",
+              "Nationality", "Passport No.", "Street Number", "Street Name", "Postcode", "Course",
+              "Residency/Visa proof "]
+
+def csv_row(**values):
+    row = dict.fromkeys(CSV_HEADER, "")
+    row.update(values)
+    return row
+
+def write_csv(path, rows):
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_HEADER)
+        writer.writeheader()
+        writer.writerows(rows)
+
+# ---------------- 列式 / 逐条 ----------------
+
+def test_columnar_matches_per_record():
+    configs = bench.config_pool(300)
+    columnar = offer_columnar.coerce_configs(copy.deepcopy(configs))
+    for config, (offer, issues, error) in zip(configs, columnar):
+        assert error is None
+        assert (offer, issues) == compose.coerce_student_offer_from_config(copy.deepcopy(config))
+
+def test_columnar_error_only_affects_its_row():
+    configs = bench.config_pool(3)
+    configs[1]["applied_courses"] = 5   # 不是列表
+    results = offer_columnar.coerce_configs(copy.deepcopy(configs))
+    assert results[0][2] is None and results[2][2] is None
+    with pytest.raises(type(results[1][2])):
+        compose.coerce_student_offer_from_config(copy.deepcopy(configs[1]))
+
+def test_config_chunk_matches_batch_items():
+    configs = bench.config_pool(50)
+    del configs[3]["offer_id"]
+    lines = [json.dumps(c, ensure_ascii=False) for c in configs]
+    lines[6] = "[1, 2]"
+    items = [(f"rows_{n:05d}", "json", line) for n, line in enumerate(lines, 1)]
+    chunk = compose.compose_config_chunk(items)
+    single = [compose.compose_batch_item(item) for item in items]
+    for a, b in zip(chunk, single):
+        a.pop("metrics", None)
+        b.pop("metrics", None)
+        assert a == b
+    assert chunk[6]["error"].startswith("ValueError: Expected a JSON object")
+
+def test_records_without_offer_id_get_distinct_ids():
+    config = {"student_info": {"first_name": "Li", "last_name": "Wang"}}
+    items = [(f"rows_{n:05d}", "json", json.dumps(config)) for n in range(1, 4)]
+    chunk = compose.compose_config_chunk(items)
+    ids = [r["offer"]["OfferId"] for r in chunk]
+    assert len(set(ids)) == 3
+    assert ids == [compose.compose_batch_item(item)["offer"]["OfferId"] for item in items]
+
+# ---------------- CSV ----------------
+
+def test_csv_row_to_config_maps_columns():
+    config, notes = compose.csv_row_to_config(csv_row(**{
+        "Are you?": "Overseas student currently in Australia", "First Name": " Anh ", "Family Name": "Nguyen",
+        "Street Number": "12", "Street Name": "Collins St", "Postcode": "3000",
+        "Course": "Diploma of Building and Construction (CPC50220)",
+    }))
+    assert notes == []
+    assert config["student_info"] == {"first_name": "Anh", "last_name": "Nguyen",
+                                      "student_origin": "OverseasStudentInAustralia"}
+    assert config["addresses"] == [{"street_number": "12", "street_name": "Collins St", "postcode": "3000",
+                                    "is_primary": True}]
+    assert config["applied_courses"] == [{"course_id": "CPC50220"}]
+    assert config["offer_id"].startswith("OFFER_")
+
+def test_csv_row_to_config_notes_unrecognised_values():
+    config, notes = compose.csv_row_to_config(csv_row(**{"Are you?": "Not sure", "Course": "Carpentry"}))
+    assert "applied_courses" not in config
+    assert "student_origin" not in config["student_info"]
+    assert len(notes) == 2
+
+def test_csv_row_offer_id_is_stable_and_distinct():
+    a = csv_row(**{"First Name": "Li"})
+    b = csv_row(**{"First Name": "Wei"})
+    assert compose.csv_row_to_config(a)[0]["offer_id"] == compose.csv_row_to_config(dict(a))[0]["offer_id"]
+    assert compose.csv_row_to_config(a)[0]["offer_id"] != compose.csv_row_to_config(b)[0]["offer_id"]
+
+def test_iter_csv_configs_strips_header_and_numbers_rows(tmp_path):
+    path = tmp_path / "apps.csv"
+    write_csv(path, [csv_row(**{"First Name": "Li"}), csv_row(**{"First Name": "Wei"})])
+    rows = list(compose.iter_csv_configs(str(path)))
+    assert [n for n, _, _ in rows] == [2, 3]
+    assert [c["student_info"]["first_name"] for _, c, _ in rows] == ["Li", "Wei"]
+
+    items = list(compose.collect_batch_items(str(path)))
+    assert [name for name, _, _ in items] == ["apps_00002", "apps_00003"]
+    result = compose.compose_batch_item(items[0])
+    assert result["error"] is None
+    assert result["offer"]["OfferId"] == rows[0][1]["offer_id"]
+
+# ---------------- 账本缓存 ----------------
+
+STALE_TIMESTAMP = "2000-01-01T00:00:00+10:00"
+
+def jsonl_items(configs):
+    return [(f"rows_{n:05d}", "json", json.dumps(c, ensure_ascii=False)) for n, c in enumerate(configs, 1)]
+
+@pytest.mark.parametrize("columnar", [True, False])
+def test_ledger_hit_reuses_offer_and_refreshes_now_fields(tmp_path, columnar):
+    configs = bench.config_pool(5)
+    for c in configs:
+        del c["timestamp"]   # TimeStamp 由当前时间生成
+    items = jsonl_items(configs)
+    with OfferLedger(str(tmp_path / "ledger.db")) as ledger:
+        first = list(compose.iter_batch_results(items, 1, ledger, columnar))
+        assert not any(r.get("cached") for r in first)
+        for r in first:
+            assert ["TimeStamp", "timestamp", 0] in r["now_fields"]
+            offer = dict(r["offer"], TimeStamp=STALE_TIMESTAMP)
+            ledger.put_composed(r["input_hash"], offer, r["issues"], r["now_fields"])
+
+        second = {r["source"]: r for r in compose.iter_batch_results(items, 1, ledger, columnar)}
+    for r in first:
+        hit = second[r["source"]]
+        assert hit["cached"] is True
+        assert hit["issues"] == r["issues"]
+        assert hit["offer"]["TimeStamp"] != STALE_TIMESTAMP
+        assert dict(hit["offer"], TimeStamp=None) == dict(r["offer"], TimeStamp=None)
+
+def test_ledger_miss_on_changed_input_or_composer_version(tmp_path, monkeypatch):
+    configs = bench.config_pool(3)
+    items = jsonl_items(configs)
+    with OfferLedger(str(tmp_path / "ledger.db")) as ledger:
+        for r in compose.iter_batch_results(items, 1, ledger):
+            ledger.put_composed(r["input_hash"], r["offer"], r["issues"], r["now_fields"])
+
+        configs[1]["student_info"]["first_name"] = "Changed"
+        results = {r["source"]: r for r in compose.iter_batch_results(jsonl_items(configs), 1, ledger)}
+        assert [results[name].get("cached", False) for name, _, _ in items] == [True, False, True]
+        assert results["rows_00002"]["offer"]["FirstName"] == "Changed"
+
+        monkeypatch.setattr(compose, "composer_version", lambda: "0" * 64)
+        assert not any(r.get("cached") for r in compose.iter_batch_results(items, 1, ledger))
+
+def test_run_batch_counts_unchanged_inputs(tmp_path):
+    source = tmp_path / "rows.jsonl"
+    source.write_text("\n".join(json.dumps(c) for c in bench.config_pool(4)) + "\n", encoding="utf-8")
+    ledger = str(tmp_path / "ledger.db")
+    out = str(tmp_path / "out.jsonl")
+    first = compose.run_batch(str(source), out, 1, ledger_path=ledger)
+    second = compose.run_batch(str(source), out, 1, ledger_path=ledger)
+    assert (first["succeeded"], first["unchanged"]) == (4, 0)
+    assert (second["succeeded"], second["unchanged"]) == (4, 4)
+    with open(out, encoding="utf-8") as f:
+        assert len(f.read().splitlines()) == 4
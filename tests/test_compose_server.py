@@ -0,0 +1,89 @@
+# tests/test_compose_server.py
+# 常驻生成服务的正常与错误响应
+
+import http.client, json, threading
+
+import pytest
+
+import compose_offer_robust as compose
+
+CONFIG = {"offer_id": "OFFER_SERVER", "student_info": {"first_name": "Li", "last_name": "Wang"}}
+
+@pytest.fixture
+def server():
+    server = compose.build_compose_server("127.0.0.1", 0, max_concurrency=1, queue_timeout=0.1, max_body=4096)
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def request(server, method, path, body=b"", headers=None):
+    """返回 (状态码, 响应 JSON)；headers 中的 Content-Length 原样发送"""
+    conn = http.client.HTTPConnection(*server.server_address, timeout=5)
+    try:
+        conn.putrequest(method, path)
+        headers = dict(headers or {})
+        headers.setdefault("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            conn.putheader(name, value)
+        conn.endheaders(body)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+def post_json(server, payload):
+    return request(server, "POST", "/compose", json.dumps(payload).encode("utf-8"),
+                   {"Content-Type": "application/json"})
+
+def test_compose_config(server):
+    status, payload = post_json(server, {"config": CONFIG})
+    assert status == 200
+    assert payload["offer"]["OfferId"] == "OFFER_SERVER"
+    assert server.compose_stats["served"] == 1
+
+def test_compose_raw_yaml(server):
+    status, payload = request(server, "POST", "/compose", b"student_info:\n  first_name: Li\n")
+    assert status == 200
+    assert payload["offer"]["FirstName"] == "Li"
+
+def test_health(server):
+    status, payload = request(server, "GET", "/health")
+    assert status == 200
+    assert payload["status"] == "ok"
+
+@pytest.mark.parametrize("method,path", [("GET", "/nope"), ("POST", "/nope")])
+def test_unknown_path(server, method, path):
+    assert request(server, method, path)[0] == 404
+
+@pytest.mark.parametrize("length", ["abc", "-5"])
+def test_invalid_content_length(server, length):
+    status, payload = request(server, "POST", "/compose", b"", {"Content-Length": length})
+    assert status == 400
+    assert "Content-Length" in payload["error"]
+
+def test_body_too_large(server):
+    status, payload = request(server, "POST", "/compose", b"x" * 5000)
+    assert status == 413
+    assert "4096" in payload["error"]
+
+@pytest.mark.parametrize("body,message", [
+    (b"", "empty"),
+    (b"- a\n- b\n", "mapping"),
+    (json.dumps({"yaml_base64": "not base64!"}).encode(), "yaml_base64"),
+    (json.dumps({"other": 1}).encode(), "Expected one of"),
+])
+def test_bad_request_body(server, body, message):
+    status, payload = request(server, "POST", "/compose", body)
+    assert status == 400
+    assert message in payload["error"]
+    assert server.compose_stats["failed"] == 1
+
+def test_busy_server_rejects(server):
+    server.compose_slots.acquire()
+    try:
+        status, _ = post_json(server, {"config": CONFIG})
+    finally:
+        server.compose_slots.release()
+    assert status == 503
+    assert server.compose_stats["rejected"] == 1
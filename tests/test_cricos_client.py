@@ -0,0 +1,89 @@
+# tests/test_cricos_client.py
+# ApiController 重试与 Submit 幂等性：对本地 cricos_standin 替身发请求
+
+import asyncio, threading
+
+import pytest
+
+import cricos_standin
+from cricos_client import ApiController, CricosClient, OutcomeUnknown
+from offer_wire import WireBody
+
+OFFER = {"OfferId": "OFFER_TEST", "FirstName": "Li", "LastName": "Wang"}
+# 超过 offer_wire.GZIP_MIN_BYTES 的请求体才会压缩
+LARGE_OFFER = dict(OFFER, EmploymentHistoryList=[{"EmployerName": f"Employer {i}"} for i in range(100)])
+
+@pytest.fixture
+def standin():
+    """standin(**StandinState 参数) -> (base, state)；测试结束时关闭所有替身服务"""
+    servers = []
+
+    def start(**options):
+        options.setdefault("latency", "0")
+        options.setdefault("token_latency", "0")
+        state = cricos_standin.StandinState(retry_after=0, seed=1, **options)
+        server = cricos_standin.serve("127.0.0.1", 0, state)
+        threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}", state
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def run_client(base, action, max_retries=2, **options):
+    """在新事件循环中执行 await action(client)"""
+    controller = ApiController(initial=2, max_limit=2, max_retries=max_retries, backoff_base=0.01)
+
+    async def go():
+        async with CricosClient(base, "user", "secret", token_cache=None, controller=controller,
+                                **options) as client:
+            return await action(client)
+
+    return asyncio.run(go()), controller
+
+def counts(state, endpoint):
+    return state.snapshot()["counts"].get(endpoint, {})
+
+def test_validate_and_submit_succeed(standin):
+    base, state = standin()
+    result, _ = run_client(base, lambda c: c.validate_and_submit(OFFER))
+    assert (result["validate"], result["submit"]) == (200, 200)
+    assert result["submit_response"]["OfferId"] == "OFFER_TEST"
+    assert counts(state, "token") == {"200": 1}
+
+def test_validate_is_retried_on_server_error(standin):
+    base, state = standin(error_rate=1.0)
+    (code, _), controller = run_client(base, lambda c: c.validate(OFFER), max_retries=2)
+    assert code == 500
+    assert counts(state, "validate") == {"500": 3}
+    assert controller.counts["retries"] == 2
+
+def test_submit_is_not_resent_after_server_error(standin):
+    base, state = standin(error_rate=1.0)
+    with pytest.raises(OutcomeUnknown) as info:
+        run_client(base, lambda c: c.submit(OFFER), max_retries=3)
+    assert info.value.status == 500
+    assert counts(state, "submit") == {"500": 1}
+
+def test_submit_is_not_resent_after_timeout(standin):
+    base, state = standin(submit_latency="fixed:1")
+    with pytest.raises(OutcomeUnknown):
+        run_client(base, lambda c: c.submit(OFFER, timeout=0.2), max_retries=3)
+    # 请求体只到达过一次（替身在读取请求体时计数，不等响应发出）
+    assert state.snapshot()["request_bytes"]["submit"] == len(WireBody(OFFER).data)
+
+def test_submit_is_retried_when_throttled(standin):
+    base, state = standin(throttle_rate=1.0)
+    (code, _), controller = run_client(base, lambda c: c.submit(OFFER), max_retries=2)
+    assert code == 429
+    assert counts(state, "submit") == {"429": 3}
+    assert controller.counts["throttled"] == 3
+
+def test_gzip_auto_falls_back_when_rejected(standin):
+    base, state = standin(reject_gzip=True)
+    result, _ = run_client(base, lambda c: c.validate_and_submit(LARGE_OFFER), gzip="auto")
+    assert (result["validate"], result["submit"]) == (200, 200)
+    assert counts(state, "validate") == {"200": 1, "415": 1}
+    assert counts(state, "submit") == {"200": 1}